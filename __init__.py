@@ -1,21 +1,107 @@
+import asyncio
 import json
-import openai
-from utils import save_result_json, extract_mafia_vote, extract_outcome_vote, majority_mafia_vote, majority_winner_vote, score_mafias, score_winner, check_prediction_discrepancy
 
-from agent import get_agents
+import agent_config
+from engine import run_campaign
+from log_compaction import load_compact_corpus
+from pipeline import experiment_modes, fork_votes, play_stages, score_stages, new_scores as new_mode_scores
 
 
 """Initialization of model count and related parameters"""
 num_agents = 3
 num_rounds = 5
 run_id = 0
-
-
-"""Invoke the model"""
-llm_client = openai.OpenAI(
-    base_url="https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1",
-    api_key="EMPTY"
-)
+resume = True  # Skip games and stages already recorded in results/ (e.g. after a crash)
+max_concurrent_games = 8  # Games talking to the LLM server at once (1 = sequential)
+max_concurrent_runs = 4  # Runs held in memory at once
+vote_at_every_depth = False  # Also vote after rounds 1 .. num_rounds - 1, scored as "multy_agents@1", ...
+
+
+"""Stages of one game (see pipeline.py)
+Agent_1 and Agent_2 make the initial statement, identical across the two discussion modes.
+Each discussion mode then has its own discussion and voters, in parallel.
+This includes two different sets related to Agent_3:
+one concerning critical thinking, and the other related to devil (or devil’s advocate)
+The single_agent vote is agent_1's initial statement.
+"""
+stages = [
+    {
+        "name": "statement",
+        "kind": "statement",
+        "agents": ["agent_1_statement", "agent_2_statement"],
+        "reads": "multy_agents",
+        "writes": ["multy_agents", "multy_agents_devil"],
+        "fan_out": True
+    },
+    {
+        "name": "discussion multy_agents",
+        "kind": "discussion",
+        "agents": ["agent_1_discussion", "agent_2_discussion", "agent_3_discussion"],
+        "reads": "multy_agents",
+        "writes": ["multy_agents"],
+        "rounds": num_rounds
+    },
+    {
+        "name": "discussion multy_agents_devil",
+        "kind": "discussion",
+        "agents": ["agent_1_discussion", "agent_2_discussion", "agent_3_devil_discussion"],
+        "reads": "multy_agents_devil",
+        "writes": ["multy_agents_devil"],
+        "rounds": num_rounds
+    },
+    {
+        "name": "vote multy_agents",
+        "kind": "vote",
+        "agents": ["agent_1_vote", "agent_2_vote", "agent_3_vote"],
+        "reads": "multy_agents",
+        "writes": ["multy_agents"]
+    },
+    {
+        "name": "vote multy_agents_devil",
+        "kind": "vote",
+        "agents": ["agent_1_vote", "agent_2_vote", "agent_3_devil_vote"],
+        "reads": "multy_agents_devil",
+        "writes": ["multy_agents_devil"]
+    },
+    {
+        "name": "vote single_agent",
+        "kind": "copy_vote",
+        "source": "statement",
+        "index": 0,
+        "writes": ["single_agent"]
+    },
+    {
+        "name": "majority vote",
+        "kind": "majority",
+        "writes": ["multy_agents", "multy_agents_devil", "single_agent"]
+    },
+]
+
+"""Votes forked from the discussions after every shorter depth, reusing the discussion log"""
+if vote_at_every_depth:
+    stages += fork_votes(stages, "discussion multy_agents", "vote multy_agents")
+    stages += fork_votes(stages, "discussion multy_agents_devil", "vote multy_agents_devil")
+
+modes = experiment_modes(stages)
+
+
+"""Invoke the model
+Every call goes through the endpoint pool of agent_config.endpoints (endpoint_pool.py);
+set MAFIA_LLM_BASE_URLS to spread the games over several servers."""
+
+
+async def play_game(run_id, game_data, store):
+    """All LLM stages of one game, up to the majority vote"""
+    await play_stages(stages, run_id, game_data, store, resume=resume)
+
+
+def score_game(run_id, game_data, store, scores):
+    """Called by the engine in game order, once the game has been played"""
+    score_stages(modes, run_id, game_data, store, scores, resume=resume)
+
+
+def new_scores():
+    return new_mode_scores(modes)
 
 
 if __name__ == '__main__':
@@ -24,415 +110,14 @@ if __name__ == '__main__':
     with open('./mafia.json', "r") as f: # Read the game log file
         data = json.load(f)
 
-    for run_id in range(0, 50): # the number of repetitions
-
-        score_mult_mafias = score_mult_winner = \
-        score_devil_mafias = score_devil_winner = \
-        score_single_mafias = score_single_winner = 0
-
-        for game_data in data[:]: # Sequentially read the game log for each game
-
-            game_log = '\n'.join(game_data["log"])
-
-
-            """STATEMENT
-            Call agent_1 and agent_2 to make the initial statement"""
-            print("#", end='')
-            agent_1_statement = get_agents("agent_1_statement")[0]
-            agent_2_statement = get_agents("agent_2_statement")[0]
-
-            opinion_agent_1_statement = agent_1_statement.update(
-                run_id,
-                game_data["id"],
-                "multy_agents",
-                agent_1_statement.name,
-                game_log)
-
-            opinion_agent_2_statement = agent_2_statement.update(
-                run_id,
-                game_data["id"],
-                "multy_agents",
-                agent_2_statement.name,
-                game_log)
-
-
-            """Store the initial statement made by agent_1
-            
-            Since the initial statement is identical across the three modes
-            — multy_agents, multy_agents_devil —
-            it is recorded three times into separate sections.
-            
-            Note: The single_agent case will be evaluated.
-            """
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "log",
-                {"speaker": agent_1_statement.name, "message": opinion_agent_1_statement},
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "log",
-                {"speaker": agent_1_statement.name, "message": opinion_agent_1_statement},
-                game_id=game_data["id"])
-
-
-            """Store the initial statement made by agent_2
-
-            The initial statement is identical across the two modes
-            — multy_agents, multy_agents_devil —
-            it is recorded two times into separate sections.
-
-            Note: The single_agent case has already been evaluated.
-            """
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "log",
-                {"speaker": agent_2_statement.name, "message": opinion_agent_2_statement},
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "log",
-                {"speaker": agent_2_statement.name, "message": opinion_agent_2_statement},
-                game_id=game_data["id"])
-
-
-            """DISCUSSION 
-            Call agent_1, agent_2, and agent_3 to make the discussion
-            This includes two different sets related to Agent_3:
-            one concerning critical thinking, and the other related to devil (or devil’s advocate)
-            """
-            print("#", end='')
-            agents_discussion = get_agents(["agent_1_discussion", "agent_2_discussion", "agent_3_discussion"])
-            agents_devil_discussion = get_agents(["agent_1_discussion", "agent_2_discussion", "agent_3_devil_discussion"])
-
-            for i in range(num_rounds):
-
-                for agent in agents_discussion:
-
-                    opinion_agents_discussion = agent.update(
-                        run_id,
-                        game_data["id"],
-                        "multy_agents",
-                        agent.name,
-                        game_log)
-
-                    save_result_json(
-                        run_id,
-                        "multy_agents",
-                        "log",
-                        {"speaker": agent.name, "message": opinion_agents_discussion},
-                        game_id=game_data["id"])
-
-                for agent in agents_devil_discussion:
-
-                    opinion_agents_discussion = agent.update(
-                        run_id,
-                        game_data["id"],
-                        "multy_agents_devil",
-                        agent.name,
-                        game_log)
-
-                    save_result_json(
-                        run_id,
-                        "multy_agents_devil",
-                        "log",
-                        {"speaker": agent.name, "message": opinion_agents_discussion},
-                        game_id=game_data["id"])
-
-
-            """VOTING
-            
-            """
-            print("#", end='')
-            agent_1_vote = get_agents("agent_1_vote")[0]
-            agent_2_vote = get_agents("agent_2_vote")[0]
-            agent_3_vote = get_agents("agent_3_vote")[0]
-            agent_3_devil_vote = get_agents("agent_3_devil_vote")[0]
-
-
-            """MULTY VOTING PART"""
-            opinion_agent_1_vote = agent_1_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents",
-                agent_1_vote.name,
-                game_log)
-
-            opinion_agent_2_vote = agent_2_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents",
-                agent_2_vote.name,
-                game_log)
-
-            opinion_agent_3_vote = agent_3_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents",
-                agent_3_vote.name,
-                game_log)
-
-            """DEVIL VOTING PART"""
-            opinion_agent_1_devil_vote = agent_1_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents_devil",
-                agent_1_vote.name,
-                game_log)
-
-            opinion_agent_2_devil_vote = agent_2_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents_devil",
-                agent_2_vote.name,
-                game_log)
-
-            opinion_agent_3_devil_vote = agent_3_devil_vote.update(
-                run_id,
-                game_data["id"],
-                "multy_agents_devil",
-                agent_3_devil_vote.name,
-                game_log)
-
-            """RECORD MULTY VOTING PART"""
-            print("#", end='')
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "vote",
-                {
-                    "speaker": agent_1_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_1_vote),
-                    "winner": extract_outcome_vote(opinion_agent_1_vote),
-                    "reason": opinion_agent_1_vote,
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "vote",
-                {
-                    "speaker": agent_2_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_2_vote),
-                    "winner": extract_outcome_vote(opinion_agent_2_vote),
-                    "reason": opinion_agent_2_vote,
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "vote",
-                {
-                    "speaker": agent_3_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_3_vote),
-                    "winner": extract_outcome_vote(opinion_agent_3_vote),
-                    "reason": opinion_agent_3_vote,
-                },
-                game_id=game_data["id"])
-
-            """RECORD DEVIL VOTING PART"""
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "vote",
-                {
-                    "speaker": agent_1_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_1_devil_vote),
-                    "winner": extract_outcome_vote(opinion_agent_1_devil_vote),
-                    "reason": opinion_agent_1_devil_vote,
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "vote",
-                {
-                    "speaker": agent_2_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_2_devil_vote),
-                    "winner": extract_outcome_vote(opinion_agent_2_devil_vote),
-                    "reason": opinion_agent_2_devil_vote,
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "vote",
-                {
-                    "speaker": agent_3_devil_vote.name,
-                    "mafias": extract_mafia_vote(opinion_agent_3_devil_vote),
-                    "winner": extract_outcome_vote(opinion_agent_3_devil_vote),
-                    "reason": opinion_agent_3_devil_vote,
-                },
-                game_id=game_data["id"])
-
-            """RECORD SINGLE VOTING PART"""
-            save_result_json(
-                run_id,
-                "single_agent",
-                "vote",
-                {
-                    "speaker": agent_1_statement.name,
-                    "mafias": extract_mafia_vote(opinion_agent_1_statement),
-                    "winner": extract_outcome_vote(opinion_agent_1_statement),
-                    "reason": opinion_agent_1_statement,
-                },
-                game_id=game_data["id"])
-
-
-            """MAJORITY VOTE
-
-            """
-            print("#", end='')
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "pred",
-                {
-                    "mafias": majority_mafia_vote(run_id, game_data["id"], "multy_agents"),
-                    "winner": majority_winner_vote(run_id, game_data["id"], "multy_agents")
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "pred",
-                {
-                    "mafias": majority_mafia_vote(run_id, game_data["id"], "multy_agents_devil"),
-                    "winner": majority_winner_vote(run_id, game_data["id"], "multy_agents_devil")
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "single_agent",
-                "pred",
-                {
-                    "mafias": majority_mafia_vote(run_id, game_data["id"], "single_agent"),
-                    "winner": majority_winner_vote(run_id, game_data["id"], "single_agent")
-                },
-                game_id=game_data["id"])
-
-
-            """SCORING
-
-            """
-            print("#", end='')
-            """True result saving"""
-            true_mafias = [agent["name"] for agent in game_data["agents"] if agent["role"] == "mafioso"]
-            true_winner = ("mafia") if game_data["win"] == "mafioso" else "bystander"
-
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "true",
-                {
-                    "true mafias": true_mafias,
-                    "true winner": true_winner
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "true",
-                {
-                    "true mafias": true_mafias,
-                    "true winner": true_winner
-                },
-                game_id=game_data["id"])
-
-            save_result_json(
-                run_id,
-                "single_agent",
-                "true",
-                {
-                    "true mafias": true_mafias,
-                    "true winner": true_winner
-                },
-                game_id=game_data["id"])
-
-            """Scoring"""
-            score_mult_mafias += score_mafias(run_id, game_data["id"], "multy_agents")
-            score_mult_winner += score_winner(run_id, game_data["id"], "multy_agents")
-
-            score_devil_mafias += score_mafias(run_id, game_data["id"], "multy_agents_devil")
-            score_devil_winner += score_winner(run_id, game_data["id"], "multy_agents_devil")
-
-            score_single_mafias += score_mafias(run_id, game_data["id"], "single_agent")
-            score_single_winner += score_winner(run_id, game_data["id"], "single_agent")
-
-            # multy_agents
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "score_mafias",
-                score_mult_mafias,
-                game_id=game_data["id"]
-            )
-
-            save_result_json(
-                run_id,
-                "multy_agents",
-                "score_winner",
-                score_mult_winner,
-                game_id=game_data["id"]
-            )
-
-            # multy_agents_devil
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "score_mafias",
-                score_devil_mafias,
-                game_id=game_data["id"]
-            )
-
-            save_result_json(
-                run_id,
-                "multy_agents_devil",
-                "score_winner",
-                score_devil_winner,
-                game_id=game_data["id"]
-            )
-
-            # single_agent
-            save_result_json(
-                run_id,
-                "single_agent",
-                "score_mafias",
-                score_single_mafias,
-                game_id=game_data["id"]
-            )
-
-            save_result_json(
-                run_id,
-                "single_agent",
-                "score_winner",
-                score_single_winner,
-                game_id=game_data["id"]
-            )
-
-
-
-            print("Scores:")
-            print(f"  multy_agents      - mafias: {score_mult_mafias}, winner: {score_mult_winner}")
-            print(f"  multy_agents_devil - mafias: {score_devil_mafias}, winner: {score_devil_winner}")
-            print(f"  single_agent       - mafias: {score_single_mafias}, winner: {score_single_winner}")
-
-            check_prediction_discrepancy(run_id, game_data["id"])
-
-
-
-
-
+    if agent_config.game_log_format == "compact":
+        load_compact_corpus(data)  # built once per corpus, then read from cache/compact_logs/
+
+    asyncio.run(run_campaign(
+        range(0, 50), # the number of repetitions
+        data[:],
+        play_game,
+        score_game,
+        new_scores,
+        max_concurrent_games=max_concurrent_games,
+        max_concurrent_runs=max_concurrent_runs))
@@ -1,12 +1,22 @@
 """Module for the Agent class"""
 
-from tenacity import retry, wait_fixed, retry_if_exception_type, stop_never
-from dataclasses import dataclass, field
-from agent_config import llm_client, agent_configs
-from utils import format_opinion
-import os
-import json
+from tenacity import AsyncRetrying, Retrying
+import asyncio
 import openai
+from collections import Counter
+from dataclasses import dataclass, field
+import time
+import uuid
+import agent_config
+import hedging
+import streaming
+from agent_config import agent_configs, completion_cache
+from fan_out import asample
+from context_policy import fit_budget, select_turns, summary_due, summary_request
+from conversation import Conversation, text_message
+from resilience import retry_policy
+from tracing import span
+from utils import format_opinion, load_game_data, save_result_json
 
 
 def get_agents(ids=None):
@@ -44,77 +54,325 @@ class Agent:
     history: list[str] = field(default_factory=list)
     latest_opinion: str = ""
     output_schema: type = None
+    latest_usage: dict = field(default_factory=dict)
+    remainder: object = None  # task reading the rest of an early answer (see aupdate)
 
-    """Prevent process termination caused by server unresponsiveness"""
-    @retry(
-        wait=wait_fixed(120),
-        stop=stop_never,
-        retry=retry_if_exception_type(openai.InternalServerError)
-    )
+    def build_messages(self, run_id, game_id, mode, agent_name, game_log, store=None) -> list[dict]:
+        """
+        Build the chat messages of one call, in the agent_config.message_layout order.
 
+        identity_first: identity reminder, prompt, game log and the conversation so far,
+                        where the agent itself is 'assistant' and others are 'user'.
+        shared_prefix:  game log and the conversation so far, every turn as 'speaker:content'
+                        from 'user', then the prompt and the identity reminder.
 
-    def update(self, run_id, game_id, mode, agent_name, game_log) -> str:
-        """
-        run_id: File name (without extension)
-        game_id: Unique ID for the current game
-        agent_name: Name of the current agent
-        mode: E"multy_agents" or "single_agent"
-        game_log: Description string of the game
+        The conversation is cut down by agent_config.context_policy and the whole request
+        by agent_config.max_prompt_tokens (see context_policy.py).
         """
 
-        # 1. Construct the messages (identity reminder, prompt, and game log)
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": f"You are{self.name}"}]},
-            {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
-            {"role": "system", "content": [{"type": "text", "text": game_log}]},
-        ]
+        # 1. Take the conversation of (game_id, mode) from the result store, or rebuild it from the result file
+        conversation = self.conversation(run_id, game_id, mode, store)
 
-        # 2. Load the log from the JSON file using game_id and mode as keys
-        if os.path.exists(f"results/{run_id}_result.json"):
-            with open(f"results/{run_id}_result.json", "r", encoding="utf-8") as f:
-                all_data = json.load(f)
-                game_data = all_data.get(game_id, {})
-                log_entries = game_data.get(mode, {}).get("log", [])
-        else:
-            log_entries = []
-
-        # 3. Separate the conversation history by role: the agent itself is 'assistant', others are 'user'
-        for entry in log_entries:
-            speaker = entry.get("speaker", "")
-            content = entry.get("message", "")
-
-            if speaker == agent_name:
-                role = "assistant"
-                messages.append({
-                    "role": role,
-                    "content": [{"type": "text", "text": content}]
-                })
-            else:
-                role = "user"
-                messages.append({
-                    "role": role,
-                    "content": [{"type": "text", "text": f'{speaker}:{content}'}]
-                })
-
-        # 4. Call the LLM and set the output format
+        identity = text_message("system", f"You are{self.name}")
+        prompt = text_message("system", self.system_prompt)
+
+        if agent_config.message_layout == "shared_prefix":
+            turns = select_turns(conversation)
+            log, turns = fit_budget([prompt, identity], text_message("system", game_log), turns)
+            return [log, *turns, prompt, identity]
+
+        if agent_config.message_layout != "identity_first":
+            raise ValueError(f"Unsupported message layout: {agent_config.message_layout}")
+
+        # 2. Identity reminder, prompt, and game log, then the conversation where the agent itself is 'assistant', others are 'user'
+        turns = select_turns(conversation, agent_name)
+        log, turns = fit_budget([identity, prompt], text_message("system", game_log), turns)
+        return [identity, prompt, log, *turns]
+
+    def conversation(self, run_id, game_id, mode, store=None) -> Conversation:
+        if store is not None:
+            return store.conversation(game_id, mode)
+        return Conversation.from_section(load_game_data(run_id, game_id).get(mode, {}))
+
+    def save_summary(self, run_id, game_id, mode, conversation, end, summarizer, store=None):
+        """Cache the new rolling summary in the conversation and store it with its usage."""
+        conversation.summary = summarizer.latest_opinion
+        conversation.summarized = end
+        save_result_json(
+            run_id,
+            mode,
+            "summary",
+            {"turns": end, "summary": conversation.summary, "usage": summarizer.latest_usage},
+            game_id=game_id,
+            store=store)
+
+    def refresh_summary(self, run_id, game_id, mode, store=None):
+        """Fold the older turns into the rolling summary when the "summary" context policy asks for it."""
+        conversation = self.conversation(run_id, game_id, mode, store)
+        due = summary_due(conversation)
+        if due is None:
+            return
+
+        summarizer = Agent(**agent_config.summarizer_config)
+        summarizer.complete(run_id, mode, summary_request(conversation, *due), affinity=game_id)
+        self.save_summary(run_id, game_id, mode, conversation, due[1], summarizer, store)
+
+    async def arefresh_summary(self, run_id, game_id, mode, store=None):
+        """Asynchronous version of refresh_summary; one summary per (game, mode) at a time."""
+        conversation = self.conversation(run_id, game_id, mode, store)
+
+        async with conversation.summary_lock:
+            due = summary_due(conversation)
+            if due is None:
+                return
+
+            summarizer = Agent(**agent_config.summarizer_config)
+            with span("summary", "llm", mode=mode, turns=due[1]):
+                await summarizer.acomplete(run_id, mode, summary_request(conversation, *due), affinity=game_id)
+            self.save_summary(run_id, game_id, mode, conversation, due[1], summarizer, store)
+
+    def cache_key(self, run_id, mode, messages) -> str:
+        """
+        Key of this call in the completion cache. run_id and mode tell apart sampled
+        repetitions of a byte-identical request (e.g. the first discussion turn of both modes).
+        None when the cache is off, so the messages are not serialized for nothing.
+        """
+        if completion_cache.mode == "off":
+            return None
+        return completion_cache.key(self.model, self.temperature, messages, self.output_schema, sample=f"{run_id}/{mode}")
+
+    def read_completion(self, completion) -> str:
+        """Store the latest opinion from a completion and return it formatted."""
         if self.output_schema:
-            completion = llm_client.beta.chat.completions.parse(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                response_format=self.output_schema,
-            )
             parsed = completion.choices[0].message.parsed
             self.latest_opinion = parsed
             return f"{format_opinion(str(parsed))}"
         else:
-            completion = llm_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-            )
             content = completion.choices[0].message.content.strip()
             self.latest_opinion = content
             return f"{format_opinion(content)}"
 
+    def read_cached(self, record) -> str:
+        """Same as read_completion, for a completion served from the cache."""
+        if self.output_schema:
+            parsed = self.output_schema.model_validate_json(record["content"])
+            self.latest_opinion = parsed
+            return f"{format_opinion(str(parsed))}"
+        else:
+            content = record["content"].strip()
+            self.latest_opinion = content
+            return f"{format_opinion(content)}"
+
+    def cache_record(self, completion) -> dict:
+        """
+        The completion cache record of a live call. A structured answer is stored as its parsed
+        fields, so an answer salvaged from a cut-off reply (see streaming.py) reads back as it was used.
+        """
+        message = completion.choices[0].message
+        parsed = getattr(message, "parsed", None)
+        content = parsed.model_dump_json() if self.output_schema and parsed is not None else message.content
+        return {"content": content, "usage": self.latest_usage}
+
+    def read_usage(self, completion, latency, first_started, attempts, extra) -> dict:
+        """
+        Accounting of one live call, stored with the log / vote entry it produced.
+        latency is the successful request; retry_seconds the time lost before it;
+        extra_requests and discarded_tokens the load added by hedging (see hedging.py);
+        ttft the seconds to the first token of a streamed answer (see streaming.py).
+        """
+        usage = completion.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "call_id": uuid.uuid4().hex,
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "cached_tokens": getattr(details, "cached_tokens", None),
+            "completion_tokens": usage.completion_tokens if usage else None,
+            "latency": round(latency, 3),
+            "attempts": attempts,
+            "retry_seconds": round(time.perf_counter() - first_started - latency, 3),
+            "extra_requests": extra["requests"],
+            "discarded_tokens": extra["discarded_tokens"],
+            "ttft": round(completion.ttft, 3) if getattr(completion, "ttft", None) is not None else None,
+            "cached": False,
+        }
+
+    def read_cached_usage(self, record) -> dict:
+        """
+        Accounting of a call served from the completion cache: recorded tokens, no latency,
+        with the same keys as read_usage.
+        """
+        usage = record.get("usage", {})
+        return {
+            "call_id": uuid.uuid4().hex,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "cached_tokens": usage.get("cached_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "latency": 0.0,
+            "attempts": 0,
+            "retry_seconds": 0.0,
+            "extra_requests": 0,
+            "discarded_tokens": 0,
+            "ttft": None,
+            "cached": True,
+        }
 
+    def update(self, run_id, game_id, mode, agent_name, game_log, store=None) -> str:
+        """
+        run_id: File name (without extension)
+        game_id: Unique ID for the current game
+        agent_name: Name of the current agent
+        mode: E"multy_agents" or "single_agent"
+        game_log: Description string of the game
+        store: Optional ResultStore of the run, read instead of the result file
+
+        The accounting of the call (tokens, latency, attempts) is kept in latest_usage.
+        """
+
+        self.refresh_summary(run_id, game_id, mode, store)
+        messages = self.build_messages(run_id, game_id, mode, agent_name, game_log, store)
+        return self.complete(run_id, mode, messages, affinity=game_id)
+
+    def complete(self, run_id, mode, messages, affinity=None) -> str:
+        """
+        Answer a list of chat messages, from the completion cache if possible.
+        affinity (the game id) keeps the calls of a game on one endpoint of the pool.
+        """
+
+        # 4. Serve the call from the completion cache if possible
+        key = self.cache_key(run_id, mode, messages)
+        cached = completion_cache.lookup(key)
+        if cached is not None:
+            self.latest_usage = self.read_cached_usage(cached)
+            return self.read_cached(cached)
+
+        # 5. Call the LLM and set the output format; errors of the server are retried (see resilience.py)
+        #    and unusable answers re-issued when agent_config.hedging is on (see hedging.py)
+        first_started = time.perf_counter()
+        extra = Counter()
+        for attempt in Retrying(**retry_policy()):
+            with attempt:
+                completion, endpoint, latency = hedging.completion(
+                    lambda endpoint: self.send(endpoint, messages), affinity, self.call_kind(), bool(self.output_schema), extra)
+
+        self.latest_usage = self.read_usage(completion, latency, first_started, attempt.retry_state.attempt_number, extra)
+        completion_cache.store(key, self.cache_record(completion))
+        return self.read_completion(completion)
+
+    async def aupdate(self, run_id, game_id, mode, agent_name, game_log, store=None, early=False, fan_out=False) -> str:
+        """
+        Asynchronous version of update, sharing the async client so that several
+        games can wait on the LLM server at the same time. Same arguments as update.
+
+        early: With agent_config.streaming and an output_schema holding mafias and game_outcome,
+        return as soon as both are streamed, with an empty reason. The rest of the answer is
+        then read by self.remainder, a task returning the full opinion (None otherwise).
+
+        fan_out: The request is the same in every run (a statement), so with
+        agent_config.fan_out_samples > 1 it is shared by a block of runs (see fan_out.py).
+        """
+
+        await self.arefresh_summary(run_id, game_id, mode, store)
+        with span("build messages", "cpu", agent=self.id, mode=mode):
+            messages = self.build_messages(run_id, game_id, mode, agent_name, game_log, store)
+
+        self.remainder = None
+        if not (early and agent_config.streaming and self.output_schema):
+            return await self.acomplete(run_id, mode, messages, affinity=game_id, fan_out=fan_out)
+
+        fields = asyncio.get_running_loop().create_future()
+
+        def on_fields(values):
+            if not fields.done():
+                fields.set_result(values)
+
+        task = asyncio.create_task(self.acomplete(run_id, mode, messages, affinity=game_id, on_fields=on_fields, fan_out=fan_out))
+        await asyncio.wait([fields, task], return_when=asyncio.FIRST_COMPLETED)
+        if task.done() or not fields.done():
+            return await task
+
+        self.remainder = task
+        self.latest_usage = {}  # known once the remainder is read
+        return f"{format_opinion(str(self.output_schema.model_construct(**fields.result(), reason='')))}"
+
+    async def acomplete(self, run_id, mode, messages, affinity=None, on_fields=None, fan_out=False) -> str:
+        """
+        Asynchronous version of complete.
+        on_fields: Callback of the early fields of a streamed answer (see streaming.py);
+        such a call is neither hedged nor re-issued, as its fields may already be recorded.
+        fan_out: Take the sample of this run from a request shared by a block of runs (see fan_out.py).
+        """
+
+        key = self.cache_key(run_id, mode, messages)
+        cached = completion_cache.lookup(key)
+        if cached is not None:
+            self.latest_usage = self.read_cached_usage(cached)
+            return self.read_cached(cached)
+
+        if fan_out and agent_config.fan_out_samples > 1:
+            record = await asample(self, run_id, mode, messages, affinity)
+            if record is not None:
+                self.latest_usage = record["usage"]
+                return self.read_cached(record)
+
+        first_started = time.perf_counter()
+        extra = Counter()
+        async for attempt in AsyncRetrying(**retry_policy()):
+            with attempt, span("llm call", "llm", agent=self.id, mode=mode, messages=len(messages)) as trace:
+                completion, endpoint, latency = await hedging.acompletion(
+                    lambda endpoint: self.asend(endpoint, messages, on_fields), affinity, self.call_kind(),
+                    bool(self.output_schema), extra, hedge=on_fields is None)
+                trace["endpoint"] = endpoint.url
+
+        self.latest_usage = self.read_usage(completion, latency, first_started, attempt.retry_state.attempt_number, extra)
+        completion_cache.store(key, self.cache_record(completion))
+        return self.read_completion(completion)
+
+    def call_kind(self) -> str:
+        """Kind of call whose recent latencies set the hedge delay."""
+        return self.output_schema.__name__ if self.output_schema else "text"
+
+    def send(self, endpoint, messages, on_fields=None):
+        """One chat completion request to an endpoint of the pool, parsed into output_schema if set."""
+        if agent_config.streaming:
+            return streaming.stream(
+                endpoint.client, self.model, messages, self.temperature, self.output_schema, on_fields)
+        if self.output_schema:
+            try:
+                return endpoint.client.beta.chat.completions.parse(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format=self.output_schema,
+                    **streaming.request_options(),
+                )
+            except openai.LengthFinishReasonError as e:
+                return streaming.salvage_completion(self.output_schema, e.completion)
+        return endpoint.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            **streaming.request_options(),
+        )
+
+    async def asend(self, endpoint, messages, on_fields=None):
+        """Asynchronous version of send."""
+        if agent_config.streaming:
+            return await streaming.astream(
+                endpoint.async_client, self.model, messages, self.temperature, self.output_schema, on_fields)
+        if self.output_schema:
+            try:
+                return await endpoint.async_client.beta.chat.completions.parse(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format=self.output_schema,
+                    **streaming.request_options(),
+                )
+            except openai.LengthFinishReasonError as e:
+                return streaming.salvage_completion(self.output_schema, e.completion)
+        return await endpoint.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            **streaming.request_options(),
+        )
@@ -2,18 +2,86 @@
 Used for configuring parameters for agents
 """
 from pathlib import Path
-import openai
-from agent_schema import AgentConclude, AgentDiscussion, AgentVote
+import os
+from agent_schema import AgentConclude, AgentDiscussion, AgentVote, AgentPositions
+from llm_cache import CompletionCache
 
 model_type = "Qwen/Qwen2.5-72B-Instruct"
-base_url = "https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1"
+base_url = os.environ.get("MAFIA_LLM_BASE_URL", "https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1")  # e.g. a local mock_server.py
 default_temperature = 2.0
 prompt_dir = Path("./data/mafia/prompt_keyword")
 
-llm_client = openai.OpenAI(
-    base_url="https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1",
-    api_key="EMPTY"
-)
+"""Retry, timeout and circuit-breaker policy of the LLM calls (see resilience.py)"""
+request_timeout = 300.0  # seconds per request, set on the clients of every endpoint
+retry_initial_wait = 1.0  # exponential backoff with jitter: 1, 2, 4, ... seconds
+retry_max_wait = 120.0
+retry_jitter = 1.0
+retry_max_attempts = None  # None: retry until the server answers
+breaker_failure_threshold = 5  # consecutive failures that take an endpoint out for breaker_cooldown seconds
+breaker_cooldown = 60.0
+
+"""Inference endpoints (see endpoint_pool.py); MAFIA_LLM_BASE_URLS="http://node1/v1,http://node2/v1" adds GPU nodes"""
+endpoints = os.environ.get("MAFIA_LLM_BASE_URLS", base_url).split(",")
+routing = "least_outstanding"  # or "latency"
+affinity_slack = 4  # requests a game's endpoint may be busier than the least loaded one before the game moves
+health_check_interval = 30.0
+
+"""Hedged requests (see hedging.py): duplicate slow requests, re-issue unusable answers"""
+hedging = False
+hedge_percentile = 95  # a request slower than this percentile of its kind gets a duplicate
+hedge_min_samples = 20  # latencies needed before the first hedge
+hedge_min_delay = 1.0  # seconds, never hedge earlier than this
+max_completion_chars = 4000  # longer answers are re-issued
+max_reissues = 2
+
+"""Streaming (see streaming.py): time to first token, early votes and a max-token guard"""
+streaming = False
+early_votes = False  # with streaming, record a vote once mafias and game_outcome are streamed; its reason follows
+max_completion_tokens = None  # cap on the tokens of an answer, e.g. 1024 against runaway generations
+
+"""Statements shared by consecutive runs (see fan_out.py): one request with n samples serves fan_out_samples runs; 1 = off"""
+fan_out_samples = 1
+
+"""Convergence-based early stopping of the discussions (see convergence.py)"""
+early_stopping = False  # go straight to the votes once every speaker holds the same mafias and game outcome
+min_discussion_rounds = 0  # rounds always played; 0 also lets agreeing statements skip the discussion
+
+def connect(urls):
+    """Point every LLM call at other OpenAI-compatible servers (e.g. mock_server.py)."""
+    global base_url, endpoints
+    endpoints = [urls] if isinstance(urls, str) else list(urls)
+    base_url = endpoints[0]
+
+
+"""Completion cache: "off", "record" (fill the cache) or "replay" (run offline, fail on a miss)"""
+cache_mode = "off"
+cache_dir = Path("./cache/completions")
+cache_max_bytes = 2 * 1024 ** 3
+
+completion_cache = CompletionCache(cache_dir, cache_mode, cache_max_bytes)
+
+
+"""Message layout of Agent.build_messages
+"identity_first": identity reminder, prompt, game log, then the conversation with the agent as 'assistant'
+"shared_prefix":  game log and conversation first, byte-identical for every agent and turn of a game,
+                  so the server's prefix (KV) cache can reuse them; prompt and identity reminder last
+"""
+message_layout = "identity_first"
+
+"""game_log sent to the agents: "raw" (the mafia.json lines) or "compact" (see log_compaction.py)"""
+game_log_format = "raw"
+
+
+"""Context policy of Agent.build_messages (see context_policy.py)
+"full":    the whole conversation
+"window":  the last context_window turns
+"summary": a rolling summary of the older turns, refreshed every summary_interval turns, then the last turns
+"""
+context_policy = "full"
+context_window = 6
+summary_interval = 6
+max_prompt_tokens = 30000  # budget per request; Qwen2.5-72B-Instruct serves 32k
+prompt_token_margin = 0.15  # share of max_prompt_tokens kept free: prompt sizes are estimated (about four characters per token), not tokenized
 
 
 def load_prompt(prompt_dir, file_name: str) -> str:
@@ -137,4 +205,32 @@ agent_configs = [
 ]
 
 
+"""Agent writing the rolling summary of the "summary" context policy"""
+summarizer_config = {
+    "id": "summarizer",
+    "name": "Summarizer",
+    "model": model_type,
+    "temperature": 0.0,
+    "system_prompt": (
+        "You keep the notes of a Mafia game discussion. Merge the summary so far with the new "
+        "discussion turns into one updated summary: who suspects whom and why, who defended whom, "
+        "and how each speaker's opinion changed. Keep every player name exactly as written. "
+        "Answer with the summary only, in at most 200 words."
+    ),
+}
+
 
+"""Agent reading the position of every turn of a discussion round, for early stopping"""
+extractor_config = {
+    "id": "extractor",
+    "name": "Extractor",
+    "model": model_type,
+    "temperature": 0.0,
+    "system_prompt": (
+        "You read the turns of a Mafia game discussion. For every turn, in the order given, report "
+        "the players the speaker currently believes are the mafias and whether the speaker thinks the "
+        "mafia or the bystanders won. Keep every player name exactly as written; if a turn does not "
+        "change the speaker's mind, repeat the position the speaker held before."
+    ),
+    "output_schema": AgentPositions
+}
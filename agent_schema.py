@@ -9,6 +9,8 @@ import typing
 AgentConclude: Perform initial analysis and summary based on the game dialogue log.
 AgentDiscussion: Discuss based on the game log and the first round of reasoning.
 AgentVote: Decide which group won, identify the mafias, and provide reasoning.
+
+AgentPositions: The position taken in each turn of a discussion round (see convergence.py).
 """
 class AgentConclude(BaseModel):
     mafias: list[str]
@@ -21,4 +23,11 @@ class AgentDiscussion(BaseModel):
 class AgentVote(BaseModel):
     mafias: list[str]
     game_outcome: typing.Literal['mafia', 'bystander']
-    reason: str
\ No newline at end of file
+    reason: str
+
+class AgentPosition(BaseModel):
+    mafias: list[str]
+    game_outcome: typing.Literal['mafia', 'bystander']
+
+class AgentPositions(BaseModel):
+    positions: list[AgentPosition]
@@ -0,0 +1,466 @@
+"""
+Benchmark suite for the experiment pipeline.
+
+Runs the __init__.py and vote_only_test.py pipelines end-to-end against the local
+mock LLM server (mock_server.py) on synthetic games shaped like mafia.json, and reports
+wall time per game, bytes read/written in the result directory, number of JSON parses
+and peak memory, while varying the number of games, num_rounds and the agent count.
+
+Save a run with save_benchmark and pass it as baseline to flag regressions.
+The "layout" suite compares the message layouts of agent_config.message_layout by
+the share of prompt tokens the mock server's prefix cache could reuse, and the "hedge"
+suite runs with and without hedged requests (hedging.py) against heavy-tailed latencies.
+The "query" suite times the analysis queries over the stored results/ with the JSON
+files and with the sqlite backend (result_db.py). The "replay" suite records a campaign
+whose answers are cut by max_completion_tokens into the completion cache, with and without
+streaming, and replays it offline.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import agent_config
+import result_db
+import utils
+from campaign import load_experiment
+from engine import run_campaign
+from hedging import hedge_stats
+from mock_server import MockServerConfig, start_mock_server
+
+
+"""Initialization of the benchmark parameters"""
+suite = "quick"  # "quick", "scaling", "layout", "hedge", "query" or "replay"
+baseline_file = "benchmark_baseline.json"
+regression_tolerance = 1.25  # flag scenarios that got 25% slower per game
+trace_memory = True  # tracemalloc slows the pipeline down; disable for pure timings
+
+FIRST_NAMES = ["Daniel", "Paul", "Megan", "Thomas", "Sara", "Bill", "Erica", "Richard", "Kimberly", "Timothy",
+               "Amanda", "Robin", "Gregory", "John", "Tanya", "Anthony", "Mary", "Yvette", "Alyssa", "Steven"]
+LAST_NAMES = ["Humphrey", "Silva", "Jackson", "Pruitt", "Marshall", "Brock", "Joseph", "Johnson", "Sullivan",
+              "Underwood", "Pearson", "Rodriguez", "Walker", "Thompson", "Kennedy", "Floyd", "Mullins", "Davis"]
+CHAT = ["sup yall", "yo", "why not", "I'll go with", "that is sus", "who do we vote", "not me", "lol", "vote"]
+
+
+def synthetic_games(num_games, num_players=10, log_lines=50, seed=0):
+    """Generate games with the mafia.json layout: id, agents, log and win."""
+    rng = random.Random(seed)
+    games = []
+
+    for i in range(num_games):
+        names = rng.sample([f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES], num_players)
+        mafiosi = set(rng.sample(names, 2))
+        agents = [
+            {"id": str(j), "name": name, "role": "mafioso" if name in mafiosi else "bystander",
+             "survive": rng.random() < 0.4}
+            for j, name in enumerate(names)
+        ]
+
+        log = ["[Phase Change to Nighttime]", f"[Phase Change to Daytime: Victim - {rng.choice(names)}]"]
+        while len(log) < log_lines:
+            speaker, target = rng.sample(names, 2)
+            if rng.random() < 0.2:
+                log.append(f"({speaker} vote to eliminate {target}.)")
+            else:
+                log.append(f"{speaker}: {rng.choice(CHAT)} {target.split()[0].lower()}")
+
+        games.append({
+            "id": f"synthetic-{seed}-{i:05d}-data",
+            "agents": agents,
+            "log": log,
+            "win": rng.choice(["mafioso", "bystander"]),
+        })
+
+    return games
+
+
+def cycle_ids(ids, count):
+    """Repeat a list of agent ids to get `count` agents (synthetic load only)."""
+    return [ids[i % len(ids)] for i in range(count)]
+
+
+def configure_experiment(experiment, num_rounds, num_agents):
+    """Set the round count and agent count of the stages of a freshly loaded experiment module."""
+    experiment.num_rounds = num_rounds
+    experiment.resume = False
+
+    stages = []
+    for stage in experiment.stages:
+        stage = dict(stage)
+        if stage["kind"] == "discussion":
+            stage["rounds"] = num_rounds
+        if stage["kind"] in ("discussion", "vote"):
+            stage["agents"] = cycle_ids(stage["agents"], num_agents)
+        stages.append(stage)
+    experiment.stages = stages
+
+
+def run_scenario(pipeline, num_games, num_rounds, num_agents, max_concurrent_games=8, seed=0):
+    """
+    Run one pipeline on synthetic games in a scratch result directory.
+
+    Returns:
+        dict: The scenario parameters and its measurements.
+    """
+    experiment = load_experiment(os.path.join(os.path.dirname(os.path.abspath(__file__)), pipeline))
+    configure_experiment(experiment, num_rounds, num_agents)
+    games = synthetic_games(num_games, seed=seed)
+
+    result_dir = tempfile.mkdtemp(prefix="mafia_bench_")
+    previous_dir, utils.result_dir = utils.result_dir, result_dir
+    utils.io_stats.clear()
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(run_campaign(
+                [0],
+                games,
+                experiment.play_game,
+                experiment.score_game,
+                experiment.new_scores,
+                max_concurrent_games=max_concurrent_games,
+                max_concurrent_runs=1))
+    finally:
+        wall = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        utils.result_dir = previous_dir
+        shutil.rmtree(result_dir, ignore_errors=True)
+
+    return {
+        "pipeline": pipeline,
+        "games": num_games,
+        "rounds": num_rounds,
+        "agents": num_agents,
+        "wall_seconds": wall,
+        "seconds_per_game": wall / num_games,
+        "bytes_read": utils.io_stats["bytes_read"],
+        "bytes_written": utils.io_stats["bytes_written"],
+        "json_parses": utils.io_stats["json_parses"],
+        "journal_records_read": utils.io_stats["journal_records_read"],
+        "peak_memory_mb": peak / 2 ** 20 if peak is not None else None,
+    }
+
+
+def scenarios(suite):
+    """(pipeline, games, rounds, agents) combinations of a suite."""
+    if suite == "quick":
+        return [
+            ("__init__.py", 5, 2, 3),
+            ("__init__.py", 20, 2, 3),
+            ("vote_only_test.py", 20, 0, 6),
+        ]
+    if suite == "scaling":
+        return (
+            [("__init__.py", games, 5, 3) for games in (10, 40, 160, 640)]
+            + [("__init__.py", 40, rounds, 3) for rounds in (1, 3, 5, 10)]
+            + [("__init__.py", 40, 5, agents) for agents in (2, 3, 5, 8)]
+            + [("vote_only_test.py", games, 0, 6) for games in (40, 400, 2000)]
+        )
+    raise ValueError(f"Unsupported suite: {suite}")
+
+
+def scenario_key(result):
+    return f'{result["pipeline"]}|g={result["games"]}|r={result["rounds"]}|a={result["agents"]}'
+
+
+def print_report(results, baseline=None):
+    header = f'{"pipeline":<18}{"games":>6}{"rounds":>7}{"agents":>7}{"s/game":>9}{"MB read":>9}{"MB written":>11}{"parses":>8}{"peak MB":>9}'
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        peak = f'{result["peak_memory_mb"]:.1f}' if result["peak_memory_mb"] is not None else "-"
+        line = (
+            f'{result["pipeline"]:<18}{result["games"]:>6}{result["rounds"]:>7}{result["agents"]:>7}'
+            f'{result["seconds_per_game"]:>9.3f}{result["bytes_read"] / 2 ** 20:>9.2f}'
+            f'{result["bytes_written"] / 2 ** 20:>11.2f}{result["json_parses"]:>8}{peak:>9}'
+        )
+
+        previous = (baseline or {}).get(scenario_key(result))
+        if previous:
+            ratio = result["seconds_per_game"] / previous["seconds_per_game"]
+            line += f"  x{ratio:.2f}" + ("  [REGRESSION]" if ratio > regression_tolerance else "")
+        print(line)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return {scenario_key(result): result for result in json.load(f)}
+
+
+def save_benchmark(results, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def run_suite(suite="quick", mock_config=None):
+    """Start a mock server with no latency and run every scenario of a suite against it."""
+    server = start_mock_server(mock_config or MockServerConfig(latency="fixed", latency_mean=0.0, completion_words=40, seed=0))
+    agent_config.connect(server.base_url)
+
+    try:
+        return [run_scenario(*scenario) for scenario in scenarios(suite)]
+    finally:
+        server.shutdown()
+
+
+def compare_layouts(num_games=10, num_rounds=3, layouts=("identity_first", "shared_prefix"), mock_config=None):
+    """
+    Run __init__.py once per message layout against a mock server with prefix caching.
+
+    Returns:
+        list[dict]: The run_scenario measurements of each layout, with the server's token counters.
+    """
+    server = start_mock_server(mock_config or MockServerConfig(
+        latency="fixed", latency_mean=0.0, seconds_per_prompt_token=2e-5, completion_words=40, seed=0))
+    agent_config.connect(server.base_url)
+    previous = agent_config.message_layout
+    results = []
+
+    try:
+        for layout in layouts:
+            agent_config.message_layout = layout
+            server.reset()
+            result = run_scenario("__init__.py", num_games, num_rounds, 3)
+            stats = server.stats.as_dict()
+            result.update(
+                layout=layout,
+                prompt_tokens=stats["prompt_tokens"],
+                cached_prompt_tokens=stats["cached_prompt_tokens"],
+                prefix_hit_rate=stats["cached_prompt_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0,
+            )
+            results.append(result)
+    finally:
+        agent_config.message_layout = previous
+        server.shutdown()
+
+    return results
+
+
+def print_layout_report(results):
+    header = f'{"layout":<16}{"games":>6}{"rounds":>7}{"s/game":>9}{"prompt tok":>12}{"cached tok":>12}{"prefix hit":>11}'
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        print(
+            f'{result["layout"]:<16}{result["games"]:>6}{result["rounds"]:>7}{result["seconds_per_game"]:>9.3f}'
+            f'{result["prompt_tokens"]:>12}{result["cached_prompt_tokens"]:>12}{result["prefix_hit_rate"]:>11.1%}'
+        )
+
+
+def compare_hedging(num_games=10, num_rounds=3, mock_config=None):
+    """
+    Run __init__.py without and with agent_config.hedging against a mock server with
+    heavy-tailed (lognormal) latencies.
+
+    Returns:
+        list[dict]: The run_scenario measurements of each setting, with the extra load of hedging.
+    """
+    server = start_mock_server(mock_config or MockServerConfig(
+        latency="lognormal", latency_mean=0.05, latency_spread=2.0, completion_words=40, seed=0))
+    agent_config.connect(server.base_url)
+    previous = agent_config.hedging, agent_config.hedge_min_delay
+    agent_config.hedge_min_delay = 0.0
+    results = []
+
+    try:
+        for hedging in (False, True):
+            agent_config.hedging = hedging
+            server.reset()
+            hedge_stats.clear()
+            result = run_scenario("__init__.py", num_games, num_rounds, 3)
+            result.update(
+                hedging=hedging,
+                server_requests=server.stats.requests,
+                **{name: hedge_stats[name] for name in ("hedges", "hedge_wins", "cancelled", "reissues_parse", "reissues_size")},
+            )
+            results.append(result)
+    finally:
+        agent_config.hedging, agent_config.hedge_min_delay = previous
+        server.shutdown()
+
+    return results
+
+
+def print_hedge_report(results):
+    header = f'{"hedging":<10}{"games":>6}{"s/game":>9}{"requests":>10}{"hedges":>8}{"won":>6}{"cancel":>8}{"reissue":>9}'
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        print(
+            f'{"on" if result["hedging"] else "off":<10}{result["games"]:>6}{result["seconds_per_game"]:>9.3f}'
+            f'{result["server_requests"]:>10}{result["hedges"]:>8}{result["hedge_wins"]:>6}{result["cancelled"]:>8}'
+            f'{result["reissues_parse"] + result["reissues_size"]:>9}'
+        )
+
+
+def compare_replay(num_games=5, num_rounds=2, max_completion_tokens=60, mock_config=None):
+    """
+    Run __init__.py with the completion cache in "record" mode, then again in "replay" mode,
+    with answers cut by max_completion_tokens, without and with streaming. A replay that
+    misses the cache or cannot read back a recorded answer raises.
+
+    Returns:
+        list[dict]: The server requests of each recording and replay.
+    """
+    server = start_mock_server(mock_config or MockServerConfig(latency="fixed", latency_mean=0.0, completion_words=120, seed=0))
+    agent_config.connect(server.base_url)
+    cache = agent_config.completion_cache
+    previous = agent_config.streaming, agent_config.max_completion_tokens, cache.mode, cache.cache_dir, cache.total_bytes
+    agent_config.max_completion_tokens = max_completion_tokens
+    results = []
+
+    try:
+        for streaming in (False, True):
+            agent_config.streaming = streaming
+            cache.cache_dir, cache.total_bytes = tempfile.mkdtemp(prefix="mafia_replay_"), None
+            try:
+                for mode in ("record", "replay"):
+                    cache.mode = mode
+                    server.reset()
+                    result = run_scenario("__init__.py", num_games, num_rounds, 3)
+                    result.update(streaming=streaming, cache_mode=mode, server_requests=server.stats.requests)
+                    results.append(result)
+            finally:
+                shutil.rmtree(cache.cache_dir, ignore_errors=True)
+    finally:
+        agent_config.streaming, agent_config.max_completion_tokens, cache.mode, cache.cache_dir, cache.total_bytes = previous
+        server.shutdown()
+
+    return results
+
+
+def print_replay_report(results):
+    header = f'{"streaming":<11}{"cache":<8}{"games":>6}{"s/game":>9}{"requests":>10}'
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        print(
+            f'{"on" if result["streaming"] else "off":<11}{result["cache_mode"]:<8}{result["games"]:>6}'
+            f'{result["seconds_per_game"]:>9.3f}{result["server_requests"]:>10}'
+        )
+
+
+def time_queries(backend, result_dir, points, game_id, mode, speaker, run_ids):
+    """Seconds per point score query and for one cross-run vote query, with a result backend."""
+    previous = utils.result_backend, utils.result_dir
+    utils.result_backend, utils.result_dir = backend, result_dir
+
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run_id, point_game, point_mode in points:
+                utils.score_mafias(run_id, point_game, point_mode)
+                utils.score_winner(run_id, point_game, point_mode)
+        point_seconds = (time.perf_counter() - started) / (2 * len(points)) if points else 0.0
+
+        started = time.perf_counter()
+        if backend == "sqlite":
+            votes = result_db.query_votes(game_id=game_id, mode=mode, speaker=speaker, run_ids=run_ids, directory=result_dir)
+        else:
+            votes = [
+                vote
+                for run_id in run_ids
+                for vote in utils.load_result_json(run_id).get(game_id, {}).get(mode, {}).get("vote", [])
+                if vote.get("speaker") == speaker
+            ]
+        scan_seconds = time.perf_counter() - started
+    finally:
+        utils.result_backend, utils.result_dir = previous
+
+    return {"backend": backend, "point_seconds": point_seconds, "cross_run_seconds": scan_seconds, "votes": len(votes)}
+
+
+def compare_queries(source_dir=None, num_points=50, mode="multy_agents_devil", speaker="Agent_3", seed=0):
+    """
+    Import the JSON results of source_dir (result_dir by default) into a temporary sqlite
+    database and time, with both backends, score_mafias / score_winner of num_points random
+    (run, game, mode) units and the votes of `speaker` in `mode` for one game across every run.
+
+    Returns:
+        list[dict]: The timings of each backend, with the run and game counts.
+    """
+    source_dir = source_dir or utils.result_dir
+    db_dir = tempfile.mkdtemp(prefix="mafia_query_")
+
+    try:
+        started = time.perf_counter()
+        run_ids = result_db.import_json(utils.read_result_files, directory=db_dir, source_dir=source_dir)
+        import_seconds = time.perf_counter() - started
+
+        connection = result_db.connect(db_dir)
+        units = connection.execute("SELECT run_id, game_id, mode FROM sections ORDER BY run_id, game_id, mode").fetchall()
+        points = random.Random(seed).sample(units, min(num_points, len(units)))
+        game_id = connection.execute(
+            "SELECT game_id FROM votes WHERE mode = ? AND speaker = ? GROUP BY game_id ORDER BY COUNT(*) DESC LIMIT 1",
+            (mode, speaker)).fetchone()
+        game_id = game_id[0] if game_id else None
+
+        results = [time_queries(backend, directory, points, game_id, mode, speaker, run_ids)
+                   for backend, directory in (("json", source_dir), ("sqlite", db_dir))]
+        for result in results:
+            result.update(runs=len(run_ids), units=len(units), import_seconds=import_seconds,
+                          db_bytes=os.path.getsize(result_db.db_path(db_dir)))
+    finally:
+        result_db.close(db_dir)
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    return results
+
+
+def print_query_report(results):
+    if results:
+        print(f'{results[0]["runs"]} runs, {results[0]["units"]} (run, game, mode) units, '
+              f'imported in {results[0]["import_seconds"]:.1f}s into {results[0]["db_bytes"] / 1e6:.1f} MB')
+
+    header = f'{"backend":<10}{"ms/point":>10}{"ms/cross-run":>14}{"votes":>8}'
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        print(
+            f'{result["backend"]:<10}{result["point_seconds"] * 1000:>10.2f}'
+            f'{result["cross_run_seconds"] * 1000:>14.2f}{result["votes"]:>8}'
+        )
+
+
+if __name__ == '__main__':
+
+
+    if suite == "layout":
+        print_layout_report(compare_layouts())
+
+    elif suite == "hedge":
+        print_hedge_report(compare_hedging())
+
+    elif suite == "query":
+        print_query_report(compare_queries())
+
+    elif suite == "replay":
+        print_replay_report(compare_replay())
+
+    else:
+        results = run_suite(suite)
+        print_report(results, load_baseline(baseline_file))
+
+        if not os.path.exists(baseline_file):
+            save_benchmark(results, baseline_file)
+            print(f"Saved baseline to {baseline_file}")
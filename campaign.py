@@ -0,0 +1,206 @@
+"""
+Multi-process campaign runner: spreads the (run_id, games) shards of an experiment
+across a process pool, so several inference endpoints can be kept busy from one machine.
+
+Each shard is played by one worker with the experiment's own play_game / score_game
+(see engine.py) and written to results/shards/{shard}/{run_id}_result.json.
+merge_run then folds the shards of a run into the usual results/{run_id}_result.json
+and recomputes the cumulative score_mafias / score_winner in game order.
+Shard traces go to results/traces/{shard}/{run_id}_trace.json.
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import queue
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import result_db
+import utils
+from checkpoint import game_completed
+from engine import run_campaign
+from result_store import ResultStore
+from utils import apply_result_entry, load_result_json, score_mafias, score_winner, write_result_json
+
+
+"""Initialization of the campaign parameters"""
+experiment_file = "__init__.py"  # or "vote_only_test.py"
+run_ids = range(0, 50)  # range(100, 130) for vote_only_test.py
+num_workers = 4
+games_per_shard = None  # None: one shard per run_id, otherwise (run_id, game chunk) shards
+
+
+def load_experiment(path):
+    """Import an experiment script (play_game, score_game, new_scores, modes) by file path."""
+    spec = importlib.util.spec_from_file_location(f"experiment_{os.path.splitext(os.path.basename(path))[0]}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def shard_dir(shard, root=None):
+    return os.path.join(root or utils.result_dir, "shards", str(shard))
+
+
+def plan_shards(run_ids, games, games_per_shard=None):
+    """
+    Split the campaign into (run_id, shard, games) units.
+
+    The shard index only depends on the position of the games, so an interrupted
+    campaign finds its shards again and the experiment's resume mode applies.
+    """
+    size = games_per_shard or len(games)
+    return [
+        (run_id, start // size, games[start:start + size])
+        for run_id in run_ids
+        for start in range(0, len(games), size)
+    ]
+
+
+def run_shard(experiment_path, run_id, shard, games, progress, root):
+    """Worker: play the games of one shard into {root}/shards/{shard}/."""
+    experiment = load_experiment(experiment_path)
+    utils.result_dir = root  # workers are reused across shards
+
+    if experiment.resume:
+        # Games already merged into results/{run_id}_result.json by an earlier campaign
+        merged = ResultStore(run_id)
+        finished = [game_data for game_data in games if game_completed(merged, game_data["id"], experiment.modes)]
+        games = [game_data for game_data in games if game_data not in finished]
+        for game_data in finished:
+            progress.put((run_id, game_data["id"]))
+
+    utils.result_dir = shard_dir(shard, root)
+
+    def score_game(run_id, game_data, store, scores):
+        # Scores are cumulative within the shard only; merge_run recomputes them per run
+        experiment.score_game(run_id, game_data, store, scores)
+        progress.put((run_id, game_data["id"]))
+
+    asyncio.run(run_campaign(
+        [run_id],
+        games,
+        experiment.play_game,
+        score_game,
+        experiment.new_scores,
+        max_concurrent_games=experiment.max_concurrent_games,
+        max_concurrent_runs=1,
+        trace_dir=os.path.join(root, "traces", str(shard))))
+
+    return run_id, shard
+
+
+def merge_run(run_id, games, modes, shards):
+    """
+    Fold the shards of a run into results/{run_id}_result.json.
+
+    Games are written in mafia.json order and the cumulative score_mafias /
+    score_winner of every mode are recomputed from the stored pred / true.
+
+    Returns:
+        dict: {mode: {"score_mafias": int, "score_winner": int}} of the whole run.
+    """
+    data = load_result_json(run_id)
+    for shard in shards:
+        data.update(load_result_json(run_id, directory=shard_dir(shard)))
+
+    rank = {game_data["id"]: i for i, game_data in enumerate(games)}
+    data = dict(sorted(data.items(), key=lambda item: rank.get(item[0], len(rank))))
+
+    store = ResultStore(run_id, data=data)
+    scores = {mode: {"score_mafias": 0, "score_winner": 0} for mode in modes}
+
+    for game_data in games:
+        game_id = game_data["id"]
+        if game_id not in data:
+            continue
+
+        for mode in modes:
+            if not data[game_id].get(mode, {}).get("true"):
+                continue
+            scores[mode]["score_mafias"] += score_mafias(run_id, game_id, mode, store=store)
+            scores[mode]["score_winner"] += score_winner(run_id, game_id, mode, store=store)
+            apply_result_entry(data, mode, "score_mafias", scores[mode]["score_mafias"], game_id)
+            apply_result_entry(data, mode, "score_winner", scores[mode]["score_winner"], game_id)
+
+    write_result_json(run_id, data)
+
+    for shard in shards:
+        for path in (utils.result_path(run_id, shard_dir(shard)), utils.journal_path(run_id, shard_dir(shard))):
+            if os.path.exists(path):
+                os.remove(path)
+        result_db.close(shard_dir(shard))  # the shard database, with the sqlite backend
+
+    return scores
+
+
+def report_progress(done, total, started):
+    elapsed = time.time() - started
+    rate = done / elapsed * 60 if elapsed > 0 else 0.0
+    eta = (total - done) / rate if rate > 0 else float("inf")
+    print(f"\n[campaign] {done}/{total} games ({done / total:.1%}), {rate:.1f} games/min, ETA {eta:.0f} min")
+
+
+def run_sharded_campaign(experiment_path, run_ids, games, num_workers=4, games_per_shard=None):
+    """
+    Play a campaign on a process pool and merge every run once all its shards are done.
+
+    Returns:
+        dict: {run_id: scores} of the merged runs.
+    """
+    experiment = load_experiment(experiment_path)
+    units = plan_shards(list(run_ids), games, games_per_shard)
+
+    remaining = {}
+    for run_id, shard, _ in units:
+        remaining.setdefault(run_id, set()).add(shard)
+    shards_of = {run_id: sorted(shards) for run_id, shards in remaining.items()}
+
+    total = len(run_ids) * len(games)
+    done = 0
+    started = time.time()
+    results = {}
+
+    with Manager() as manager, ProcessPoolExecutor(max_workers=num_workers) as pool:
+        progress = manager.Queue()
+        futures = {
+            pool.submit(run_shard, experiment_path, run_id, shard, shard_games, progress, utils.result_dir)
+            for run_id, shard, shard_games in units
+        }
+
+        while futures:
+            finished = [future for future in futures if future.done()]
+
+            for future in finished:
+                futures.remove(future)
+                run_id, shard = future.result()
+                remaining[run_id].discard(shard)
+
+                if not remaining[run_id]:
+                    results[run_id] = merge_run(run_id, games, experiment.modes, shards_of[run_id])
+                    print(f"\n[campaign] merged run {run_id}: {results[run_id]}")
+
+            try:
+                while True:
+                    progress.get(timeout=0.5)
+                    done += 1
+                    if done % 10 == 0 or done == total:
+                        report_progress(done, total, started)
+            except queue.Empty:
+                pass
+
+    shutil.rmtree(os.path.join(utils.result_dir, "shards"), ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+
+
+    with open('./mafia.json', "r") as f: # Read the game log file
+        data = json.load(f)
+
+    run_sharded_campaign(experiment_file, run_ids, data[:], num_workers=num_workers, games_per_shard=games_per_shard)
@@ -0,0 +1,38 @@
+"""
+Helpers for resuming an interrupted experiment from the result store.
+
+A run is checkpointed at every stage boundary (statement, each discussion round,
+vote, scoring), so after a crash the experiment scripts can ask the store which
+stages of a game are already recorded and only call the LLM for the rest.
+"""
+
+
+def stored_section(store, game_id, mode):
+    """The stored data of one (game_id, mode) unit, or an empty dict."""
+    return store.game(game_id).get(mode, {})
+
+
+def logged_messages(store, game_id, mode):
+    """Discussion log entries already recorded for a (game_id, mode) unit."""
+    return stored_section(store, game_id, mode).get("log", [])
+
+
+def recorded_votes(store, game_id, mode):
+    """Vote entries already recorded for a (game_id, mode) unit."""
+    return stored_section(store, game_id, mode).get("vote", [])
+
+
+def unit_completed(store, game_id, mode):
+    """
+    Whether a (game_id, mode) unit has finished.
+
+    The ground truth and the cumulative score_mafias / score_winner are written
+    together at the end of a game, and score_winner defaults to 0 in a fresh
+    entry, so the presence of the ground truth marks a finished unit.
+    """
+    return bool(stored_section(store, game_id, mode).get("true"))
+
+
+def game_completed(store, game_id, modes):
+    """Whether every mode of a game has finished."""
+    return all(unit_completed(store, game_id, mode) for mode in modes)
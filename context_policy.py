@@ -0,0 +1,125 @@
+"""
+Context policies of Agent.build_messages, bounding the prompt size of long discussions.
+
+"full":    the whole conversation
+"window":  the last agent_config.context_window turns
+"summary": a rolling summary of the older turns, written by the summarizer agent every
+           summary_interval turns, followed by the turns since. The summary is cached per
+           (game, mode) in the Conversation and stored in the "summary" field of the results.
+
+Whatever the policy, a request is fitted to agent_config.max_prompt_tokens: the oldest turns
+are dropped first, then the start of the game log is cut. The repo has no tokenizer of the
+served model, so sizes are estimated at about four characters per token (as in mock_server.py
+and the usage accounting of the mock runs), and prompt_token_margin of the budget is kept free
+for the error of that estimate; the fit is approximate, not exact.
+"""
+
+import agent_config
+from conversation import text_message
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token), as in mock_server.py."""
+    return max(1, len(text) // 4)
+
+
+MESSAGE_OVERHEAD = 4  # estimated tokens of the role and separators of a message
+
+
+def message_tokens(message):
+    return estimate_tokens("".join(part["text"] for part in message["content"])) + MESSAGE_OVERHEAD
+
+
+def context_settings():
+    """The context settings of the current configuration, stored as the "context" field of every mode."""
+    return {
+        "policy": agent_config.context_policy,
+        "window": agent_config.context_window,
+        "summary_interval": agent_config.summary_interval,
+        "max_prompt_tokens": agent_config.max_prompt_tokens,
+        "prompt_token_margin": agent_config.prompt_token_margin,
+        "message_layout": agent_config.message_layout,
+        "game_log_format": agent_config.game_log_format,
+    }
+
+
+def summary_due(conversation):
+    """
+    Turns to fold into the rolling summary before the next call.
+
+    Returns:
+        tuple[int, int] or None: (start, end) of the turns, or None if the summary is recent enough.
+    """
+    if agent_config.context_policy != "summary":
+        return None
+
+    end = len(conversation) - agent_config.context_window
+    if end - conversation.summarized < agent_config.summary_interval:
+        return None
+    return conversation.summarized, end
+
+
+def summary_request(conversation, start, end):
+    """Messages asking the summarizer to merge turns[start:end] into the current summary."""
+    turns = "\n".join(message["content"][0]["text"] for message in conversation.as_user[start:end])
+    text = f"Summary so far:\n{conversation.summary or '(none)'}\n\nNew discussion turns:\n{turns}"
+    return [
+        text_message("system", agent_config.summarizer_config["system_prompt"]),
+        text_message("user", text),
+    ]
+
+
+def select_turns(conversation, agent_name=None):
+    """The messages of a conversation kept by the context policy, as agent_name sees them."""
+    view = conversation.view(agent_name)
+    policy = agent_config.context_policy
+
+    if policy == "full":
+        return list(view)
+    if policy == "window":
+        return view[max(0, len(view) - agent_config.context_window):]
+    if policy == "summary":
+        turns = view[conversation.summarized:]
+        if conversation.summary:
+            return [text_message("user", f"Summary of the earlier discussion:\n{conversation.summary}")] + turns
+        return turns
+    raise ValueError(f"Unsupported context policy: {policy}")
+
+
+def prompt_budget():
+    """The estimated tokens a request may use: max_prompt_tokens less the safety margin."""
+    return int(agent_config.max_prompt_tokens * (1 - agent_config.prompt_token_margin))
+
+
+def fit_budget(fixed, log, turns):
+    """
+    Fit one request to max_prompt_tokens, by estimated token counts within prompt_budget().
+
+    Args:
+        fixed: The messages that are always sent whole (identity reminder, prompt).
+        log: The game log message.
+        turns: The conversation messages, oldest first.
+
+    Returns:
+        tuple[dict, list[dict]]: The game log message and the turns that fit.
+    """
+    budget = prompt_budget()
+    turn_tokens = [message_tokens(message) for message in turns]
+    log_tokens = message_tokens(log)
+    total = sum(message_tokens(message) for message in fixed) + log_tokens + sum(turn_tokens)
+
+    dropped = 0
+    while total > budget and dropped < len(turns):
+        total -= turn_tokens[dropped]
+        dropped += 1
+    turns = turns[dropped:]
+
+    if total > budget:
+        # Keep the end of the game log (the latest events), cut at a line boundary
+        text = log["content"][0]["text"]
+        keep = max(0, (budget - (total - log_tokens) - MESSAGE_OVERHEAD) * 4)
+        text = text[max(0, len(text) - keep):] if keep else ""
+        text = text.split("\n", 1)[-1] if "\n" in text else text
+        log = text_message("system", text)
+
+    return log, turns
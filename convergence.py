@@ -0,0 +1,137 @@
+"""
+Convergence-based early stopping of the discussions (agent_config.early_stopping).
+
+A discussion stage checks for a consensus before each round, and goes straight to the votes
+once every speaker holds the same position (the same mafias and game outcome):
+    before the first round -- the positions of the structured statements already in the log,
+                              without any call: agreeing statements skip the discussion
+    after each round       -- one light extraction call (agent_config.extractor_config, temperature 0)
+                              reads the position of every turn of that round
+A consensus needs the positions of at least two speakers, and the first min_discussion_rounds
+rounds are always played.
+
+Every check is stored in the "convergence" field of the mode, with the positions known so far
+and the usage of its extraction call, so a resumed game does not check again. Once the
+discussion ends, the "early_stop" field records the rounds used and the LLM calls saved
+(the turns skipped, less the extraction calls).
+"""
+
+import agent_config
+from agent import Agent
+from checkpoint import logged_messages, stored_section
+from conversation import text_message
+from hedging import PARSE_ERRORS
+from tracing import span
+from utils import extract_mafia_vote, extract_outcome_vote, save_result_json
+
+
+def position(mafias, winner):
+    return {"mafias": sorted(name.strip() for name in mafias), "winner": winner}
+
+
+def consensus(positions):
+    """The position shared by every speaker ({speaker: position}), or None."""
+    held = list(positions.values())
+    if len(held) < 2 or any(other != held[0] for other in held[1:]):
+        return None
+    return held[0]
+
+
+def logged_positions(entries):
+    """{speaker: position} of the structured answers among log entries (the statements)."""
+    positions = {}
+    for entry in entries:
+        mafias = extract_mafia_vote(entry.get("message", ""))
+        winner = extract_outcome_vote(entry.get("message", ""))
+        if mafias is not None and winner is not None:
+            positions[entry["speaker"]] = position(mafias, winner)
+    return positions
+
+
+def extraction_request(conversation, start, end, positions):
+    """Messages asking the extractor for the position of every turn in turns[start:end]."""
+    known = "\n".join(f"{speaker}: mafias {held['mafias']}, winner {held['winner']}" for speaker, held in positions.items())
+    turns = "\n".join(message["content"][0]["text"] for message in conversation.as_user[start:end])
+    text = f"Positions so far:\n{known or '(none)'}\n\nDiscussion turns ({end - start}):\n{turns}"
+    return [
+        text_message("system", agent_config.extractor_config["system_prompt"]),
+        text_message("user", text),
+    ]
+
+
+class EarlyStopping:
+    """Consensus checks of one discussion (game, mode)"""
+
+    def __init__(self, run_id, game_id, mode, store, offset, num_agents, num_rounds, resume=True):
+        """offset: Position in the log of the first turn of the discussion, after the statements."""
+        self.run_id = run_id
+        self.game_id = game_id
+        self.mode = mode
+        self.store = store
+        self.num_agents = num_agents
+        self.num_rounds = num_rounds
+        self.section = stored_section(store, game_id, mode) if resume else {}
+        self.checks = {check["round"]: check for check in self.section.get("convergence", [])}
+        self.positions = logged_positions(logged_messages(store, game_id, mode)[:offset])
+        self.extraction_calls = 0
+
+    def finished(self):
+        """Whether an interrupted game already ended this discussion."""
+        return bool(self.section.get("early_stop"))
+
+    def save(self, field, entry):
+        save_result_json(self.run_id, self.mode, field, entry, game_id=self.game_id, store=self.store)
+
+    async def converged(self, round_number, start):
+        """
+        Check for a consensus before a round.
+
+        Args:
+            round_number: Index of the next round.
+            start: Position in the log of the first turn of that round.
+        """
+        if round_number < agent_config.min_discussion_rounds:
+            return False
+
+        check = self.checks.get(round_number)
+        if check is None:
+            check = await self.check(round_number, start)
+            self.save("convergence", check)
+        if round_number > 0:
+            self.extraction_calls += 1
+
+        self.positions = check["positions"]
+        return check["consensus"] is not None
+
+    async def check(self, round_number, start):
+        conversation = self.store.conversation(self.game_id, self.mode)
+        positions = dict(self.positions)
+        usage = None
+
+        if round_number > 0:
+            extractor = Agent(**agent_config.extractor_config)
+            begin = start - self.num_agents
+            try:
+                with span("convergence check", "llm", mode=self.mode, round=round_number):
+                    await extractor.acomplete(
+                        self.run_id, self.mode, extraction_request(conversation, begin, start, positions), affinity=self.game_id)
+                usage = extractor.latest_usage
+                read = extractor.latest_opinion.positions if extractor.latest_opinion is not None else []
+                for speaker, held in zip(conversation.speakers[begin:start], read):
+                    positions[speaker] = position(held.mafias, held.game_outcome)
+            except PARSE_ERRORS as e:
+                print(f"\n[Warning] {self.game_id} {self.mode}: no positions read after round {round_number}: {e}")
+
+        return {"round": round_number, "positions": positions, "consensus": consensus(positions), "usage": usage}
+
+    def finish(self, rounds_used):
+        """Record the rounds used and the calls saved by the discussion."""
+        turns_saved = (self.num_rounds - rounds_used) * self.num_agents
+        self.save("early_stop", {
+            "rounds": self.num_rounds,
+            "rounds_used": rounds_used,
+            "consensus": consensus(self.positions),
+            "turns_saved": turns_saved,
+            "extraction_calls": self.extraction_calls,
+            "calls_saved": turns_saved - self.extraction_calls,
+        })
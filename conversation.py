@@ -0,0 +1,95 @@
+"""
+In-memory transcript of one (game, mode) discussion.
+
+The ResultStore keeps one Conversation per (game, mode) and appends every saved
+log entry to it once, so an agent's next call does not rebuild its history from
+the stored log. Both role renderings of every turn are built once and shared:
+an agent's view picks 'assistant' for its own turns and 'user' for the others'.
+It also caches the rolling summary of the "summary" context policy (context_policy.py).
+A snapshot of the first turns shares their messages, so votes can branch off a
+discussion at any depth without copying or regenerating it.
+"""
+
+import asyncio
+from collections.abc import Sequence
+
+
+def text_message(role, text):
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+class Conversation:
+    """Append-only transcript with cached chat messages per turn"""
+
+    def __init__(self, entries=()):
+        self.speakers = []
+        self.as_user = []  # 'speaker:content' from 'user', as other agents see a turn
+        self.as_assistant = []  # the bare content from 'assistant', as the speaker sees its own turn
+        self.summary = ""  # rolling summary of the first `summarized` turns
+        self.summarized = 0
+        self.summary_lock = asyncio.Lock()  # the voters of a mode may ask for the same summary at once
+        for entry in entries:
+            self.append(entry.get("speaker", ""), entry.get("message", ""))
+
+    @classmethod
+    def from_section(cls, section):
+        """Rebuild the conversation of a stored mode section: its log and latest summary."""
+        conversation = cls(section.get("log", []))
+        if section.get("summary"):
+            conversation.summary = section["summary"][-1]["summary"]
+            conversation.summarized = section["summary"][-1]["turns"]
+        return conversation
+
+    def __len__(self):
+        return len(self.speakers)
+
+    def append(self, speaker, message):
+        self.speakers.append(speaker)
+        self.as_user.append(text_message("user", f"{speaker}:{message}"))
+        self.as_assistant.append(text_message("assistant", message))
+
+    def snapshot(self, turns, summaries=()):
+        """
+        A new Conversation of the first `turns` turns, sharing their cached messages.
+        summaries: the stored "summary" entries of the mode; the latest one covering
+        no more than those turns is kept.
+        """
+        snapshot = Conversation()
+        snapshot.speakers = self.speakers[:turns]
+        snapshot.as_user = self.as_user[:turns]
+        snapshot.as_assistant = self.as_assistant[:turns]
+        for entry in summaries:
+            if entry["turns"] <= turns:
+                snapshot.summary, snapshot.summarized = entry["summary"], entry["turns"]
+        return snapshot
+
+    def view(self, agent_name=None):
+        """The transcript as agent_name sees it (agent_name=None: every turn from 'user')."""
+        return ConversationView(self, agent_name, len(self))
+
+
+class ConversationView(Sequence):
+    """
+    Read-only view of the first `length` turns of a Conversation, with the role
+    of each turn resolved on access. Turns appended later are not part of the view.
+    """
+
+    def __init__(self, conversation, agent_name, length):
+        self.conversation = conversation
+        self.agent_name = agent_name
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+
+        if self.conversation.speakers[index] == self.agent_name:
+            return self.conversation.as_assistant[index]
+        return self.conversation.as_user[index]
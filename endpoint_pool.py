@@ -0,0 +1,207 @@
+"""
+Pool of OpenAI-compatible inference endpoints shared by every LLM call.
+
+Each request is routed to one endpoint of agent_config.endpoints:
+    "least_outstanding" -- the endpoint with the fewest requests in flight
+    "latency"           -- the endpoint with the lowest expected wait,
+                           (requests in flight + 1) x its recent latency
+Requests of the same game stick to the endpoint that served the game first, so the
+game log stays in that server's prefix cache, unless that endpoint is busier than
+the least loaded one by more than affinity_slack requests.
+
+Every endpoint has its own circuit breaker (resilience.py): an endpoint that keeps
+failing is skipped until its cooldown ends, and calls only pause when all endpoints
+are down. With several endpoints, GET /models health checks run every
+health_check_interval seconds and take unreachable endpoints out of the rotation.
+
+get_pool() returns the pool of the process, rebuilt whenever agent_config.endpoints changes.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+import agent_config
+from resilience import RETRYABLE_ERRORS, CircuitBreaker, retry_stats
+
+
+class Endpoint:
+    """One OpenAI-compatible server with its clients, load and health"""
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip("/")
+        self.client = openai.OpenAI(base_url=self.url, api_key="EMPTY", timeout=timeout, max_retries=0)
+        self.async_client = openai.AsyncOpenAI(base_url=self.url, api_key="EMPTY", timeout=timeout, max_retries=0)
+        self.breaker = CircuitBreaker(name=self.url)
+        self.outstanding = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.healthy = True
+        self.requests = 0
+
+    def available(self):
+        return self.healthy and not self.breaker.remaining()
+
+    def expected_wait(self):
+        return (self.outstanding + 1) * (self.latency or 0.0)
+
+    def record_latency(self, seconds, weight=0.2):
+        self.latency = seconds if self.latency is None else (1 - weight) * self.latency + weight * seconds
+
+
+class EndpointPool:
+    """Routes the LLM calls of a process over several endpoints"""
+
+    def __init__(self, urls, timeout=300.0, routing="least_outstanding", affinity_slack=4, health_check_interval=30.0):
+        if routing not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unsupported routing: {routing}")
+
+        self.urls = list(urls)
+        self.endpoints = [Endpoint(url, timeout) for url in self.urls]
+        self.routing = routing
+        self.affinity_slack = affinity_slack
+        self.health_check_interval = health_check_interval
+        self.affinity = {}  # game id -> Endpoint
+        self.lock = threading.Lock()
+        self.monitor_task = None
+
+    def rank(self, endpoint):
+        if self.routing == "latency":
+            return endpoint.expected_wait(), endpoint.outstanding
+        return endpoint.outstanding, endpoint.latency or 0.0
+
+    def pick(self, affinity=None, avoid=None):
+        """Choose the endpoint of the next request and count it as outstanding; avoid one if there is another."""
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.available()] or self.endpoints
+            candidates = [endpoint for endpoint in candidates if endpoint is not avoid] or candidates
+            best = min(candidates, key=self.rank)
+
+            endpoint = self.affinity.get(affinity)
+            if endpoint not in candidates or endpoint.outstanding > best.outstanding + self.affinity_slack:
+                endpoint = best
+            if affinity is not None:
+                self.affinity[affinity] = endpoint
+
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, started, error=None):
+        with self.lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.record_latency(time.perf_counter() - started)
+
+        if error is None:
+            endpoint.breaker.record_success()
+        elif isinstance(error, RETRYABLE_ERRORS):
+            endpoint.breaker.record_failure()
+
+    def wait_for_endpoint(self):
+        """Seconds until some endpoint's breaker closes (0 if one is available)."""
+        return min(endpoint.breaker.remaining() for endpoint in self.endpoints)
+
+    @contextmanager
+    def request(self, affinity=None, avoid=None):
+        """Hold an endpoint for one synchronous request: `with pool.request(game_id) as endpoint:`"""
+        waited = self.wait_for_endpoint()
+        if waited:
+            time.sleep(waited)
+            retry_stats["breaker_wait_seconds"] += waited
+
+        endpoint = self.pick(affinity, avoid)
+        started = time.perf_counter()
+        try:
+            yield endpoint
+        except BaseException as e:
+            self.release(endpoint, started, e)
+            raise
+        self.release(endpoint, started)
+
+    @asynccontextmanager
+    async def arequest(self, affinity=None, avoid=None):
+        """Asynchronous version of request: `async with pool.arequest(game_id) as endpoint:`"""
+        self.ensure_monitor()
+
+        waited = self.wait_for_endpoint()
+        if waited:
+            await asyncio.sleep(waited)
+            retry_stats["breaker_wait_seconds"] += waited
+
+        endpoint = self.pick(affinity, avoid)
+        started = time.perf_counter()
+        try:
+            yield endpoint
+        except BaseException as e:
+            self.release(endpoint, started, e)
+            raise
+        self.release(endpoint, started)
+
+    def check_health(self, timeout=5.0):
+        """GET /models on every endpoint; unreachable ones leave the rotation until they answer again."""
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.models.list(timeout=timeout)
+                healthy = True
+            except openai.APIError:
+                healthy = False
+            self.set_health(endpoint, healthy)
+
+    async def acheck_health(self, timeout=5.0):
+        for endpoint in self.endpoints:
+            try:
+                await endpoint.async_client.models.list(timeout=timeout)
+                healthy = True
+            except openai.APIError:
+                healthy = False
+            self.set_health(endpoint, healthy)
+
+    def set_health(self, endpoint, healthy):
+        if endpoint.healthy and not healthy:
+            print(f"\n[Warning] LLM endpoint {endpoint.url} failed its health check, routing around it")
+        endpoint.healthy = healthy
+
+    def ensure_monitor(self):
+        """Run the periodic health checks in the current event loop (only useful with several endpoints)."""
+        if len(self.endpoints) < 2:
+            return
+        loop = asyncio.get_running_loop()
+        if self.monitor_task is None or self.monitor_task.done() or self.monitor_task.get_loop() is not loop:
+            self.monitor_task = loop.create_task(self.monitor())
+
+    async def monitor(self):
+        while True:
+            await self.acheck_health()
+            await asyncio.sleep(self.health_check_interval)
+
+    def stats(self):
+        """{url: {"requests", "outstanding", "latency", "healthy"}}"""
+        return {
+            endpoint.url: {
+                "requests": endpoint.requests,
+                "outstanding": endpoint.outstanding,
+                "latency": endpoint.latency,
+                "healthy": endpoint.healthy,
+            }
+            for endpoint in self.endpoints
+        }
+
+
+pool = None
+
+
+def get_pool():
+    """The EndpointPool of agent_config.endpoints, shared by every LLM call of the process."""
+    global pool
+    if pool is None or pool.urls != list(agent_config.endpoints):
+        pool = EndpointPool(
+            agent_config.endpoints,
+            timeout=agent_config.request_timeout,
+            routing=agent_config.routing,
+            affinity_slack=agent_config.affinity_slack,
+            health_check_interval=agent_config.health_check_interval,
+        )
+    return pool
@@ -0,0 +1,113 @@
+"""
+Asyncio orchestration engine that runs several games (and several run_ids)
+against the LLM server at once.
+
+Each experiment script provides two callbacks:
+    play_game(run_id, game_data, store)        -- coroutine with all LLM stages of a game
+    score_game(run_id, game_data, store, scores) -- adds the game to the running scores
+Games are played concurrently, but scored strictly in game order, because
+score_mafias / score_winner are stored as cumulative totals per run.
+
+Every run is traced (see tracing.py) into results/traces/{run_id}_trace.json.
+"""
+
+import asyncio
+import os
+
+import agent_config
+import utils
+from fan_out import release_block
+from result_store import ResultStore
+from tracing import Tracer, current_lane, current_tracer, span
+
+
+async def run_game_slot(slots, play_game, run_id, game_data, store):
+    """Play one game once a slot under the concurrency cap is free."""
+    current_lane.set(game_data["id"])  # one trace lane per game
+
+    with span("queue wait", "engine"):
+        await slots.acquire()
+    try:
+        with span("game", "engine", game_id=game_data["id"]):
+            await play_game(run_id, game_data, store)
+    finally:
+        slots.release()
+
+
+async def run_one(run_id, games, play_game, score_game, new_scores, slots, trace_dir=None):
+    """
+    Play every game of one run concurrently and score them in order.
+
+    Returns:
+        The running scores of the run after the last game.
+    """
+    tracer = Tracer(run_id)
+    current_tracer.set(tracer)  # inherited by the game tasks created below
+
+    store = ResultStore(run_id)  # in-memory results of this run
+    scores = new_scores()
+
+    tasks = [
+        asyncio.create_task(run_game_slot(slots, play_game, run_id, game_data, store))
+        for game_data in games
+    ]
+
+    try:
+        for task, game_data in zip(tasks, games):
+            await task
+            with span("score game", "engine", game_id=game_data["id"]):
+                score_game(run_id, game_data, store, scores)
+
+            """Persist this game's records at the game boundary"""
+            store.flush()
+
+        await store.drain()  # e.g. the reasons of early votes
+    finally:
+        for task in [*tasks, *store.background]:
+            task.cancel()
+        store.flush()
+
+    """Fold this run's journal into results/{run_id}_result.json"""
+    store.compact(game_order=[game_data["id"] for game_data in games])
+
+    tracer.export(os.path.join(trace_dir or os.path.join(utils.result_dir, "traces"), f"{run_id}_trace.json"))
+    return scores
+
+
+async def run_campaign(run_ids, games, play_game, score_game, new_scores,
+                       max_concurrent_games=8, max_concurrent_runs=4, trace_dir=None):
+    """
+    Run every game of every run_id under a shared concurrency cap.
+
+    Args:
+        run_ids: The repetition indices, e.g. range(0, 50).
+        games: The game records from mafia.json.
+        play_game: Coroutine function (run_id, game_data, store) running the LLM stages.
+        score_game: Function (run_id, game_data, store, scores) called in game order.
+        new_scores: Function returning the empty running scores of a run.
+        max_concurrent_games: Number of games talking to the LLM server at once.
+        max_concurrent_runs: Number of runs whose stores are held in memory at once.
+        trace_dir: Directory of the trace files, results/traces by default.
+
+    Returns:
+        dict: {run_id: scores}
+    """
+    slots = asyncio.Semaphore(max_concurrent_games)
+    run_slots = asyncio.Semaphore(max_concurrent_runs)
+
+    blocks = {}  # fan-out block -> its runs still playing (see fan_out.py)
+    for run_id in run_ids:
+        blocks.setdefault(run_id // agent_config.fan_out_samples, set()).add(run_id)
+
+    async def run_with_slot(run_id):
+        async with run_slots:
+            try:
+                return await run_one(run_id, games, play_game, score_game, new_scores, slots, trace_dir)
+            finally:
+                block = run_id // agent_config.fan_out_samples
+                blocks[block].discard(run_id)
+                if not blocks[block]:
+                    release_block(block)
+
+    results = await asyncio.gather(*(run_with_slot(run_id) for run_id in run_ids))
+    return dict(zip(run_ids, results))
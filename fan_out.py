@@ -0,0 +1,167 @@
+"""
+n-sample fan-out of the first-stage requests across repetition runs (agent_config.fan_out_samples).
+
+The statement calls of a game have no conversation yet, so their request is the same in
+every run; only the sampling differs. With fan_out_samples = K, the runs are grouped into
+blocks of K consecutive run ids (run_id // K). The first run of a block to make such a call
+requests n=K samples at once, and sample run_id % K goes to each run of the block: one
+prefill of the game log serves K runs. K should divide the run range, e.g. 10 for
+range(0, 50) or range(100, 130).
+
+The samples wait in memory for the other runs of the block. With the completion cache in
+"record" mode they are also stored under each run's own cache key, so runs played later or
+in another process (campaign.py) find them there.
+
+Each sample carries its share of the request in its usage: prompt tokens split evenly,
+completion tokens by length, and fan_out = K. A sample that does not parse into the output
+schema, or that the server did not return (a server ignoring n sends a single choice), is not
+handed out; its run makes its own request. fan_out_stats counts the requests, the samples
+handed out and these fallbacks for the whole process.
+
+A block's samples are dropped once every run of the block has taken its own, or when the
+engine finishes the block (release_block): a resumed run that is past its statements never
+asks for its sample.
+"""
+
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import pydantic
+from tenacity import AsyncRetrying
+
+import agent_config
+import streaming
+from agent_config import completion_cache
+from endpoint_pool import get_pool
+from resilience import retry_policy
+from tracing import span
+
+
+batches = {}  # batch key -> Batch of the samples of one block
+fan_out_stats = Counter()
+
+
+class Batch:
+    """The pending or received samples of one fan-out request"""
+
+    def __init__(self, task, block):
+        self.task = task
+        self.block = block
+        self.taken = 0
+
+
+def batch_key(agent, block, mode, messages):
+    return completion_cache.key(agent.model, agent.temperature, messages, agent.output_schema, sample=f"block {block}/{mode}")
+
+
+async def asample(agent, run_id, mode, messages, affinity=None):
+    """
+    The sample of run_id for a first-stage request of an agent.
+
+    Returns:
+        dict or None: A completion cache record ({"content", "usage"}), or None if the
+        sample of this run is unusable and the run has to make its own request.
+    """
+    samples = agent_config.fan_out_samples
+    block, index = divmod(run_id, samples)
+    key = batch_key(agent, block, mode, messages)
+
+    batch = batches.get(key)
+    if batch is None:
+        batch = batches[key] = Batch(asyncio.ensure_future(request(agent, block, mode, messages, affinity)), block)
+
+    try:
+        records = await asyncio.shield(batch.task)  # one run being cancelled does not cancel the block
+    except BaseException:
+        batches.pop(key, None)  # the next run of the block asks again
+        raise
+
+    batch.taken += 1
+    if batch.taken >= samples:
+        batches.pop(key, None)
+
+    record = records[index] if index < len(records) else None
+    if record is None:
+        fan_out_stats["fallbacks"] += 1
+        return None
+    fan_out_stats["samples"] += 1
+    return record
+
+
+def release_block(block):
+    """Drop the samples of a block whose runs are all finished."""
+    for key in [key for key, batch in batches.items() if batch.block == block]:
+        del batches[key]
+
+
+async def request(agent, block, mode, messages, affinity=None):
+    """Request the samples of one block and store each under its run's cache key."""
+    samples = agent_config.fan_out_samples
+
+    first_started = time.perf_counter()
+    async for attempt in AsyncRetrying(**retry_policy()):
+        with attempt, span("llm call", "llm", agent=agent.id, mode=mode, messages=len(messages), n=samples) as trace:
+            async with get_pool().arequest(affinity) as endpoint:
+                trace["endpoint"] = endpoint.url
+                started = time.perf_counter()
+                options = streaming.request_options()
+                if agent.output_schema:
+                    options["response_format"] = streaming.response_format(agent.output_schema)
+                completion = await endpoint.async_client.chat.completions.create(
+                    model=agent.model,
+                    messages=messages,
+                    temperature=agent.temperature,
+                    n=samples,
+                    **options,
+                )
+                latency = time.perf_counter() - started
+
+    fan_out_stats["requests"] += 1
+    retry_seconds = time.perf_counter() - first_started - latency
+    records = split(agent, completion, latency, retry_seconds, attempt.retry_state.attempt_number)
+
+    for index, record in enumerate(records):
+        if record is not None:
+            completion_cache.store(agent.cache_key(block * samples + index, mode, messages), record)
+    return records
+
+
+def split(agent, completion, latency, retry_seconds, attempts):
+    """One cache record per choice of a fan-out completion, with its share of the usage (None if unusable)."""
+    choices = sorted(completion.choices, key=lambda choice: choice.index)
+    samples = len(choices)
+    usage = completion.usage
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    lengths = [len(choice.message.content or "") for choice in choices]
+
+    records = []
+    for choice, length in zip(choices, lengths):
+        content = choice.message.content or ""
+        if agent.output_schema:
+            try:
+                agent.output_schema.model_validate_json(content)
+            except pydantic.ValidationError:
+                records.append(None)
+                continue
+
+        records.append({
+            "content": content,
+            "usage": {
+                "call_id": uuid.uuid4().hex,
+                "prompt_tokens": round(usage.prompt_tokens / samples) if usage else None,
+                "cached_tokens": round(cached_tokens / samples) if cached_tokens is not None else None,
+                "completion_tokens": round(usage.completion_tokens * length / (sum(lengths) or 1)) if usage else None,
+                "latency": round(latency, 3),
+                "attempts": attempts,
+                "retry_seconds": round(retry_seconds, 3),
+                "extra_requests": 0,
+                "discarded_tokens": 0,
+                "ttft": None,
+                "fan_out": samples,
+                "cached": False,
+            },
+        })
+    return records
@@ -0,0 +1,198 @@
+"""
+Hedged LLM requests, cutting the tail latency of slow completions (agent_config.hedging).
+
+Latency hedge: when a request has not answered after the hedge_percentile of the recent
+latencies of the same kind of call (free text, or one output_schema), a duplicate is sent
+to another endpoint, or another slot of the same one, and the first answer wins; the
+other request is cancelled. Only the asynchronous calls are hedged.
+
+Re-issue: a structured output whose parse fails, or a completion longer than
+max_completion_chars, is requested again, up to max_reissues times.
+
+Both add load to the servers. Every call records its extra_requests (duplicates and
+re-issues) and discarded_tokens (tokens of answers thrown away; unknown for an answer
+that failed to parse) in its usage, and hedge_stats counts them for the whole process.
+"""
+
+import asyncio
+import json
+import time
+from collections import Counter, deque
+
+import openai
+import pydantic
+
+import agent_config
+from endpoint_pool import get_pool
+from tracing import instant
+
+
+PARSE_ERRORS = (
+    pydantic.ValidationError,
+    json.JSONDecodeError,
+    openai.LengthFinishReasonError,
+    openai.ContentFilterFinishReasonError,
+)
+
+"""Hedging counters of this process"""
+hedge_stats = Counter()
+
+
+class LatencyTracker:
+    """Recent request latencies per kind of call, giving the hedge delay"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}
+
+    def record(self, kind, seconds):
+        self.samples.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, kind):
+        """The hedge_percentile of the recent latencies, or None until hedge_min_samples are known."""
+        samples = sorted(self.samples.get(kind, ()))
+        if len(samples) < agent_config.hedge_min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * agent_config.hedge_percentile / 100))
+        return max(samples[index], agent_config.hedge_min_delay)
+
+
+latencies = LatencyTracker()
+
+
+def rejection(completion, structured):
+    """Why a completion has to be requested again ("parse", "size"), or None."""
+    message = completion.choices[0].message
+    if structured and message.parsed is None:
+        return "parse"
+    if len(message.content or "") > agent_config.max_completion_chars:
+        return "size"
+    return None
+
+
+def discard(completion, extra):
+    """Account for an answer that was received but not used."""
+    usage = completion.usage
+    tokens = ((usage.prompt_tokens or 0) + (usage.completion_tokens or 0)) if usage else 0
+    extra["discarded_tokens"] += tokens
+    hedge_stats["discarded_tokens"] += tokens
+
+
+def reissue(reason, extra, completion=None):
+    extra["requests"] += 1
+    hedge_stats[f"reissues_{reason}"] += 1
+    if completion is not None:
+        discard(completion, extra)
+    instant("reissue", "llm", reason=reason)
+
+
+async def race(send, affinity, kind, extra, hedge=True):
+    """
+    Send one request, and a duplicate if it is slower than the hedge delay.
+
+    Args:
+        send: Coroutine function sending the request to an Endpoint and returning the completion.
+        affinity: Game id of the request (see EndpointPool.pick).
+        kind: Kind of call whose latencies set the hedge delay.
+        extra: Counter of the extra load of this call, updated in place.
+        hedge: False to never send a duplicate of this call.
+
+    Returns:
+        tuple: (completion, endpoint, seconds until the winning answer)
+    """
+    pool = get_pool()
+    used = []
+    started = time.perf_counter()
+
+    async def attempt(affinity=None, avoid=None):
+        async with pool.arequest(affinity, avoid=avoid) as endpoint:
+            used.append(endpoint)
+            sent = time.perf_counter()
+            completion = await send(endpoint)
+            latencies.record(kind, time.perf_counter() - sent)
+            return completion, endpoint
+
+    delay = latencies.threshold(kind) if hedge and agent_config.hedging else None
+    if delay is None:
+        completion, endpoint = await attempt(affinity)
+        return completion, endpoint, time.perf_counter() - started
+
+    primary = asyncio.ensure_future(attempt(affinity))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            extra["requests"] += 1
+            hedge_stats["hedges"] += 1
+            instant("hedge", "llm", kind=kind, after=round(delay, 3))
+            tasks.append(asyncio.ensure_future(attempt(avoid=used[0] if used else None)))
+
+        pending = set(tasks)
+        while pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in tasks if task.done() and task.exception() is None]
+            if winners:
+                break
+        if not winners:
+            raise primary.exception()
+
+        winner = winners[0]
+        if winner is not primary:
+            hedge_stats["hedge_wins"] += 1
+        for task in winners[1:]:
+            discard(task.result()[0], extra)
+        completion, endpoint = winner.result()
+        return completion, endpoint, time.perf_counter() - started
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                hedge_stats["cancelled"] += 1
+
+
+async def acompletion(send, affinity, kind, structured, extra, hedge=True):
+    """
+    Hedged request with the re-issue of unusable answers; the last re-issue is kept as it is.
+    Arguments as race, structured: the request has an output_schema.
+    """
+    reissues = agent_config.max_reissues if hedge and agent_config.hedging else 0
+
+    for number in range(reissues + 1):
+        last = number == reissues
+        try:
+            completion, endpoint, latency = await race(send, affinity, kind, extra, hedge)
+        except PARSE_ERRORS:
+            if last:
+                raise
+            reissue("parse", extra)
+            continue
+
+        reason = rejection(completion, structured)
+        if reason is None or last:
+            return completion, endpoint, latency
+        reissue(reason, extra, completion)
+
+
+def completion(send, affinity, kind, structured, extra):
+    """Synchronous version of acompletion: re-issues unusable answers, without the latency hedge."""
+    reissues = agent_config.max_reissues if agent_config.hedging else 0
+    pool = get_pool()
+
+    for number in range(reissues + 1):
+        last = number == reissues
+        try:
+            with pool.request(affinity) as endpoint:
+                sent = time.perf_counter()
+                response = send(endpoint)
+                latency = time.perf_counter() - sent
+        except PARSE_ERRORS:
+            if last:
+                raise
+            reissue("parse", extra)
+            continue
+
+        latencies.record(kind, latency)
+        reason = rejection(response, structured)
+        if reason is None or last:
+            return response, endpoint, latency
+        reissue(reason, extra, response)
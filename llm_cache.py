@@ -0,0 +1,134 @@
+"""
+Disk-backed cache of LLM completions, keyed by a hash of the request.
+
+Modes:
+    "off"    -- every call goes to the LLM server.
+    "record" -- hits are served from the cache, misses go to the server and are stored.
+    "replay" -- hits are served from the cache, a miss raises CacheMissError,
+                so a recorded campaign can be re-run fully offline.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+
+class CompletionCache:
+    """Content-addressed completion store with a size limit and least-recently-used eviction"""
+
+    def __init__(self, cache_dir, mode="off", max_bytes=2 * 1024 ** 3):
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unsupported cache mode: {mode}")
+
+        self.cache_dir = str(cache_dir)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = None  # computed lazily on the first store
+
+    @staticmethod
+    def key(model, temperature, messages, response_format=None, sample=None):
+        """
+        Hash of everything that determines a completion.
+
+        sample distinguishes repetitions of the same request (e.g. the run_id): at
+        temperature 2.0 the repetitions are different samples, not one answer.
+        """
+        if response_format is not None:
+            response_format = {
+                "name": response_format.__name__,
+                "schema": response_format.model_json_schema(),
+            }
+
+        request = {
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "response_format": response_format,
+            "sample": sample,
+        }
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def lookup(self, key):
+        """
+        Return the cached record ({"content": str, ...}) of a request, or None.
+
+        Raises:
+            CacheMissError: In replay mode, if the request was never recorded.
+        """
+        if self.mode == "off":
+            return None
+
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            if self.mode == "replay":
+                raise CacheMissError(f"No recorded completion for request {key}")
+            return None
+
+        self.hits += 1
+        os.utime(path)  # mark as recently used
+        return record
+
+    def store(self, key, record):
+        """Store the record of a live completion (record mode only)."""
+        if self.mode != "record":
+            return
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        payload = json.dumps(record, ensure_ascii=False)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"  # several workers may record at once
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self.total_bytes += len(payload.encode("utf-8"))
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """Yield (path, size, last use) of every cached completion."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self, target_ratio=0.9):
+        """Remove the least recently used completions until the cache fits in target_ratio * max_bytes."""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if total <= self.max_bytes * target_ratio:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self.total_bytes = total
@@ -0,0 +1,200 @@
+"""
+Compact representation of the mafia.json game logs, sent as game_log instead of the raw lines
+when agent_config.game_log_format = "compact".
+
+The compact log lists the players once, groups the game into days and nights, keeps
+the chat with speaker names normalized to the player list, drops filler lines
+("hi", "lol", "yo", ...) that mention no player, folds repeated phase markers, and replaces the
+vote lines of each day by one vote table: the voters grouped by their final target,
+then the votes that changed ("voter: first target > later target").
+
+The compact logs of a corpus are built once and cached under cache/compact_logs/.
+Run this file to print the token savings of every game:
+    python log_compaction.py
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import agent_config
+from context_policy import estimate_tokens
+
+
+"""Initialization of the compaction parameters"""
+cache_dir = "./cache/compact_logs"
+drop_filler = True
+
+PHASE = re.compile(r"^\[Phase Change to (Nighttime|Daytime)(?:: Victim - (.+?))?\]$")
+VOTE = re.compile(r"^\((.+?) vote to eliminate (.+?)\.\)$")
+FILLER = re.compile(
+    r"^((hi+|hey+|hello+|yo+|sup|hola|howdy|morning|good morning)( (all|guys|everyone|everybody|yall|people|there))?|"
+    r"lo+l|lmao|ha(ha)+|he(he)+|hm+|ok(ay)?|k|sigh|bye|gg|rip|f|\d+|\W*)$"
+)
+
+compact_logs = {}  # game id -> compact log, filled by compact_game_log and load_compact_corpus
+
+
+def normalize(text):
+    return re.sub(r"[^\w\s]", "", text).strip().lower()
+
+
+def is_filler(message, names):
+    """A short low-information line that does not mention any player."""
+    text = normalize(message)
+    if any(part in text for name in names for part in normalize(name).split() if len(part) > 2):
+        return False
+    return bool(FILLER.match(text))
+
+
+def split_chat(line, names):
+    """(speaker, message) of a chat line, matching the longest player name first, or None."""
+    for name in names:
+        if line.startswith(f"{name}:"):
+            return name, line[len(name) + 1:].strip()
+    return None
+
+
+def compact_game_log(game_data, filler=None):
+    """
+    Build the compact log of one game.
+
+    Args:
+        game_data: A game record of mafia.json (id, agents, log).
+        filler: Drop filler lines; defaults to the module's drop_filler.
+
+    Returns:
+        str: The compact log.
+    """
+    filler = drop_filler if filler is None else filler
+    names = sorted((agent["name"] for agent in game_data["agents"]), key=len, reverse=True)
+    canonical = {normalize(name): name for name in names}
+
+    lines = ["Players: " + ", ".join(agent["name"] for agent in game_data["agents"])]
+    votes = {}  # voter -> targets in order, for the current day
+    phase = None
+
+    def close_day():
+        if not votes:
+            return
+        by_target = {}
+        for voter, targets in votes.items():
+            by_target.setdefault(targets[-1], []).append(voter)
+        lines.append("Votes: " + "; ".join(
+            f"{target} ({len(voters)}) <- {', '.join(voters)}"
+            for target, voters in sorted(by_target.items(), key=lambda item: -len(item[1]))
+        ))
+        changed = [f"{voter}: {' > '.join(targets)}" for voter, targets in votes.items() if len(targets) > 1]
+        if changed:
+            lines.append("Changed votes: " + "; ".join(changed))
+        votes.clear()
+
+    day = 0
+    for line in game_data["log"]:
+        line = line.strip()
+
+        match = PHASE.match(line)
+        if match:
+            kind, victim = match.groups()
+            if (kind, victim) == phase:
+                continue  # repeated marker
+            phase = (kind, victim)
+
+            if kind == "Nighttime":
+                close_day()
+                lines.append(f"Night: eliminated by vote - {victim}" if victim else "Night")
+            else:
+                day += 1
+                lines.append(f"Day {day}: killed at night - {victim}" if victim else f"Day {day}")
+            continue
+
+        match = VOTE.match(line)
+        if match:
+            voter, target = (canonical.get(normalize(name), name) for name in match.groups())
+            targets = votes.setdefault(voter, [])
+            if not targets or targets[-1] != target:
+                targets.append(target)
+            continue
+
+        chat = split_chat(line, names)
+        if chat is None:
+            lines.append(line)
+            continue
+
+        speaker, message = chat
+        if filler and is_filler(message, names):
+            continue
+        lines.append(f"{speaker}: {message}")
+
+    close_day()
+    return "\n".join(lines)
+
+
+def format_game_log(game_data):
+    """The game_log input of the agents, in the agent_config.game_log_format format."""
+    if agent_config.game_log_format == "raw":
+        return "\n".join(game_data["log"])
+    if agent_config.game_log_format == "compact":
+        if game_data["id"] not in compact_logs:
+            compact_logs[game_data["id"]] = compact_game_log(game_data)
+        return compact_logs[game_data["id"]]
+    raise ValueError(f"Unsupported game log format: {agent_config.game_log_format}")
+
+
+def corpus_key(games):
+    """Hash of the corpus and the compaction settings, naming its cache file."""
+    payload = json.dumps({"games": games, "drop_filler": drop_filler, "filler": FILLER.pattern}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_compact_corpus(games):
+    """
+    Compact every game of a corpus, reading cache/compact_logs/ if it was compacted before.
+
+    Returns:
+        dict: {game id: compact log}, also used by format_game_log from now on.
+    """
+    path = os.path.join(cache_dir, f"{corpus_key(games)}.json")
+
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+    else:
+        logs = {game_data["id"]: compact_game_log(game_data) for game_data in games}
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(logs, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    compact_logs.update(logs)
+    return logs
+
+
+def savings_report(games):
+    """Print the estimated tokens of the raw and compact game log of every game."""
+    logs = load_compact_corpus(games)
+    header = f'{"game":<40}{"lines":>7}{"raw tok":>9}{"compact":>9}{"saved":>8}'
+    print(header)
+    print("-" * len(header))
+
+    raw_total = compact_total = 0
+    for game_data in games:
+        raw = estimate_tokens("\n".join(game_data["log"]))
+        compact = estimate_tokens(logs[game_data["id"]])
+        raw_total += raw
+        compact_total += compact
+        print(f'{game_data["id"]:<40}{len(game_data["log"]):>7}{raw:>9}{compact:>9}{1 - compact / raw:>8.1%}')
+
+    print("-" * len(header))
+    print(f'{"total":<40}{"":>7}{raw_total:>9}{compact_total:>9}{1 - compact_total / raw_total:>8.1%}')
+
+
+if __name__ == '__main__':
+
+
+    with open('./mafia.json', "r") as f: # Read the game log file
+        data = json.load(f)
+
+    savings_report(data)
@@ -0,0 +1,436 @@
+"""
+Local stand-in for the OpenAI-compatible LLM server, used to benchmark the
+experiment pipeline (message building, result I/O, majority vote and scoring)
+without the live 72B model.
+
+Serves POST /v1/chat/completions, including the json_schema response_format sent by
+beta.chat.completions.parse for AgentConclude / AgentVote, streaming (stream=True, one
+chunk per token), n samples and max_tokens, GET /v1/models, and GET /stats with the request counters.
+
+Like vLLM's automatic prefix caching, the server remembers fixed-size blocks of the
+rendered prompts it has seen; the leading blocks a new prompt shares with an earlier
+one are reported as usage.prompt_tokens_details.cached_tokens and skip the prefill time.
+
+Point a campaign at it with
+    MAFIA_LLM_BASE_URL=http://127.0.0.1:8000/v1 python __init__.py
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+"""Initialization of the server parameters"""
+host = "127.0.0.1"
+port = 8000
+
+
+@dataclass
+class MockServerConfig:
+    """Behaviour of the mock server"""
+
+    latency: str = "lognormal"  # "fixed", "uniform", "exponential" or "lognormal"
+    latency_mean: float = 1.0  # seconds until the first token
+    latency_spread: float = 0.5  # uniform half-width / lognormal sigma
+    seconds_per_token: float = 0.0  # added per completion token
+    seconds_per_prompt_token: float = 0.0  # prefill time, added per prompt token not served from the prefix cache
+    prefix_cache: bool = True
+    prefix_block_chars: int = 64  # about 16 tokens per cached block
+    prefix_cache_blocks: int = 200_000  # least recently used blocks are dropped beyond this
+    error_rate: float = 0.0  # share of requests answered with 500 (InternalServerError)
+    rate_limit_rate: float = 0.0  # share of requests answered with 429 (RateLimitError)
+    malformed_rate: float = 0.0  # share of json_schema answers cut off mid-object, failing the parse
+    agreement_rate: float = 0.0  # share of json_schema answers naming the first two players and outcome, so agents agree
+    runaway_rate: float = 0.0  # share of answers that run on for runaway_words, as at temperature 2.0
+    runaway_words: int = 2000
+    retry_after: float = None  # Retry-After header of the 429 responses, in seconds
+    max_concurrency: int = 64  # requests generated at once; the rest wait in a queue
+    completion_words: int = 60  # length of generated free text
+    seed: int = None
+
+    def sample_latency(self, rng):
+        if self.latency == "fixed":
+            return self.latency_mean
+        if self.latency == "uniform":
+            return max(0.0, rng.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+        if self.latency == "exponential":
+            return rng.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+        if self.latency == "lognormal":
+            if self.latency_mean <= 0:
+                return 0.0
+            # mu chosen so that the distribution keeps latency_mean as its mean
+            sigma = self.latency_spread
+            mu = math.log(self.latency_mean) - sigma ** 2 / 2
+            return rng.lognormvariate(mu, sigma)
+        raise ValueError(f"Unsupported latency distribution: {self.latency}")
+
+
+@dataclass
+class MockServerStats:
+    """Counters exposed on GET /stats"""
+
+    requests: int = 0
+    structured_requests: int = 0
+    streamed_requests: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    abandoned: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    queue_seconds: float = 0.0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def as_dict(self):
+        return {name: value for name, value in vars(self).items() if name != "lock"}
+
+
+FILLER = (
+    "the voting pattern suggests coordination and the late defence looks suspicious "
+    "while the quiet players avoided committing to any target during the day phase"
+).split()
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def message_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+def render_prompt(messages):
+    """The prompt as a chat template would lay it out, so role changes break the shared prefix."""
+    return "".join(
+        f"<|im_start|>{message.get('role', '')}\n{message_text([message])}<|im_end|>\n"
+        for message in messages
+    )
+
+
+def player_names(text):
+    """Player names as they appear at the start of the game log lines ('Name Surname: ...')."""
+    names = sorted(set(re.findall(r"^([A-Z][a-z]+ [A-Z][a-z]+):", text, flags=re.MULTILINE)))
+    return names or ["Player One", "Player Two"]
+
+
+def filler_text(rng, names, words):
+    text = [rng.choice(FILLER) for _ in range(words)]
+    for name in rng.sample(names, min(2, len(names))):
+        text.insert(rng.randrange(len(text) + 1), name)
+    sentence = " ".join(text)
+    return sentence[:1].upper() + sentence[1:] + "."
+
+
+def generate_from_schema(schema, rng, names, words, definitions=None, agree=False):
+    """Generate a value conforming to a (pydantic generated) JSON schema (agree: the same choices every time)."""
+    definitions = definitions if definitions is not None else schema.get("$defs", {})
+
+    if "$ref" in schema:
+        return generate_from_schema(definitions[schema["$ref"].split("/")[-1]], rng, names, words, definitions, agree)
+    if "enum" in schema:
+        return schema["enum"][0] if agree else rng.choice(schema["enum"])
+    if "const" in schema:
+        return schema["const"]
+    if "anyOf" in schema:
+        return generate_from_schema(schema["anyOf"][0], rng, names, words, definitions, agree)
+
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: generate_from_schema(prop, rng, names, words, definitions, agree)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        items = schema.get("items", {})
+        if items.get("type") == "string":
+            return names[:2] if agree else rng.sample(names, min(2, len(names)))
+        return [generate_from_schema(items, rng, names, words, definitions, agree) for _ in range(2)]
+    if kind == "string":
+        return filler_text(rng, names, words)
+    if kind == "integer":
+        return rng.randint(0, 10)
+    if kind == "number":
+        return rng.random()
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return None
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Threading HTTP server holding the mock configuration, counters and queue"""
+
+    daemon_threads = True
+    request_queue_size = 128  # listen backlog; the default of 5 drops connections of a burst of requests
+
+    def __init__(self, address, config=None):
+        self.config = config or MockServerConfig()
+        self.request_queue_size = max(self.request_queue_size, self.config.max_concurrency)  # read by listen() in server_activate
+        super().__init__(address, MockRequestHandler)
+        self.stats = MockServerStats()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.slots = threading.Semaphore(self.config.max_concurrency)
+        self.prefix_blocks = OrderedDict()
+        self.prefix_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def reset(self):
+        """Clear the counters and the prefix cache (e.g. between benchmark scenarios)."""
+        self.stats = MockServerStats()
+        with self.prefix_lock:
+            self.prefix_blocks.clear()
+
+    def cached_prefix_tokens(self, prompt):
+        """Tokens of the longest cached prefix of a prompt; the prompt's blocks are cached afterwards."""
+        if not self.config.prefix_cache:
+            return 0
+
+        size = self.config.prefix_block_chars
+        digest = hashlib.sha256()
+        hit_chars = 0
+        matching = True
+
+        with self.prefix_lock:
+            for start in range(0, len(prompt) - size + 1, size):
+                digest.update(prompt[start:start + size].encode("utf-8"))
+                block = digest.hexdigest()  # chained: identifies the whole prefix up to this block
+
+                if matching and block in self.prefix_blocks:
+                    self.prefix_blocks.move_to_end(block)
+                    hit_chars += size
+                else:
+                    matching = False
+                    self.prefix_blocks[block] = None
+
+            while len(self.prefix_blocks) > self.config.prefix_cache_blocks:
+                self.prefix_blocks.popitem(last=False)
+
+        return hit_chars // 4
+
+    def complete(self, request):
+        """Build the chat.completion response body of a request."""
+        messages = request.get("messages", [])
+        prompt = message_text(messages)
+        names = player_names(prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        cached_tokens = min(self.cached_prefix_tokens(render_prompt(messages)), prompt_tokens)
+
+        with self.rng_lock:
+            rng = random.Random(self.rng.random())
+
+        choices = [self.sample_choice(request, rng, names, index) for index in range(request.get("n") or 1)]
+        completion_tokens = sum(estimate_tokens(choice["message"]["content"]) for choice in choices)
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    def sample_choice(self, request, rng, names, index):
+        """One of the n choices of a request."""
+        words = self.config.runaway_words if rng.random() < self.config.runaway_rate else self.config.completion_words
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            agree = bool(self.config.agreement_rate) and rng.random() < self.config.agreement_rate
+            content = json.dumps(generate_from_schema(schema, rng, names, words, agree=agree))
+            if rng.random() < self.config.malformed_rate:
+                content = content[:len(content) // 2]
+        else:
+            content = filler_text(rng, names, words)
+
+        finish_reason = "stop"
+        if request.get("max_tokens") and estimate_tokens(content) > request["max_tokens"]:
+            content = content[:request["max_tokens"] * 4]
+            finish_reason = "length"
+
+        return {
+            "index": index,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Routes of the OpenAI-compatible API used by the experiment"""
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.stats.lock:
+                self.server.stats.abandoned += 1  # the client cancelled, e.g. a hedged request that lost
+
+    def send_error_json(self, status, message, error_type, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": error_type, "code": status}}, headers)
+
+    def send_stream(self, body, token_seconds, include_usage):
+        """Send a completion as server-sent chunks of about one token (four characters) each."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        choice = body["choices"][0]
+        content = choice["message"]["content"]
+        header = {"id": body["id"], "object": "chat.completion.chunk", "created": body["created"], "model": body["model"]}
+
+        def event(choices, usage=None):
+            chunk = {**header, "choices": choices, "usage": usage}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for start in range(0, len(content), 4):
+                event([{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}])
+                if token_seconds:
+                    time.sleep(token_seconds)
+            event([{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}])
+            if include_usage:
+                event([], body["usage"])
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.stats.lock:
+                self.server.stats.abandoned += 1
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path.rstrip("/") == "/stats":
+            with self.server.stats.lock:
+                self.send_json(200, self.server.stats.as_dict())
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", "not_found")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_error_json(404, f"Unknown path {self.path}", "not_found")
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        server = self.server
+        config = server.config
+        stats = server.stats
+
+        with server.rng_lock:
+            roll = server.rng.random()
+            latency = config.sample_latency(server.rng)
+
+        with stats.lock:
+            stats.requests += 1
+            if (request.get("response_format") or {}).get("type") == "json_schema":
+                stats.structured_requests += 1
+
+        if roll < config.rate_limit_rate:
+            with stats.lock:
+                stats.rate_limited += 1
+            headers = {"Retry-After": str(config.retry_after)} if config.retry_after is not None else None
+            self.send_error_json(429, "Rate limit exceeded (injected)", "rate_limit_error", headers)
+            return
+
+        queued = time.perf_counter()
+        with server.slots:
+            with stats.lock:
+                stats.queue_seconds += time.perf_counter() - queued
+                stats.in_flight += 1
+                stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+
+            try:
+                if roll < config.rate_limit_rate + config.error_rate:
+                    time.sleep(latency)
+                    with stats.lock:
+                        stats.errors += 1
+                    self.send_error_json(500, "Internal server error (injected)", "server_error")
+                    return
+
+                body = server.complete(request)
+                usage = body["usage"]
+                prefill = usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"]
+
+                with stats.lock:
+                    stats.prompt_tokens += usage["prompt_tokens"]
+                    stats.cached_prompt_tokens += usage["prompt_tokens_details"]["cached_tokens"]
+                    stats.completion_tokens += usage["completion_tokens"]
+
+                if request.get("stream"):
+                    with stats.lock:
+                        stats.streamed_requests += 1
+                    time.sleep(latency + config.seconds_per_prompt_token * prefill)
+                    include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+                    self.send_stream(body, config.seconds_per_token, include_usage)
+                    return
+
+                decode = max(estimate_tokens(choice["message"]["content"]) for choice in body["choices"])  # the n samples decode side by side
+                time.sleep(latency + config.seconds_per_prompt_token * prefill + config.seconds_per_token * decode)
+                self.send_json(200, body)
+            finally:
+                with stats.lock:
+                    stats.in_flight -= 1
+
+
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start the mock server on a background thread.
+
+    Returns:
+        MockLLMServer: The running server; its base_url can be given to openai.OpenAI.
+    """
+    server = MockLLMServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+
+
+    server = MockLLMServer((host, port), MockServerConfig())
+    print(f"Mock LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,507 @@
+"""
+Declarative experiment pipelines, played as a graph of stages.
+
+An experiment script lists the stages of a game instead of calling the agents itself:
+
+    stages = [
+        {"name": "statement", "kind": "statement", "agents": ["agent_1_statement", "agent_2_statement"],
+         "reads": "multy_agents", "writes": ["multy_agents", "multy_agents_devil"], "fan_out": True},
+        {"name": "discussion multy_agents", "kind": "discussion", "agents": [...],
+         "reads": "multy_agents", "writes": ["multy_agents"], "rounds": 5},
+        ...
+    ]
+
+Keys of a stage:
+    name     -- unique name, also the name of its span in the traces
+    kind     -- "statement":  the agents answer at the same time, all reading the log of `reads` before
+                              any answer is recorded; the answers become log entries of every mode of `writes`
+                "discussion": `rounds` rounds in turn order, each agent reading and extending the log of `reads`
+                "vote":       the agents answer at the same time from the log of `reads`; the answers become
+                              votes of every mode of `writes` (streamed early with agent_config.early_votes)
+                "copy_vote":  the answer of agent `index` of stage `source` becomes the vote of every mode of `writes`
+                "majority":   the majority vote (pred) of every mode of `writes`
+    agents   -- ids of agent_config.agent_configs, in turn order (an id may repeat)
+    reads    -- mode whose log the agents see
+    writes   -- modes the stage records into
+    rounds   -- rounds of a discussion (default 1)
+    fan_out  -- the requests are the same in every run, so they may be shared (see fan_out.py)
+    source, index -- the stage and agent copied by a copy_vote
+    snapshot -- (discussion stage, rounds): a vote stage reads the log of `reads` as it was after
+                that many rounds of the discussion, as the mode f"{reads}@{rounds}" (see fork_votes)
+
+fork_votes adds a vote stage forked from every shorter depth of a discussion, so one
+run scores the votes after 1, 2, ... rounds in the modes "multy_agents@1", ...: the
+forks read a snapshot of the discussion log, which is shared rather than regenerated.
+
+A stage depends on every earlier stage that writes a (mode, field) it reads or writes, so
+stages recording into the same field keep their spec order, and play_stages starts each stage
+as soon as its dependencies have finished: independent branches (e.g. the discussions of two
+modes) run at the same time. Every stage checkpoints the store and skips, with resume, what an
+interrupted run already recorded.
+"""
+
+import asyncio
+
+import agent_config
+from agent import get_agents
+from checkpoint import logged_messages, stored_section, unit_completed, game_completed
+from context_policy import context_settings
+from convergence import EarlyStopping
+from log_compaction import format_game_log
+from tracing import span
+from utils import save_result_json, log_entry, vote_entry, partial_vote_entry, vote_reason_entry, majority_mafia_vote, majority_winner_vote, score_mafias, score_winner, check_prediction_discrepancy
+
+
+STAGE_KINDS = ["statement", "discussion", "vote", "copy_vote", "majority"]
+
+"""Field of the modes of `writes` each kind of stage records into"""
+WRITTEN_FIELD = {"statement": "log", "discussion": "log", "vote": "vote", "copy_vote": "vote", "majority": "pred"}
+
+
+def check_stages(stages):
+    """Raise a ValueError for a stage that cannot be played."""
+    agent_ids = {config["id"] for config in agent_config.agent_configs}
+    names = set()
+
+    for stage in stages:
+        name, kind = stage.get("name"), stage.get("kind")
+        if kind not in STAGE_KINDS:
+            raise ValueError(f"Stage {name}: unknown kind {kind!r}, expected one of {STAGE_KINDS}")
+        if name in names:
+            raise ValueError(f"Stage {name}: duplicate stage name")
+        if not stage.get("writes"):
+            raise ValueError(f"Stage {name}: no modes to write")
+
+        if kind in ("statement", "discussion", "vote"):
+            unknown = [agent_id for agent_id in stage.get("agents", []) if agent_id not in agent_ids]
+            if unknown or not stage.get("agents"):
+                raise ValueError(f"Stage {name}: no agents or unknown agent ids {unknown}")
+            if not stage.get("reads"):
+                raise ValueError(f"Stage {name}: no log to read")
+        if stage.get("snapshot"):
+            discussion = next((other for other in stages if other["name"] == stage["snapshot"][0]), None)
+            if kind != "vote" or discussion is None or discussion["kind"] != "discussion" or discussion["name"] not in names:
+                raise ValueError(f"Stage {name}: a snapshot is read by a vote stage from an earlier discussion stage")
+            if discussion["reads"] != stage["reads"] or not 0 < stage["snapshot"][1] <= discussion.get("rounds", 1):
+                raise ValueError(f"Stage {name}: no round {stage['snapshot'][1]} in the log of {discussion['name']}")
+        if kind == "discussion" and stage["writes"] != [stage["reads"]]:
+            raise ValueError(f"Stage {name}: a discussion extends the log it reads")
+        if kind == "copy_vote":
+            source = next((other for other in stages if other["name"] == stage.get("source")), None)
+            if source is None or source["name"] not in names or source["kind"] not in ("statement", "vote"):
+                raise ValueError(f"Stage {name}: source must be an earlier statement or vote stage")
+            if not 0 <= stage.get("index", 0) < len(source["agents"]):
+                raise ValueError(f"Stage {name}: no agent {stage.get('index', 0)} in {source['name']}")
+
+        names.add(name)
+
+
+def stage_io(stage):
+    """The (mode, field) resources a stage reads and writes; ("stage", name) stands for its answers."""
+    kind = stage["kind"]
+    writes = {(mode, WRITTEN_FIELD[kind]) for mode in stage["writes"]} | {("stage", stage["name"])}
+
+    if kind == "copy_vote":
+        reads = {("stage", stage["source"])}
+    elif kind == "majority":
+        reads = {(mode, "vote") for mode in stage["writes"]}
+    else:
+        reads = {(stage["reads"], "log")}
+    return reads, writes
+
+
+def dependencies(stages):
+    """{stage name: names of the earlier stages it has to wait for}"""
+    io = [stage_io(stage) for stage in stages]
+    graph = {}
+
+    for i, stage in enumerate(stages):
+        reads, writes = io[i]
+        graph[stage["name"]] = [
+            earlier["name"] for earlier, (earlier_reads, earlier_writes) in zip(stages[:i], io[:i])
+            if earlier_writes & (reads | writes) or earlier_reads & writes
+        ]
+    return graph
+
+
+def entry_count(stage, mode, field):
+    """Entries a stage adds to the field of a mode."""
+    if mode not in stage["writes"] or WRITTEN_FIELD[stage["kind"]] != field:
+        return 0
+    if stage["kind"] == "copy_vote":
+        return 1
+    return len(stage["agents"]) * stage.get("rounds", 1)
+
+
+def entry_offset(stages, stage, mode, field):
+    """Position of the first entry of a stage in the field of a mode, after those of the stages before it."""
+    offset = 0
+    for earlier in stages:
+        if earlier is stage:
+            return offset
+        offset += entry_count(earlier, mode, field)
+    raise ValueError(f"Stage {stage['name']} is not part of the experiment")
+
+
+def stage_agents(stage):
+    """A new Agent for every id of the stage, in turn order."""
+    return [get_agents(agent_id)[0] for agent_id in stage["agents"]]
+
+
+class Game:
+    """State shared by the stages of one game"""
+
+    def __init__(self, stages, run_id, game_id, game_log, store, resume):
+        self.stages = stages
+        self.run_id = run_id
+        self.game_id = game_id
+        self.game_log = game_log
+        self.store = store
+        self.resume = resume
+        self.early = {}  # (stage name, agent index) -> Agent whose reason is still streamed
+
+    def offset(self, stage, mode, field):
+        return entry_offset(self.stages, stage, mode, field)
+
+    def stored(self, stage, mode, field):
+        """The entries of a stage already recorded in the field of a mode (none without resume)."""
+        if not self.resume:
+            return []
+        entries = stored_section(self.store, self.game_id, mode).get(field, [])
+        offset = self.offset(stage, mode, field)
+        return entries[offset:offset + entry_count(stage, mode, field)]
+
+    def save(self, mode, field, entry):
+        save_result_json(self.run_id, mode, field, entry, game_id=self.game_id, store=self.store)
+
+
+async def run_statement(game, stage):
+    """STATEMENT
+    The agents answer at the same time, so their statements are independent;
+    each statement is recorded into every mode of the stage.
+    """
+    agents = stage_agents(stage)
+
+    # Reuse the statements of an interrupted game
+    logged = next((entries for entries in (game.stored(stage, mode, "log") for mode in stage["writes"])
+                   if len(entries) == len(agents)), None)
+    if logged is not None:
+        answers = [(entry["speaker"], entry["message"], entry.get("usage")) for entry in logged]
+    else:
+        opinions = await asyncio.gather(*(
+            agent.aupdate(game.run_id, game.game_id, stage["reads"], agent.name, game.game_log,
+                          store=game.store, fan_out=stage.get("fan_out", False))
+            for agent in agents
+        ))
+        answers = [(agent.name, opinion, agent.latest_usage) for agent, opinion in zip(agents, opinions)]
+
+    for mode in stage["writes"]:
+        for speaker, opinion, usage in answers[len(game.stored(stage, mode, "log")):]:
+            game.save(mode, "log", log_entry(speaker, opinion, usage))
+
+    game.store.flush()  # checkpoint
+
+
+async def run_discussion(game, stage):
+    """DISCUSSION
+    The agents speak in turn order, every turn reading the log extended by the previous ones.
+
+    With agent_config.early_stopping, the discussion ends before a round once
+    every speaker holds the same position (see convergence.py).
+    """
+    agents = stage_agents(stage)
+    mode = stage["reads"]
+    offset = game.offset(stage, mode, "log")
+    rounds = stage.get("rounds", 1)
+
+    stopping = None
+    if agent_config.early_stopping:
+        stopping = EarlyStopping(game.run_id, game.game_id, mode, game.store, offset, len(agents), rounds, game.resume)
+        if stopping.finished():
+            return
+
+    rounds_used = rounds
+    for i in range(rounds):
+        if stopping and await stopping.converged(i, offset + i * len(agents)):
+            rounds_used = i
+            break
+
+        with span("discussion round", mode=mode, round=i):
+
+            for j, agent in enumerate(agents):
+
+                # Skip turns already recorded before an interruption
+                turn = offset + i * len(agents) + j
+                if game.resume and len(logged_messages(game.store, game.game_id, mode)) > turn:
+                    continue
+
+                opinion = await agent.aupdate(game.run_id, game.game_id, mode, agent.name, game.game_log, store=game.store)
+                game.save(mode, "log", log_entry(agent.name, opinion, agent.latest_usage))
+
+            game.store.flush()  # checkpoint after every round
+
+    if stopping:
+        stopping.finish(rounds_used)
+        game.store.flush()
+
+
+async def run_vote(game, stage):
+    """VOTING
+    The voters answer at the same time; votes are not part of the log, so no voter sees another's vote.
+
+    A vote streamed early (see streaming.py) is recorded with its mafias and winner,
+    and completed by its reason in the background.
+    """
+    agents = stage_agents(stage)
+    done = {mode: len(game.stored(stage, mode, "vote")) for mode in stage["writes"]}
+    first = min(done.values())
+    reads = fork_snapshot(game, stage) if stage.get("snapshot") else stage["reads"]
+
+    opinions = await asyncio.gather(*(
+        agent.aupdate(game.run_id, game.game_id, reads, agent.name, game.game_log, store=game.store,
+                      early=agent_config.early_votes, fan_out=stage.get("fan_out", False))
+        for agent in agents[first:]
+    ))
+
+    for index, (agent, opinion) in enumerate(zip(agents[first:], opinions), start=first):
+        vote_modes = [mode for mode in stage["writes"] if index >= done[mode]]
+        for mode in vote_modes:
+            if agent.remainder is None:
+                game.save(mode, "vote", vote_entry(agent.name, opinion, agent.latest_usage))
+            else:
+                game.save(mode, "vote", partial_vote_entry(agent.name, opinion))
+
+        if agent.remainder is not None:
+            game.early[(stage["name"], index)] = agent
+            game.store.defer(record_vote_reason(game, vote_modes, agent))
+
+    game.store.flush()  # checkpoint
+
+
+def snapshot_mode(mode, rounds):
+    return f"{mode}@{rounds}"
+
+
+def fork_snapshot(game, stage):
+    """
+    Register the snapshot read by a forked vote stage: the log of its discussion after
+    `rounds` rounds (or all of it, if the discussion stopped early). Returns its mode.
+    """
+    name, rounds = stage["snapshot"]
+    discussion = next(other for other in game.stages if other["name"] == name)
+    mode = stage["reads"]
+
+    turns = game.offset(discussion, mode, "log") + rounds * len(discussion["agents"])
+    turns = min(turns, len(logged_messages(game.store, game.game_id, mode)))
+    game.store.snapshot(game.game_id, snapshot_mode(mode, rounds), mode, turns)
+    return snapshot_mode(mode, rounds)
+
+
+def fork_votes(stages, discussion_name, vote_name):
+    """
+    Vote stages forked from a discussion after each of its rounds but the last, which the
+    vote stage itself covers, followed by the majority vote of the forks.
+
+    Args:
+        stages: The stages of the experiment, holding both named stages.
+        discussion_name: Name of the discussion stage.
+        vote_name: Name of the vote stage whose agents vote at every depth.
+
+    Returns:
+        list[dict]: The stages to append to the experiment.
+    """
+    discussion = next(stage for stage in stages if stage["name"] == discussion_name)
+    vote = next(stage for stage in stages if stage["name"] == vote_name)
+    mode = discussion["reads"]
+
+    forks = [
+        {
+            "name": f"{vote_name} @{rounds}",
+            "kind": "vote",
+            "agents": vote["agents"],
+            "reads": mode,
+            "writes": [snapshot_mode(mode, rounds)],
+            "snapshot": (discussion_name, rounds)
+        }
+        for rounds in range(1, discussion.get("rounds", 1))
+    ]
+    if not forks:
+        return []
+    return forks + [{
+        "name": f"majority vote {mode} forks",
+        "kind": "majority",
+        "writes": [mode for fork in forks for mode in fork["writes"]]
+    }]
+
+
+async def record_vote_reason(game, vote_modes, agent):
+    """
+    Complete the early vote of an agent in every mode it was recorded in, once its reason is read.
+    If the rest of the answer fails, the vote stays partial (its mafias and winner are already
+    recorded) and the run goes on.
+    """
+    try:
+        opinion = await agent.remainder
+    except Exception as e:
+        print(f"\n[Warning] {game.game_id} {agent.name}: the reason of the early vote in {vote_modes} was not read, "
+              f"the vote stays partial: {e!r}")
+        return
+    for mode in vote_modes:
+        game.save(mode, "vote_reason", vote_reason_entry(agent.name, opinion, agent.latest_usage))
+
+
+async def run_copy_vote(game, stage):
+    """RECORD SINGLE VOTING PART
+    The answer of one agent of an earlier stage is the vote of the modes (and shares its call's usage)."""
+    source = next(other for other in game.stages if other["name"] == stage["source"])
+    index = stage.get("index", 0)
+    field = WRITTEN_FIELD[source["kind"]]
+    mode = source["writes"][0]
+
+    entries = stored_section(game.store, game.game_id, mode).get(field, [])
+    entry = entries[game.offset(source, mode, field) + index]
+    text = entry["message"] if field == "log" else entry["reason"]
+
+    vote_modes = [mode for mode in stage["writes"] if not game.stored(stage, mode, "vote")]
+    for vote_mode in vote_modes:
+        copy = vote_entry(entry["speaker"], text, entry.get("usage"))
+        if entry.get("partial"):
+            copy["partial"] = True
+        game.save(vote_mode, "vote", copy)
+
+    agent = game.early.get((source["name"], index))
+    if entry.get("partial") and agent is not None and vote_modes:
+        game.store.defer(record_vote_reason(game, vote_modes, agent))
+
+    game.store.flush()  # checkpoint
+
+
+async def run_majority(game, stage):
+    """MAJORITY VOTE
+
+    """
+    for mode in stage["writes"]:
+        if game.resume and stored_section(game.store, game.game_id, mode).get("pred"):
+            continue
+
+        game.save(mode, "pred", {
+            "mafias": majority_mafia_vote(game.run_id, game.game_id, mode, store=game.store),
+            "winner": majority_winner_vote(game.run_id, game.game_id, mode, store=game.store)
+        })
+
+
+STAGE_RUNNERS = {
+    "statement": run_statement,
+    "discussion": run_discussion,
+    "vote": run_vote,
+    "copy_vote": run_copy_vote,
+    "majority": run_majority,
+}
+
+
+def experiment_modes(stages):
+    """Every mode recorded by the stages, in order of appearance."""
+    return list(dict.fromkeys(mode for stage in stages for mode in stage["writes"]))
+
+
+def record_context(game, modes):
+    """Store the context policy used for every mode, so results of different policies stay apart."""
+    settings = context_settings()
+
+    for mode in modes:
+        stored = stored_section(game.store, game.game_id, mode).get("context")
+        if stored and stored != settings:
+            print(f"\n[Warning] {game.game_id} {mode} was started with context settings {stored}, now {settings}")
+        if not stored:
+            game.save(mode, "context", settings)
+
+
+async def play_stages(stages, run_id, game_data, store, resume=True):
+    """
+    All LLM stages of one game, each started once the stages it depends on have finished.
+
+    Args:
+        stages: The stage dicts of the experiment (see the module docstring).
+        resume: Skip the games and stages already recorded in the store.
+    """
+    game_id = game_data["id"]
+    modes = experiment_modes(stages)
+    if resume and game_completed(store, game_id, modes):
+        return
+
+    check_stages(stages)
+    game = Game(stages, run_id, game_id, format_game_log(game_data), store, resume)
+    record_context(game, modes)
+
+    graph = dependencies(stages)
+    tasks = {}
+
+    async def play(stage):
+        await asyncio.gather(*(tasks[name] for name in graph[stage["name"]]))
+        print("#", end='')
+        with span(stage["name"], kind=stage["kind"], modes=stage["writes"]):
+            await STAGE_RUNNERS[stage["kind"]](game, stage)
+
+    for stage in stages:
+        tasks[stage["name"]] = asyncio.ensure_future(play(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()  # the other stages of a failed game
+
+
+def run_scoring(modes, run_id, game_data, store, scores, resume=True):
+    """SCORING
+    Store the ground truth and add this game's scores to the running totals.
+
+    Args:
+        scores: {mode: {"score_mafias": int, "score_winner": int}} running totals of the run, updated in place.
+    """
+    print("#", end='')
+    game_id = game_data["id"]
+
+    """True result saving"""
+    true_mafias = [agent["name"] for agent in game_data["agents"] if agent["role"] == "mafioso"]
+    true_winner = ("mafia") if game_data["win"] == "mafioso" else "bystander"
+
+    for mode in modes:
+        completed = resume and unit_completed(store, game_id, mode)
+
+        if not completed:
+            save_result_json(
+                run_id,
+                mode,
+                "true",
+                {
+                    "true mafias": true_mafias,
+                    "true winner": true_winner
+                },
+                game_id=game_id,
+                store=store)
+
+        """Scoring
+        For a completed unit the running totals are rebuilt from the stored pred/true"""
+        scores[mode]["score_mafias"] += score_mafias(run_id, game_id, mode, store=store)
+        scores[mode]["score_winner"] += score_winner(run_id, game_id, mode, store=store)
+
+        if completed:
+            continue
+
+        save_result_json(run_id, mode, "score_mafias", scores[mode]["score_mafias"], game_id=game_id, store=store)
+        save_result_json(run_id, mode, "score_winner", scores[mode]["score_winner"], game_id=game_id, store=store)
+
+
+def score_stages(modes, run_id, game_data, store, scores, resume=True):
+    """Score one played game and print the running totals of every mode."""
+    run_scoring(modes, run_id, game_data, store, scores, resume)
+
+    print("Scores:")
+    for mode in modes:
+        print(f"  {mode:<20} - mafias: {scores[mode]['score_mafias']}, winner: {scores[mode]['score_winner']}")
+
+    check_prediction_discrepancy(run_id, game_data["id"], store=store)
+
+
+def new_scores(modes):
+    return {mode: {"score_mafias": 0, "score_winner": 0} for mode in modes}
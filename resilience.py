@@ -0,0 +1,112 @@
+"""
+Retry, timeout and circuit-breaker policy of the LLM calls.
+
+Server errors (500), rate limits (429), timeouts and connection errors are retried
+with exponential backoff and jitter; a 429 with a Retry-After header waits at least
+that long. The per-request timeout is set on the clients in agent_config.py.
+
+Every endpoint has a circuit breaker shared by all games of the process (see
+endpoint_pool.py): after breaker_failure_threshold consecutive failures it opens, and
+the endpoint gets no calls for breaker_cooldown seconds instead of each game hammering
+a server that is down. One more failure after the cooldown opens it again.
+
+retry_stats counts the retries, the time spent waiting on them and on the open breaker.
+"""
+
+import threading
+import time
+from collections import Counter
+
+import openai
+from tenacity import retry_if_exception_type, stop_after_attempt, stop_never, wait_exponential_jitter
+
+import agent_config
+from tracing import instant, record_retry
+
+
+RETRYABLE_ERRORS = (
+    openai.InternalServerError,
+    openai.RateLimitError,
+    openai.APIConnectionError,  # includes openai.APITimeoutError
+)
+
+"""Retry and circuit-breaker counters of this process"""
+retry_stats = Counter()
+
+
+def retry_after(error):
+    """Seconds asked by the server's Retry-After header, or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class wait_backoff:
+    """tenacity wait: exponential backoff with jitter, at least the Retry-After of a rate limit"""
+
+    def __init__(self):
+        self.backoff = wait_exponential_jitter(
+            initial=agent_config.retry_initial_wait,
+            max=agent_config.retry_max_wait,
+            jitter=agent_config.retry_jitter,
+        )
+
+    def __call__(self, retry_state):
+        wait = self.backoff(retry_state)
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        requested = retry_after(error) if isinstance(error, openai.RateLimitError) else None
+        if requested is not None:
+            wait = max(wait, min(requested, agent_config.retry_max_wait))
+        return wait
+
+
+def count_retry(retry_state):
+    """tenacity before_sleep callback: update retry_stats and the trace."""
+    error = retry_state.outcome.exception() if retry_state.outcome else None
+    retry_stats["retries"] += 1
+    retry_stats[f"retries_{type(error).__name__}"] += 1
+    retry_stats["retry_wait_seconds"] += retry_state.next_action.sleep if retry_state.next_action else 0.0
+    record_retry(retry_state)
+
+
+def retry_policy():
+    """Keyword arguments of tenacity.Retrying / AsyncRetrying for one LLM call, from agent_config."""
+    attempts = agent_config.retry_max_attempts
+    return dict(
+        wait=wait_backoff(),
+        stop=stop_after_attempt(attempts) if attempts else stop_never,
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        before_sleep=count_retry,
+        reraise=True,
+    )
+
+
+class CircuitBreaker:
+    """Keeps the calls of the process away from an endpoint while it keeps failing"""
+
+    def __init__(self, name="LLM endpoint"):
+        self.name = name
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds until the breaker closes again (0 when closed)."""
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= agent_config.breaker_failure_threshold and not self.remaining():
+                self.open_until = time.monotonic() + agent_config.breaker_cooldown
+                retry_stats["breaker_opened"] += 1
+                print(f"\n[Warning] {self.name} failed {self.failures} times in a row, pausing its calls for {agent_config.breaker_cooldown:.0f} s")
+                instant("circuit open", "llm", endpoint=self.name, failures=self.failures)
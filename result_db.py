@@ -0,0 +1,382 @@
+"""
+SQLite backend of the results (utils.result_backend = "sqlite").
+
+Every run of a result directory is kept in {result_dir}/results.sqlite instead of
+{run_id}_result.json and its journal, behind the same API: save_result_json and
+ResultStore.flush() insert their records, load_result_json rebuilds the nested
+{game_id: {mode: {...}}} data of a run, and the analysis helpers of utils.py
+(score_mafias, score_winner, majority votes, check_prediction_discrepancy) read only
+the game they ask about. Tables, all indexed on (run_id, game_id, mode):
+
+    logs    -- one row per log entry, in order
+    votes   -- one row per vote entry, in order (also indexed on game_id, mode, speaker)
+    preds   -- majority vote of a mode
+    truths  -- ground truth of a mode
+    scores  -- cumulative score_mafias / score_winner
+    fields  -- the other fields (summary, context, convergence, early_stop) as JSON
+
+Cross-run questions become one query, e.g. every devil vote of Agent_3 for a game:
+
+    query_votes(game_id=game_id, mode="multy_agents_devil", speaker="Agent_3")
+
+import_json / export_json convert between the database and the JSON result files;
+run the file to import results/ (or export it back with direction = "export").
+benchmark.py with suite = "query" compares the query latency with the file scan.
+"""
+
+import json
+import os
+import sqlite3
+
+from result_records import _new_game_entry
+
+
+DB_NAME = "results.sqlite"
+DEFAULT_DIR = "results"  # utils.py passes its result_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (run_id TEXT, game_id TEXT, position INTEGER, PRIMARY KEY (run_id, game_id));
+CREATE TABLE IF NOT EXISTS sections (run_id TEXT, game_id TEXT, mode TEXT, position INTEGER, PRIMARY KEY (run_id, game_id, mode));
+CREATE TABLE IF NOT EXISTS logs (run_id TEXT, game_id TEXT, mode TEXT, position INTEGER, speaker TEXT, message TEXT, usage TEXT, extra TEXT);
+CREATE TABLE IF NOT EXISTS votes (run_id TEXT, game_id TEXT, mode TEXT, position INTEGER, speaker TEXT, mafias TEXT, winner TEXT, reason TEXT, usage TEXT, partial INTEGER, extra TEXT);
+CREATE TABLE IF NOT EXISTS preds (run_id TEXT, game_id TEXT, mode TEXT, mafias TEXT, winner TEXT, PRIMARY KEY (run_id, game_id, mode));
+CREATE TABLE IF NOT EXISTS truths (run_id TEXT, game_id TEXT, mode TEXT, mafias TEXT, winner TEXT, PRIMARY KEY (run_id, game_id, mode));
+CREATE TABLE IF NOT EXISTS scores (run_id TEXT, game_id TEXT, mode TEXT, score_mafias INTEGER DEFAULT 0, score_winner INTEGER DEFAULT 0, PRIMARY KEY (run_id, game_id, mode));
+CREATE TABLE IF NOT EXISTS fields (run_id TEXT, game_id TEXT, mode TEXT, field TEXT, position INTEGER, entry TEXT);
+CREATE INDEX IF NOT EXISTS logs_unit ON logs (run_id, game_id, mode, position);
+CREATE INDEX IF NOT EXISTS votes_unit ON votes (run_id, game_id, mode, position);
+CREATE INDEX IF NOT EXISTS votes_speaker ON votes (game_id, mode, speaker);
+CREATE INDEX IF NOT EXISTS fields_unit ON fields (run_id, game_id, mode, field, position);
+"""
+
+TABLES = ["games", "sections", "logs", "votes", "preds", "truths", "scores", "fields"]
+
+LOG_COLUMNS = ("speaker", "message", "usage")
+VOTE_COLUMNS = ("speaker", "mafias", "winner", "reason", "usage", "partial")
+
+connections = {}  # (path, pid) -> sqlite3.Connection; a forked campaign worker opens its own
+
+
+def db_path(directory=None):
+    return os.path.join(directory or DEFAULT_DIR, DB_NAME)
+
+
+def connect(directory=None):
+    """The connection to the database of a result directory, created with its tables on first use."""
+    path = db_path(directory)
+    key = (path, os.getpid())
+    if key not in connections:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30.0)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connections[key] = connection
+    return connections[key]
+
+
+def close(directory=None):
+    connection = connections.pop((db_path(directory), os.getpid()), None)
+    if connection is not None:
+        connection.close()
+
+
+def dumps(value):
+    return None if value is None else json.dumps(value, ensure_ascii=False)
+
+
+def loads(text):
+    return None if text is None else json.loads(text)
+
+
+def present(entry, key):
+    """A column of an entry key: NULL when the key is missing, JSON (so 'null' for None) when it is there."""
+    return json.dumps(entry[key], ensure_ascii=False) if key in entry else None
+
+
+def keyed(pairs):
+    """The entry of (key, column) pairs, without the keys whose column is NULL (see present)."""
+    return {key: json.loads(column) for key, column in pairs if column is not None}
+
+
+def extra_of(entry, columns):
+    """The keys of an entry that have no column of their own, as JSON (None if there are none)."""
+    extra = {key: value for key, value in entry.items() if key not in columns}
+    return dumps(extra) if extra else None
+
+
+def next_position(connection, table, run_id, game_id, mode, field=None):
+    query = f"SELECT COUNT(*) FROM {table} WHERE run_id = ? AND game_id = ? AND mode = ?"
+    args = [run_id, game_id, mode]
+    if field is not None:
+        query += " AND field = ?"
+        args.append(field)
+    return connection.execute(query, args).fetchone()[0]
+
+
+def insert_record(connection, run_id, record, default_sections=True):
+    """Apply one save_result_json record (see make_result_record), as apply_result_entry does."""
+    game_id, mode, field, entry = record["game_id"], record["mode"], record["field"], record["entry"]
+    unit = (run_id, game_id, mode)
+
+    created = connection.execute(
+        "INSERT OR IGNORE INTO games VALUES (?, ?, (SELECT COUNT(*) FROM games WHERE run_id = ?))",
+        (run_id, game_id, run_id)).rowcount
+    if created and default_sections:
+        # A new game starts with the three default modes, as in _new_game_entry
+        for position, default_mode in enumerate(_new_game_entry()):
+            connection.execute("INSERT INTO sections VALUES (?, ?, ?, ?)", (run_id, game_id, default_mode, position))
+    connection.execute(
+        "INSERT OR IGNORE INTO sections VALUES (?, ?, ?, (SELECT COUNT(*) FROM sections WHERE run_id = ? AND game_id = ?))",
+        (*unit, run_id, game_id))
+
+    if field == "log":
+        connection.execute(
+            "INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*unit, next_position(connection, "logs", *unit), entry.get("speaker"), entry.get("message"),
+             present(entry, "usage"), extra_of(entry, LOG_COLUMNS)))
+
+    elif field == "vote":
+        connection.execute(
+            "INSERT INTO votes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*unit, next_position(connection, "votes", *unit), entry.get("speaker"), dumps(entry.get("mafias")),
+             dumps(entry.get("winner")), entry.get("reason"), present(entry, "usage"),
+             1 if entry.get("partial") else 0, extra_of(entry, VOTE_COLUMNS)))
+
+    elif field == "vote_reason":
+        # Completes the partial vote of the speaker
+        connection.execute(
+            "UPDATE votes SET reason = ?, usage = ?, partial = 0 WHERE rowid = ("
+            "SELECT rowid FROM votes WHERE run_id = ? AND game_id = ? AND mode = ? AND speaker = ? AND partial = 1 "
+            "ORDER BY position DESC LIMIT 1)",
+            (entry["reason"], json.dumps(entry.get("usage"), ensure_ascii=False), *unit, entry["speaker"]))
+
+    elif field == "pred":
+        connection.execute("INSERT OR REPLACE INTO preds VALUES (?, ?, ?, ?, ?)",
+                           (*unit, present(entry, "mafias"), present(entry, "winner")))
+
+    elif field == "true":
+        connection.execute("INSERT OR REPLACE INTO truths VALUES (?, ?, ?, ?, ?)",
+                           (*unit, present(entry, "true mafias"), present(entry, "true winner")))
+
+    elif field in ["score_mafias", "score_winner"]:
+        connection.execute(
+            f"INSERT INTO scores (run_id, game_id, mode, {field}) VALUES (?, ?, ?, ?) "
+            f"ON CONFLICT (run_id, game_id, mode) DO UPDATE SET {field} = excluded.{field}",
+            (*unit, int(entry)))
+
+    elif field in ["summary", "convergence"]:
+        connection.execute("INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?)",
+                           (*unit, field, next_position(connection, "fields", *unit, field), dumps(entry)))
+
+    elif field in ["context", "early_stop"]:
+        connection.execute("DELETE FROM fields WHERE run_id = ? AND game_id = ? AND mode = ? AND field = ?", (*unit, field))
+        connection.execute("INSERT INTO fields VALUES (?, ?, ?, ?, 0, ?)", (*unit, field, dumps(entry)))
+
+    else:
+        raise ValueError(f"Unsupported field: {field}")
+
+
+def save_records(run_id, records, directory=None):
+    """Insert save_result_json records of a run in one transaction."""
+    connection = connect(directory)
+    with connection:
+        for record in records:
+            insert_record(connection, str(run_id), record)
+
+
+def read_games(connection, run_id, game_ids):
+    """The nested data of some games of a run, in their stored order."""
+    data = {game_id: {} for game_id in game_ids}
+    if not game_ids:
+        return data
+    defaults = _new_game_entry()
+
+    marks = ",".join("?" * len(game_ids))
+    where = f"run_id = ? AND game_id IN ({marks})"
+    args = [run_id, *game_ids]
+
+    for game_id, mode in connection.execute(f"SELECT game_id, mode FROM sections WHERE {where} ORDER BY position", args):
+        data[game_id][mode] = json.loads(json.dumps(defaults[mode])) if mode in defaults else {}
+
+    for game_id, mode, speaker, message, usage, extra in connection.execute(
+            f"SELECT game_id, mode, speaker, message, usage, extra FROM logs WHERE {where} ORDER BY position", args):
+        entry = {"speaker": speaker, "message": message}
+        if usage is not None:
+            entry["usage"] = loads(usage)
+        entry.update(loads(extra) or {})
+        data[game_id][mode].setdefault("log", []).append(entry)
+
+    for game_id, mode, speaker, mafias, winner, reason, usage, partial, extra in connection.execute(
+            f"SELECT game_id, mode, speaker, mafias, winner, reason, usage, partial, extra FROM votes "
+            f"WHERE {where} ORDER BY position", args):
+        entry = {"speaker": speaker, "mafias": loads(mafias), "winner": loads(winner), "reason": reason}
+        if usage is not None:
+            entry["usage"] = loads(usage)
+        if partial:
+            entry["partial"] = True
+        entry.update(loads(extra) or {})
+        data[game_id][mode].setdefault("vote", []).append(entry)
+
+    for game_id, mode, mafias, winner in connection.execute(
+            f"SELECT game_id, mode, mafias, winner FROM preds WHERE {where}", args):
+        data[game_id][mode]["pred"] = keyed((("mafias", mafias), ("winner", winner)))
+
+    for game_id, mode, mafias, winner in connection.execute(
+            f"SELECT game_id, mode, mafias, winner FROM truths WHERE {where}", args):
+        data[game_id][mode]["true"] = keyed((("true mafias", mafias), ("true winner", winner)))
+
+    for game_id, mode, score_mafias, score_winner in connection.execute(
+            f"SELECT game_id, mode, score_mafias, score_winner FROM scores WHERE {where}", args):
+        data[game_id][mode].update(score_mafias=score_mafias, score_winner=score_winner)
+
+    for game_id, mode, field, entry in connection.execute(
+            f"SELECT game_id, mode, field, entry FROM fields WHERE {where} ORDER BY position", args):
+        if field in ["summary", "convergence"]:
+            data[game_id][mode].setdefault(field, []).append(loads(entry))
+        else:
+            data[game_id][mode][field] = loads(entry)
+
+    return data
+
+
+def load_run(run_id, directory=None):
+    """The nested {game_id: {mode: {...}}} data of a run, empty if nothing was saved."""
+    connection = connect(directory)
+    game_ids = [game_id for (game_id,) in connection.execute(
+        "SELECT game_id FROM games WHERE run_id = ? ORDER BY position", (str(run_id),))]
+    return read_games(connection, str(run_id), game_ids)
+
+
+def load_game(run_id, game_id, directory=None):
+    """The {mode: {...}} data of one game of a run, or an empty dict."""
+    connection = connect(directory)
+    if connection.execute("SELECT 1 FROM games WHERE run_id = ? AND game_id = ?", (str(run_id), game_id)).fetchone() is None:
+        return {}
+    return read_games(connection, str(run_id), [game_id])[game_id]
+
+
+def run_exists(run_id, directory=None):
+    if not os.path.exists(db_path(directory)):
+        return False
+    return connect(directory).execute("SELECT 1 FROM games WHERE run_id = ? LIMIT 1", (str(run_id),)).fetchone() is not None
+
+
+def run_records(data):
+    """The save_result_json records rebuilding nested data, in its order."""
+    for game_id, game_data in data.items():
+        for mode, section in game_data.items():
+            for field, value in section.items():
+                if field in ["log", "vote", "summary", "convergence"]:
+                    for entry in value:
+                        yield {"game_id": game_id, "mode": mode, "field": field, "entry": entry}
+                else:
+                    yield {"game_id": game_id, "mode": mode, "field": field, "entry": value}
+
+
+def replace_run(run_id, data, directory=None):
+    """Replace every row of a run with the nested data (e.g. the merged shards of a campaign)."""
+    connection = connect(directory)
+    with connection:
+        for table in TABLES:
+            connection.execute(f"DELETE FROM {table} WHERE run_id = ?", (str(run_id),))
+        for position, (game_id, game_data) in enumerate(data.items()):
+            connection.execute("INSERT INTO games VALUES (?, ?, ?)", (str(run_id), game_id, position))
+            for mode_position, mode in enumerate(game_data):
+                connection.execute("INSERT INTO sections VALUES (?, ?, ?, ?)", (str(run_id), game_id, mode, mode_position))
+        for record in run_records(data):
+            insert_record(connection, str(run_id), record, default_sections=False)
+
+
+def order_games(run_id, game_order, directory=None):
+    """Store the games of a run in the order of game_order (the others after them)."""
+    connection = connect(directory)
+    rank = {game_id: i for i, game_id in enumerate(game_order)}
+    game_ids = [game_id for (game_id,) in connection.execute(
+        "SELECT game_id FROM games WHERE run_id = ? ORDER BY position", (str(run_id),))]
+    with connection:
+        for position, game_id in enumerate(sorted(game_ids, key=lambda game_id: rank.get(game_id, len(rank)))):
+            connection.execute("UPDATE games SET position = ? WHERE run_id = ? AND game_id = ?", (position, str(run_id), game_id))
+
+
+def query_votes(game_id=None, mode=None, speaker=None, run_ids=None, directory=None):
+    """
+    Vote entries across runs, e.g. every Agent_3 vote of the multy_agents_devil mode for a game.
+
+    Returns:
+        list[dict]: The vote entries, each with its run_id, game_id and mode.
+    """
+    conditions, args = [], []
+    for column, value in (("game_id", game_id), ("mode", mode), ("speaker", speaker)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            args.append(value)
+    if run_ids is not None:
+        run_ids = [str(run_id) for run_id in run_ids]
+        conditions.append(f"run_id IN ({','.join('?' * len(run_ids))})")
+        args.extend(run_ids)
+
+    query = "SELECT run_id, game_id, mode, speaker, mafias, winner, reason FROM votes"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return [
+        {"run_id": run, "game_id": game, "mode": vote_mode, "speaker": name,
+         "mafias": loads(mafias), "winner": loads(winner), "reason": reason}
+        for run, game, vote_mode, name, mafias, winner, reason in connect(directory).execute(query + " ORDER BY run_id, position", args)
+    ]
+
+
+def json_run_ids(directory=None):
+    """Run ids of the JSON result files of a directory."""
+    directory = directory or DEFAULT_DIR
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    run_ids = {name[:-len(suffix)] for name in names for suffix in ("_result.json", "_result.jsonl") if name.endswith(suffix)}
+    return sorted(run_ids, key=lambda run_id: (not run_id.isdigit(), int(run_id) if run_id.isdigit() else run_id))
+
+
+def import_json(read_run, run_ids=None, directory=None, source_dir=None):
+    """
+    Copy the JSON result files of some runs, read from source_dir (the database directory
+    by default), into the database.
+
+    Args:
+        read_run: Function (run_id, directory) returning the nested data of the JSON files
+            of a run, i.e. utils.read_result_files.
+    """
+    source_dir = source_dir or directory
+    run_ids = json_run_ids(source_dir) if run_ids is None else run_ids
+    for run_id in run_ids:
+        replace_run(run_id, read_run(run_id, source_dir), directory)
+    return run_ids
+
+
+def export_json(write_run, run_ids=None, directory=None):
+    """
+    Write runs of the database back to their JSON result files.
+
+    Args:
+        write_run: Function (run_id, data, directory) writing the JSON result file of a run,
+            i.e. utils.write_result_file (in utils.result_format).
+    """
+    connection = connect(directory)
+    if run_ids is None:
+        run_ids = [run_id for (run_id,) in connection.execute("SELECT DISTINCT run_id FROM games")]
+    for run_id in run_ids:
+        write_run(run_id, load_run(run_id, directory), directory)
+    return run_ids
+
+
+"""Initialization of the conversion parameters"""
+direction = "import"  # "import": results/*.json into results/results.sqlite, "export": back to JSON
+
+
+if __name__ == '__main__':
+
+
+    import utils
+
+    if direction == "import":
+        run_ids = import_json(utils.read_result_files)
+        print(f"Imported {len(run_ids)} runs into {db_path()}")
+    else:
+        run_ids = export_json(utils.write_result_file)
+        print(f"Exported {len(run_ids)} runs from {db_path()}")
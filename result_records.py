@@ -0,0 +1,98 @@
+"""
+The records of the results: the empty structure of a game, and the validation and
+application of one save_result_json record to the nested {game_id: {mode: {...}}} data.
+Shared by utils.py (JSON files and journal) and result_db.py (sqlite) without importing either.
+"""
+
+
+RESULT_FIELDS = ["log", "vote", "pred", "true", "score_mafias", "score_winner", "summary", "context", "vote_reason", "convergence", "early_stop"]
+
+
+def _new_game_entry():
+    """Return the empty per-game structure shared by all three modes."""
+    return {
+        "multy_agents": {
+            "log": [],
+            "vote": [],
+            "pred": {},
+            "true": {},
+            "score_mafias": 0,
+            "score_winner": 0
+        },
+        "multy_agents_devil": {
+            "log": [],
+            "vote": [],
+            "pred": {},
+            "true": {},
+            "score_mafias": 0,
+            "score_winner": 0
+        },
+        "single_agent": {
+            "vote": [],
+            "pred": {},
+            "true": {},
+            "score_mafias": 0,
+            "score_winner": 0
+        }
+    }
+
+
+def apply_result_entry(data, mode, field, entry, game_id="unknown_game"):
+    """
+    Apply a single save_result_json record to the nested result structure in place.
+
+    Args:
+        data: The {game_id: {mode: {...}}} dictionary to update.
+        mode: Either "multy_agents", "multy_agents_devil" or "single_agent".
+        field: The field name to write ("log", "vote", "pred", "true", "score_mafias", "score_winner",
+            "summary" for the rolling summaries of the context policy, "context" for its settings,
+            "vote_reason" for the full reason of a vote recorded early, see partial_vote_entry,
+            "convergence" for the consensus checks and "early_stop" for the rounds used, see convergence.py).
+        entry: The data to be saved (type depends on the field).
+        game_id: The current game ID (used as the top-level key).
+    """
+
+    # Initialize the structure for this game_id
+    if game_id not in data:
+        data[game_id] = _new_game_entry()
+
+    # Write data to the specified field; modes other than the three default ones (e.g. the
+    # votes forked at every discussion depth, "multy_agents@2") get their section on first use
+    section = data[game_id].setdefault(mode, {})
+
+    if field in ["log", "vote", "summary", "convergence"]:
+        if not isinstance(section.get(field), list):
+            section[field] = []
+        section[field].append(entry)
+
+    elif field in ["pred", "true", "context", "early_stop"]:
+        if not isinstance(section.get(field), dict):
+            section[field] = {}
+        section[field] = entry
+
+    elif field in ["score_mafias", "score_winner"]:
+        section[field] = int(entry)
+
+    elif field == "vote_reason":
+        # Completes the partial vote of the speaker in place
+        for vote in reversed(section.get("vote", [])):
+            if vote.get("speaker") == entry["speaker"] and vote.get("partial"):
+                vote.update(reason=entry["reason"], usage=entry.get("usage"))
+                del vote["partial"]
+                break
+
+    else:
+        raise ValueError(f"Unsupported field: {field}")
+
+    return data
+
+
+def make_result_record(mode, field, entry, game_id="unknown_game"):
+    """Validate a save_result_json call and turn it into a journal record."""
+    if field not in RESULT_FIELDS:
+        raise ValueError(f"Unsupported field: {field}")
+
+    if field in ["score_mafias", "score_winner"]:
+        entry = int(entry)
+
+    return {"game_id": game_id, "mode": mode, "field": field, "entry": entry}
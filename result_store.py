@@ -0,0 +1,90 @@
+"""
+In-memory result store shared by the agents, the majority votes and the scoring
+within one run, so that results/{run_id}_result.json is not re-parsed on every read.
+"""
+
+import asyncio
+
+from conversation import Conversation
+from tracing import span
+from utils import apply_result_entry, append_result_journal, compact_result_json, load_result_json, make_result_record
+
+
+class ResultStore:
+    """
+    Holds the nested {game_id: {mode: {...}}} data of one run in memory.
+
+    save() updates the in-memory view immediately; the records only reach the
+    journal on flush() (called at game boundaries) and the compacted
+    results/{run_id}_result.json on compact() (called at the end of a run).
+    Saved log entries are also appended to the in-memory Conversation of their (game, mode).
+    Work that may outlive its game (the reasons of early votes) is handed to defer()
+    and awaited by drain() before the run is compacted.
+    """
+
+    def __init__(self, run_id, data=None):
+        self.run_id = run_id
+        if data is None:
+            with span("result load", "io", run_id=run_id):
+                data = load_result_json(run_id)
+        self.data = data
+        self.pending = []
+        self.conversations = {}
+        self.background = set()
+
+    def save(self, mode, field, entry, game_id="unknown_game"):
+        """Same contract as utils.save_result_json, but kept in memory until flush()."""
+        record = make_result_record(mode, field, entry, game_id)
+        apply_result_entry(self.data, record["mode"], record["field"], record["entry"], record["game_id"])
+        self.pending.append(record)
+
+        conversation = self.conversations.get((record["game_id"], record["mode"]))
+        if record["field"] == "log" and conversation is not None:
+            conversation.append(record["entry"].get("speaker", ""), record["entry"].get("message", ""))
+
+    def game(self, game_id):
+        """Return the stored data of a game, or an empty dict if nothing was saved yet."""
+        return self.data.get(game_id, {})
+
+    def conversation(self, game_id, mode):
+        """The Conversation of a (game, mode), built from the stored log on first use."""
+        key = (game_id, mode)
+        if key not in self.conversations:
+            self.conversations[key] = Conversation.from_section(self.game(game_id).get(mode, {}))
+        return self.conversations[key]
+
+    def snapshot(self, game_id, mode, source, turns):
+        """
+        Make the Conversation of (game, mode) the first `turns` turns of the log of
+        (game, source), e.g. for votes forked from a discussion after a number of rounds.
+        """
+        summaries = self.game(game_id).get(source, {}).get("summary", [])
+        self.conversations[(game_id, mode)] = self.conversation(game_id, source).snapshot(turns, summaries)
+        return self.conversations[(game_id, mode)]
+
+    def defer(self, coroutine):
+        """Run a coroutine in the background of the run, e.g. the rest of an early vote."""
+        task = asyncio.ensure_future(coroutine)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
+    async def drain(self):
+        """Wait for the deferred work of the run."""
+        while self.background:
+            await asyncio.gather(*self.background)
+
+    def flush(self):
+        """Append the pending records to results/{run_id}_result.jsonl."""
+        if not self.pending:
+            return
+        with span("result flush", "io", records=len(self.pending)):
+            append_result_journal(self.run_id, self.pending)
+        self.pending = []
+
+    def compact(self, game_order=None):
+        """Flush and fold the journal into results/{run_id}_result.json."""
+        self.flush()
+        with span("result compact", "io"):
+            self.data = compact_result_json(self.run_id, game_order)
+        return self.data
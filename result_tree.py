@@ -0,0 +1,208 @@
+"""
+Deduplicated storage of the results: the transcripts of a run as a tree of turns.
+
+The nested {game_id: {mode: {...}}} data repeats a lot of text: the initial statements
+are logged in both discussion modes and copied again as the reason of the single_agent
+vote, and every vote embeds its mafias and winner, which its reason already holds.
+The tree format stores each text once and each transcript as a path in a tree of turns:
+
+    {
+        "format": "conversation_tree",
+        "texts": [text, ...],
+        "turns": [{"parent": turn id or None, "speaker": ..., "text": text id, "usage": ...}, ...],
+        "games": {game_id: {mode: {"log": id of the last turn or None,
+                                   "vote": [{"speaker": ..., "text": text id, ...}, ...],
+                                   "summary": [{"turns": ..., "text": text id, ...}, ...],
+                                   "pred": {...}, "true": {...}, ...}}}
+    }
+
+Ids are positions in the texts / turns lists. Transcripts with a common beginning (the
+statements shared by multy_agents and multy_agents_devil) share the turns of that prefix. A vote keeps its mafias and winner only
+if they differ from what extract_mafia_vote / extract_outcome_vote read from its reason.
+
+utils.write_result_json writes this format when utils.result_format is "tree", and
+utils.load_result_json expands either format back into the nested data, so the rest of
+the code never sees the tree. Run the file to convert the files of results/ in place
+(convert_to = "tree" or "nested") and print their sizes before and after.
+"""
+
+import json
+import os
+
+from vote_parsing import extract_mafia_vote, extract_outcome_vote
+
+
+FORMAT = "conversation_tree"
+
+
+def is_tree(data):
+    return isinstance(data, dict) and data.get("format") == FORMAT
+
+
+class TreeBuilder:
+    """Interns the texts and turns of a run"""
+
+    def __init__(self):
+        self.texts = []
+        self.text_ids = {}
+        self.turns = []
+        self.turn_ids = {}
+
+    def text(self, text):
+        if text not in self.text_ids:
+            self.text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        return self.text_ids[text]
+
+    def turn(self, parent, entry):
+        node = {"parent": parent}
+        for key, value in entry.items():
+            if key == "message":
+                node["text"] = self.text(value)
+            else:
+                node[key] = value
+
+        key = json.dumps(node, sort_keys=True, ensure_ascii=False)
+        if key not in self.turn_ids:
+            self.turn_ids[key] = len(self.turns)
+            self.turns.append(node)
+        return self.turn_ids[key]
+
+    def log(self, entries):
+        tip = None
+        for entry in entries:
+            tip = self.turn(tip, entry)
+        return tip
+
+    def vote(self, entry):
+        node = {key: value for key, value in entry.items() if key != "reason"}
+        reason = entry.get("reason")
+        if isinstance(reason, str):
+            node["text"] = self.text(reason)
+            if node.get("mafias") == extract_mafia_vote(reason) and node.get("winner") == extract_outcome_vote(reason):
+                node.pop("mafias", None)
+                node.pop("winner", None)
+        else:
+            node["reason"] = reason
+        return node
+
+    def summary(self, entry):
+        node = {key: value for key, value in entry.items() if key != "summary"}
+        node["text"] = self.text(entry.get("summary", ""))
+        return node
+
+
+def build_tree(data):
+    """The tree format of nested result data."""
+    builder = TreeBuilder()
+    games = {}
+
+    for game_id, game_data in data.items():
+        games[game_id] = {}
+        for mode, section in game_data.items():
+            stored = {}
+            for field, value in section.items():
+                if field == "log" and isinstance(value, list):
+                    stored[field] = builder.log(value)
+                elif field == "vote" and isinstance(value, list):
+                    stored[field] = [builder.vote(entry) for entry in value]
+                elif field == "summary" and isinstance(value, list):
+                    stored[field] = [builder.summary(entry) for entry in value]
+                else:
+                    stored[field] = value
+            games[game_id][mode] = stored
+
+    return {"format": FORMAT, "texts": builder.texts, "turns": builder.turns, "games": games}
+
+
+def expand_log(tree, tip, cache):
+    """The log entries of the path ending at turn `tip`; cache holds the expanded prefixes."""
+    path = []
+    while tip is not None and tip not in cache:
+        path.append(tip)
+        tip = tree["turns"][tip]["parent"]
+
+    entries = cache[tip] if tip is not None else []
+    for turn in reversed(path):
+        entry = {}
+        for key, value in tree["turns"][turn].items():
+            if key == "text":
+                entry["message"] = tree["texts"][value]
+            elif key != "parent":
+                entry[key] = value
+        entries = cache[turn] = entries + [entry]
+    return entries
+
+
+def expand_vote(tree, node):
+    if "text" not in node:
+        return dict(node)
+
+    reason = tree["texts"][node["text"]]
+    entry = {
+        "speaker": node.get("speaker"),
+        "mafias": node["mafias"] if "mafias" in node else extract_mafia_vote(reason),
+        "winner": node["winner"] if "winner" in node else extract_outcome_vote(reason),
+        "reason": reason,
+    }
+    entry.update((key, value) for key, value in node.items() if key not in ("speaker", "mafias", "winner", "text"))
+    return entry
+
+
+def expand_summary(tree, node):
+    entry = {key: value for key, value in node.items() if key != "text"}
+    entry["summary"] = tree["texts"][node["text"]]
+    return entry
+
+
+def expand_tree(tree):
+    """The nested {game_id: {mode: {...}}} data of the tree format."""
+    data = {}
+    prefixes = {}
+
+    for game_id, game_data in tree["games"].items():
+        data[game_id] = {}
+        for mode, stored in game_data.items():
+            section = {}
+            for field, value in stored.items():
+                if field == "log" and not isinstance(value, list):
+                    section[field] = [dict(entry) for entry in expand_log(tree, value, prefixes)]
+                elif field == "vote":
+                    section[field] = [expand_vote(tree, node) for node in value]
+                elif field == "summary":
+                    section[field] = [expand_summary(tree, node) for node in value]
+                else:
+                    section[field] = value
+            data[game_id][mode] = section
+
+    return data
+
+
+"""Initialization of the conversion parameters"""
+convert_to = "tree"  # or "nested", to write the results back in the expanded format
+
+
+if __name__ == '__main__':
+
+
+    import utils
+
+    utils.result_format = convert_to
+    before = after = 0
+
+    for file_name in sorted(os.listdir(utils.result_dir)):
+        if not file_name.endswith("_result.json"):
+            continue
+        run_id = file_name[:-len("_result.json")]
+        size = os.path.getsize(utils.result_path(run_id))
+
+        data = utils.load_result_json(run_id)
+        if expand_tree(json.loads(json.dumps(build_tree(data)))) != data:
+            raise RuntimeError(f"{file_name} would not read back the same in the tree format")
+        utils.write_result_json(run_id, data)
+
+        before += size
+        after += os.path.getsize(utils.result_path(run_id))
+        print(f"{file_name:<24}{size:>12}{os.path.getsize(utils.result_path(run_id)):>12}")
+
+    print(f"{'total':<24}{before:>12}{after:>12}  ({after / before if before else 0:.1%})")
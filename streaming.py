@@ -0,0 +1,261 @@
+"""
+Streaming chat completions (agent_config.streaming).
+
+The answer is read token by token, which gives:
+    ttft              -- seconds until the first token, stored in the usage of every call
+    a max-token guard -- agent_config.max_completion_tokens is sent as max_tokens and also
+                         enforced on the stream, cutting runaway generations at temperature 2.0
+    early fields      -- for an output_schema with mafias and game_outcome (AgentVote,
+                         AgentConclude), a callback gets both as soon as they are complete,
+                         before the reason is written (see Agent.aupdate with early=True)
+
+A structured answer cut off by the guard or by a dropped connection is kept if its mafias
+and game_outcome are complete, with the reason written so far; so is the answer of a plain
+parse request cut off by max_tokens (salvage_completion).
+
+The streams are read into the same ParsedChatCompletion as beta.chat.completions.parse,
+with an extra ttft attribute.
+"""
+
+import json
+import re
+import time
+
+import pydantic
+from openai.types import CompletionUsage
+from openai.types.chat import ParsedChatCompletion, ParsedChatCompletionMessage, ParsedChoice
+
+import agent_config
+from resilience import RETRYABLE_ERRORS
+
+
+EARLY_FIELDS = ("mafias", "game_outcome")
+
+decoder = json.JSONDecoder()
+WHITESPACE = re.compile(r"\s*")
+KEY_PATTERNS = {key: re.compile(rf'(?<!\\)"{key}"\s*:') for key in EARLY_FIELDS}
+KEY_WINDOW = 32  # characters of the text already scanned searched again, for a key cut between chunks
+
+
+def response_format(schema):
+    """The json_schema response_format of a pydantic output schema."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema(), "strict": True},
+    }
+
+
+def request_options(schema=None, stream=False):
+    """Keyword arguments of chat.completions.create shared by the streaming and the plain requests."""
+    options = {}
+    if agent_config.max_completion_tokens:
+        options["max_tokens"] = agent_config.max_completion_tokens
+    if stream:
+        options.update(stream=True, stream_options={"include_usage": True})
+        if schema is not None:
+            options["response_format"] = response_format(schema)
+    return options
+
+
+def complete_fields(text, keys=EARLY_FIELDS):
+    """The values of keys in a partial JSON object once all of them are complete, else None."""
+    values = {}
+    for key in keys:
+        match = re.search(rf'(?<!\\)"{key}"\s*:\s*', text)
+        if match is None:
+            return None
+        try:
+            values[key], _ = decoder.raw_decode(text, match.end())
+        except ValueError:
+            return None
+    return values
+
+
+def partial_string(text):
+    """The value of a JSON string whose closing quote may be missing (text starts after the opening quote)."""
+    match = re.match(r'((?:[^"\\]|\\.)*)', text, re.DOTALL)
+    body = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', "", match.group(1))  # drop a cut escape sequence
+    try:
+        return json.loads(f'"{body}"')
+    except ValueError:
+        return body
+
+
+def salvage(schema, text):
+    """The answer of a cut-off structured stream, if every field but the reason is complete."""
+    if "reason" not in schema.model_fields:
+        return None
+
+    fields = complete_fields(text, [name for name in schema.model_fields if name != "reason"])
+    if fields is None:
+        return None
+
+    match = re.search(r'(?<!\\)"reason"\s*:\s*"', text)
+    try:
+        return schema(**fields, reason=partial_string(text[match.end():]) if match else "")
+    except pydantic.ValidationError:
+        return None
+
+
+class StreamReader:
+    """Collects the chunks of one streamed completion"""
+
+    def __init__(self, schema=None, on_fields=None):
+        self.schema = schema
+        self.on_fields = on_fields if schema is not None and set(EARLY_FIELDS) <= set(schema.model_fields) else None
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.content = ""
+        self.tokens = 0
+        self.finish_reason = None
+        self.usage = None
+        self.fields_sent = False
+        self.scanned = 0  # length of the content searched for the early fields so far
+        self.value_starts = {}  # early field -> position of its value in the content
+        self.early = {}  # early field -> its complete value
+
+    def add(self, chunk):
+        """Read one chunk; returns True once the max-token guard is reached."""
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return False
+
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        if not choice.delta.content:
+            return False
+
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+        self.content += choice.delta.content
+        self.tokens += 1  # the server sends about one token per chunk
+
+        if self.on_fields and not self.fields_sent:
+            self.send_fields()
+
+        guard = agent_config.max_completion_tokens
+        if guard and self.tokens >= guard and not self.finish_reason:
+            self.finish_reason = "length"
+            return True
+        return False
+
+    def send_fields(self):
+        """
+        Look for the early fields in the content added since the last chunk, and decode
+        only the values not complete yet, so a chunk costs no more than its own text.
+        """
+        for key in EARLY_FIELDS:
+            if key in self.early:
+                continue
+            if key not in self.value_starts:
+                match = KEY_PATTERNS[key].search(self.content, max(self.scanned - KEY_WINDOW, 0))
+                if match is None:
+                    continue
+                self.value_starts[key] = match.end()
+            try:
+                start = WHITESPACE.match(self.content, self.value_starts[key]).end()
+                self.early[key], _ = decoder.raw_decode(self.content, start)
+            except ValueError:
+                pass  # the value is not complete yet
+        self.scanned = len(self.content)
+
+        if len(self.early) < len(EARLY_FIELDS):
+            return
+        fields = {key: self.early[key] for key in EARLY_FIELDS}
+        try:
+            self.schema.model_validate({**fields, "reason": ""})
+        except pydantic.ValidationError:
+            self.on_fields = None  # left to the full answer
+            return
+        self.fields_sent = True
+        self.on_fields(fields)
+
+    def interrupted(self, error):
+        """Keep a stream that broke off after its early fields were sent, since they may already be recorded."""
+        if not self.fields_sent:
+            raise error
+        self.finish_reason = "length"
+
+    def completion(self):
+        """The ParsedChatCompletion of the stream, parsed into the schema if there is one."""
+        content = self.content
+        parsed = None
+        if self.schema is not None:
+            try:
+                parsed = self.schema.model_validate_json(content)
+            except pydantic.ValidationError:
+                parsed = salvage(self.schema, content) if self.finish_reason == "length" else None
+                if parsed is None:
+                    raise
+
+        usage = self.usage or CompletionUsage.model_construct(
+            prompt_tokens=None, completion_tokens=self.tokens, total_tokens=None)
+        return ParsedChatCompletion.model_construct(
+            id="",
+            object="chat.completion",
+            created=int(time.time()),
+            model="",
+            choices=[ParsedChoice.model_construct(
+                index=0,
+                finish_reason=self.finish_reason or "stop",
+                message=ParsedChatCompletionMessage.model_construct(role="assistant", content=content, parsed=parsed),
+            )],
+            usage=usage,
+            ttft=self.ttft,
+        )
+
+
+def salvage_completion(schema, completion):
+    """
+    The answer of a beta.chat.completions.parse request cut off by max_tokens, which the
+    openai SDK raises as openai.LengthFinishReasonError, kept as a cut-off stream would be.
+    """
+    reader = StreamReader(schema)
+    reader.content = completion.choices[0].message.content or ""
+    reader.finish_reason = "length"
+    reader.usage = completion.usage
+    return reader.completion()
+
+
+def stream(client, model, messages, temperature, schema=None, on_fields=None):
+    """
+    One streamed chat completion.
+
+    Args:
+        client: openai.OpenAI client of an endpoint.
+        schema: Optional pydantic output schema.
+        on_fields: Called with {"mafias", "game_outcome"} as soon as both are complete.
+
+    Returns:
+        ParsedChatCompletion: The answer, with ttft in seconds.
+    """
+    reader = StreamReader(schema, on_fields)
+    response = client.chat.completions.create(
+        model=model, messages=messages, temperature=temperature, **request_options(schema, stream=True))
+    try:
+        for chunk in response:
+            if reader.add(chunk):
+                break
+    except RETRYABLE_ERRORS as e:
+        reader.interrupted(e)
+    finally:
+        response.close()
+    return reader.completion()
+
+
+async def astream(client, model, messages, temperature, schema=None, on_fields=None):
+    """Asynchronous version of stream, with an openai.AsyncOpenAI client."""
+    reader = StreamReader(schema, on_fields)
+    response = await client.chat.completions.create(
+        model=model, messages=messages, temperature=temperature, **request_options(schema, stream=True))
+    try:
+        async for chunk in response:
+            if reader.add(chunk):
+                break
+    except RETRYABLE_ERRORS as e:
+        reader.interrupted(e)
+    finally:
+        await response.close()
+    return reader.completion()
@@ -0,0 +1,120 @@
+"""
+Per-stage tracing of the experiment pipeline.
+
+The engine gives every run a Tracer; stages, LLM calls, retries, queue waits and
+result-file I/O record spans into it through span() / instant(), and the run is
+exported as Chrome trace-event JSON to results/traces/{run_id}_trace.json
+(open it in chrome://tracing or https://ui.perfetto.dev). Every game gets its own lane.
+Without an active tracer, span() and instant() do nothing.
+"""
+
+import contextvars
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+current_tracer = contextvars.ContextVar("current_tracer", default=None)
+current_lane = contextvars.ContextVar("current_lane", default="run")
+
+
+class Tracer:
+    """Collects the trace events of one run"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lanes = {}
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def lane_id(self, lane):
+        """Chrome trace thread id of a lane (a game, or the run itself)."""
+        if lane not in self.lanes:
+            self.lanes[lane] = len(self.lanes) + 1
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": 0, "tid": self.lanes[lane],
+                "args": {"name": str(lane)},
+            })
+        return self.lanes[lane]
+
+    def timestamp(self, moment):
+        return (moment - self.origin) * 1e6  # microseconds
+
+    def complete(self, name, cat, start, end, args):
+        self.events.append({
+            "name": name, "cat": cat, "ph": "X", "pid": 0,
+            "tid": self.lane_id(current_lane.get()),
+            "ts": self.timestamp(start), "dur": (end - start) * 1e6,
+            "args": args,
+        })
+        self.totals[name] += end - start
+        self.counts[name] += 1
+
+    def instant(self, name, cat, args):
+        self.events.append({
+            "name": name, "cat": cat, "ph": "i", "s": "t", "pid": 0,
+            "tid": self.lane_id(current_lane.get()),
+            "ts": self.timestamp(time.perf_counter()),
+            "args": args,
+        })
+        self.counts[name] += 1
+
+    def summary(self):
+        """{span name: {"count": int, "seconds": float}}, sorted by total time."""
+        names = sorted(self.counts, key=lambda name: -self.totals.get(name, 0.0))
+        return {name: {"count": self.counts[name], "seconds": round(self.totals.get(name, 0.0), 3)} for name in names}
+
+    def export(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": self.events,
+                "displayTimeUnit": "ms",
+                "otherData": {"run_id": self.run_id, "summary": self.summary()},
+            }, f)
+
+
+@contextmanager
+def span(name, cat="stage", **args):
+    """
+    Record the duration of a block in the current run's trace.
+
+    Yields the args dict, so the block can attach more details (e.g. token counts).
+    """
+    tracer = current_tracer.get()
+    if tracer is None:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = repr(e)
+        raise
+    finally:
+        tracer.complete(name, cat, start, time.perf_counter(), args)
+
+
+def instant(name, cat="stage", **args):
+    """Record a point event in the current run's trace."""
+    tracer = current_tracer.get()
+    if tracer is not None:
+        tracer.instant(name, cat, args)
+
+
+def record_retry(retry_state):
+    """tenacity before_sleep callback: record a retried LLM call and the time waited for it."""
+    wait = retry_state.next_action.sleep if retry_state.next_action else 0.0
+    error = retry_state.outcome.exception() if retry_state.outcome else None
+
+    instant("retry", "llm", attempt=retry_state.attempt_number, wait_seconds=wait, error=repr(error))
+
+    tracer = current_tracer.get()
+    if tracer is not None:
+        tracer.totals["retry wait"] += wait
+        tracer.counts["retry wait"] += 1
@@ -0,0 +1,183 @@
+"""
+Token, latency and cost accounting of the experiment results.
+
+Every log, vote, summary and convergence entry produced by an LLM call carries the "usage" of that call
+(prompt_tokens, cached_tokens, completion_tokens, latency, attempts, retry_seconds,
+extra_requests, discarded_tokens, ttft, cached, call_id; see Agent.latest_usage).
+cached_tokens are the prompt tokens served from the server's prefix cache, extra_requests
+the duplicates and re-issues sent by hedging (the "hedge +" column, per live call),
+ttft the seconds to the first token of a streamed call. A statement shared by several
+runs (fan_out in its usage, see fan_out.py) carries its run's share of the tokens.
+With early stopping (convergence.py), the rounds used and LLM calls saved by the
+discussions are totalled as well.
+This module rolls them up per game and per run, and prints the token throughput and
+cost of each mode:
+    python usage_report.py
+
+An entry recorded in several modes (the shared statements, the single_agent vote)
+keeps the call_id of its one call: it counts towards every mode it belongs to,
+but only once in the run total.
+"""
+
+from utils import load_run_data, result_exists
+
+
+"""Initialization of the report parameters"""
+run_ids = range(0, 50)  # range(100, 130) for vote_only_test.py
+modes = ["multy_agents", "multy_agents_devil", "single_agent"]
+prompt_price_per_million = 0.9  # USD, reference price of a hosted 72B model
+completion_price_per_million = 0.9
+
+
+def new_totals():
+    return {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            "latency": 0.0, "attempts": 0, "retry_seconds": 0.0, "extra_requests": 0, "discarded_tokens": 0,
+            "streamed_calls": 0, "ttft": 0.0}
+
+
+def add_usage(totals, usage):
+    totals["calls"] += 1
+    totals["cached_calls"] += 1 if usage.get("cached") else 0
+    totals["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    totals["cached_tokens"] += usage.get("cached_tokens") or 0
+    totals["completion_tokens"] += usage.get("completion_tokens") or 0
+    totals["latency"] += usage.get("latency") or 0.0
+    totals["attempts"] += usage.get("attempts") or 0
+    totals["retry_seconds"] += usage.get("retry_seconds") or 0.0
+    totals["extra_requests"] += usage.get("extra_requests") or 0
+    totals["discarded_tokens"] += usage.get("discarded_tokens") or 0
+    if usage.get("ttft") is not None:
+        totals["streamed_calls"] += 1
+        totals["ttft"] += usage["ttft"]
+
+
+def merge_totals(totals, other):
+    for name, value in other.items():
+        totals[name] += value
+
+
+def new_early_stop():
+    return {"discussions": 0, "stopped": 0, "rounds": 0, "rounds_used": 0, "calls_saved": 0}
+
+
+def section_usages(section):
+    """Yield the usage of every log, vote, summary and convergence entry of one mode of a game."""
+    for field in ("log", "vote", "summary", "convergence"):
+        for entry in section.get(field, []):
+            if entry.get("usage"):
+                yield entry["usage"]
+
+
+def game_usage(game_data):
+    """
+    Roll up the usage of one stored game ({mode: {...}}).
+
+    Returns:
+        dict: {mode: totals, ..., "total": totals over the distinct calls of the game}
+    """
+    rollup = {"total": new_totals()}
+    seen = set()
+
+    for mode, section in game_data.items():
+        if not isinstance(section, dict):
+            continue
+        rollup[mode] = new_totals()
+
+        for usage in section_usages(section):
+            add_usage(rollup[mode], usage)
+            if usage.get("call_id") not in seen:
+                seen.add(usage.get("call_id"))
+                add_usage(rollup["total"], usage)
+
+    return rollup
+
+
+def run_usage(run_id, store=None):
+    """
+    Roll up the usage of one run.
+
+    Returns:
+        dict: {"games": {game_id: game rollup}, "modes": {mode: totals}, "total": totals,
+               "early_stop": rounds used and calls saved by the discussions}
+    """
+    data = load_run_data(run_id, store)
+    rollup = {"games": {}, "modes": {}, "total": new_totals(), "early_stop": new_early_stop()}
+
+    for game_id, game_data in data.items():
+        game = game_usage(game_data)
+        rollup["games"][game_id] = game
+
+        for section in game_data.values():
+            stop = section.get("early_stop") if isinstance(section, dict) else None
+            if stop:
+                merge_totals(rollup["early_stop"], {
+                    "discussions": 1,
+                    "stopped": 1 if stop["rounds_used"] < stop["rounds"] else 0,
+                    "rounds": stop["rounds"],
+                    "rounds_used": stop["rounds_used"],
+                    "calls_saved": stop["calls_saved"],
+                })
+
+        for mode, totals in game.items():
+            if mode == "total":
+                merge_totals(rollup["total"], totals)
+            else:
+                merge_totals(rollup["modes"].setdefault(mode, new_totals()), totals)
+
+    return rollup
+
+
+def cost(totals):
+    """Cost in USD of the prompt and completion tokens of a rollup."""
+    return (totals["prompt_tokens"] * prompt_price_per_million
+            + totals["completion_tokens"] * completion_price_per_million) / 1e6
+
+
+def print_summary(rollups):
+    """Print tokens, throughput and cost per mode over several runs ({run_id: run_usage})."""
+    games = sum(len(rollup["games"]) for rollup in rollups.values())
+    by_mode = {}
+    total = new_totals()
+    for rollup in rollups.values():
+        for mode, totals in rollup["modes"].items():
+            merge_totals(by_mode.setdefault(mode, new_totals()), totals)
+        merge_totals(total, rollup["total"])
+
+    print(f"{len(rollups)} runs, {games} games")
+    header = f'{"mode":<20}{"calls":>8}{"cached":>8}{"retries":>8}{"retry s":>9}{"hedge +":>8}{"prompt tok":>12}{"prefix hit":>11}{"compl. tok":>12}{"tok/game":>10}{"tok/s":>9}{"s/call":>8}{"ttft":>7}{"USD":>9}'
+    print(header)
+    print("-" * len(header))
+
+    ordered = [mode for mode in modes if mode in by_mode] + [mode for mode in by_mode if mode not in modes]
+    for name, totals in [(mode, by_mode[mode]) for mode in ordered] + [("total (distinct)", total)]:
+        tokens = totals["prompt_tokens"] + totals["completion_tokens"]
+        live_calls = totals["calls"] - totals["cached_calls"]
+        print(
+            f'{name:<20}{totals["calls"]:>8}{totals["cached_calls"]:>8}{totals["attempts"] - live_calls:>8}'
+            f'{totals["retry_seconds"]:>9.1f}'
+            f'{totals["extra_requests"] / live_calls if live_calls else 0:>8.1%}'
+            f'{totals["prompt_tokens"]:>12}'
+            f'{totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0:>11.1%}'
+            f'{totals["completion_tokens"]:>12}'
+            f'{tokens / games if games else 0:>10.0f}'
+            f'{tokens / totals["latency"] if totals["latency"] else 0:>9.0f}'
+            f'{totals["latency"] / live_calls if live_calls else 0:>8.2f}'
+            f'{totals["ttft"] / totals["streamed_calls"] if totals["streamed_calls"] else 0:>7.2f}'
+            f'{cost(totals):>9.2f}'
+        )
+
+    early_stop = new_early_stop()
+    for rollup in rollups.values():
+        merge_totals(early_stop, rollup.get("early_stop", new_early_stop()))
+    if early_stop["discussions"]:
+        print(
+            f'early stopping: {early_stop["stopped"]} of {early_stop["discussions"]} discussions stopped, '
+            f'{early_stop["rounds_used"]} of {early_stop["rounds"]} rounds used, {early_stop["calls_saved"]} LLM calls saved'
+        )
+
+
+if __name__ == '__main__':
+
+
+    rollups = {run_id: run_usage(run_id) for run_id in run_ids if result_exists(run_id)}
+    print_summary(rollups)
@@ -3,27 +3,41 @@ A collection of helper tools for preprocessing inputs and postprocessing outputs
 to support more effective interaction with large language models (LLMs).
 """
 
-import ast
 import json
-import openai
 import os
 import re
 from agent_config import load_prompt, prompt_dir
+from endpoint_pool import get_pool
 from collections import Counter
+from result_tree import build_tree, expand_tree, is_tree
+from vote_parsing import extract_mafia_vote, extract_outcome_vote
+from result_records import RESULT_FIELDS, _new_game_entry, apply_result_entry, make_result_record
+import result_db
 
 
+"""Directory holding results/{run_id}_result.json and its append-only journal"""
+result_dir = "results"
+result_format = "nested"  # "nested": as read; "tree": texts and shared transcript prefixes stored once (see result_tree.py)
+result_backend = "json"  # "json": one file and journal per run; "sqlite": results/results.sqlite, indexed per game and mode (see result_db.py)
 
-def check_prediction_discrepancy(run_id, game_id):
+"""Result-file I/O counters, read by benchmark.py"""
+io_stats = Counter()
+
+
+def result_path(run_id, directory=None):
+    return os.path.join(directory or result_dir, f"{run_id}_result.json")
+
+
+def journal_path(run_id, directory=None):
+    return os.path.join(directory or result_dir, f"{run_id}_result.jsonl")
+
+
+def check_prediction_discrepancy(run_id, game_id, store=None):
     """
     Briefly check whether the pred from multy_agents or multy_agents_devil differs from that of single_agent.
     If there is a mismatch, print the game_id and the type of difference.
     """
-    filename = os.path.join("results", f"{run_id}_result.json")
-
-    with open(filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    game_data = data.get(game_id, {})
+    game_data = load_game_data(run_id, game_id, store)
 
     pred_single = game_data.get("single_agent", {}).get("pred", {})
     pred_multy = game_data.get("multy_agents", {}).get("pred", {})
@@ -36,7 +50,7 @@ def check_prediction_discrepancy(run_id, game_id):
         print(f"{game_id}: multy_agents_devil differs from single_agent")
 
 
-def majority_mafia_vote(run_id, game_id, mode="multy_agents"):
+def majority_mafia_vote(run_id, game_id, mode="multy_agents", store=None):
     """
     From the 'mafia' field in each vote entry, count and return the two most frequently
     predicted mafia members.
@@ -44,10 +58,7 @@ def majority_mafia_vote(run_id, game_id, mode="multy_agents"):
     Returns:
         List[str]: Names of the top 2 mafia suspects.
     """
-    with open(f"results/{run_id}_result.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    votes = data.get(game_id, {}).get(mode, {}).get("vote", [])
+    votes = load_game_data(run_id, game_id, store).get(mode, {}).get("vote", [])
 
     mafia_counter = Counter()
 
@@ -64,7 +75,7 @@ def majority_mafia_vote(run_id, game_id, mode="multy_agents"):
     return top_mafias
 
 
-def majority_winner_vote(run_id, game_id, mode="multy_agents"):
+def majority_winner_vote(run_id, game_id, mode="multy_agents", store=None):
     """
     From the 'winner' field in each vote entry, determine the most commonly predicted
     winning group (e.g., 'mafia' or 'bystander').
@@ -72,10 +83,7 @@ def majority_winner_vote(run_id, game_id, mode="multy_agents"):
     Returns:
         List[str]: A single-element list containing the most voted winner.
     """
-    with open(f"results/{run_id}_result.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    votes = data.get(game_id, {}).get(mode, {}).get("vote", [])
+    votes = load_game_data(run_id, game_id, store).get(mode, {}).get("vote", [])
 
     winner_counter = Counter()
 
@@ -91,52 +99,44 @@ def majority_winner_vote(run_id, game_id, mode="multy_agents"):
     return top_winner
 
 
-def extract_mafia_vote(text):
-    """
-    Extract the list of mafias from the structured text.
-    The return value should be a list in the form [mafia1, mafia2, ...], or None if extraction fails.
-    """
-    try:
-
-        text = text.replace('\n', ' ').replace('\\n', ' ')
-
-
-        mafias_match = re.search(r"mafias\s*=\s*(\[[^\]]+\])", text)
-
-        if mafias_match:
-            mafias_str = mafias_match.group(1)
-            mafias = ast.literal_eval(mafias_str)
-            if isinstance(mafias, list):
-
-                return [name.strip() for name in mafias]
-    except Exception as e:
-        print("Fail:", e)
-
-    return None
+def vote_entry(speaker, opinion, usage=None):
+    """Build the vote entry saved for an agent's structured opinion (usage: Agent.latest_usage of the call)."""
+    entry = {
+        "speaker": speaker,
+        "mafias": extract_mafia_vote(opinion),
+        "winner": extract_outcome_vote(opinion),
+        "reason": opinion,
+    }
+    if usage:
+        entry["usage"] = usage
+    return entry
 
 
-def extract_outcome_vote(text):
+def partial_vote_entry(speaker, opinion):
     """
-    Extract the game_outcome from the structured text.
-    The return value should be a string such as 'mafia' or 'villager', or None if extraction fails.
+    Build the vote entry of an answer whose mafias and game_outcome were streamed before its
+    reason (Agent.aupdate with early=True). The reason follows as a "vote_reason" record,
+    which completes the entry when the result is loaded.
     """
-    try:
-
-        text = text.replace('\n', ' ').replace('\\n', ' ')
-
+    entry = vote_entry(speaker, opinion)
+    entry["partial"] = True
+    return entry
 
-        outcome_match = re.search(r"game_outcome\s*=\s*'([^']+)'", text)
 
-        if outcome_match:
-            return outcome_match.group(1).strip()
-    except Exception as e:
-        print("Fail:", e)
+def vote_reason_entry(speaker, opinion, usage=None):
+    """Build the "vote_reason" record completing the partial vote of a speaker."""
+    return {"speaker": speaker, "reason": opinion, "usage": usage}
 
-    return None
 
+def log_entry(speaker, opinion, usage=None):
+    """Build the log entry saved for an agent's statement or discussion turn."""
+    entry = {"speaker": speaker, "message": opinion}
+    if usage:
+        entry["usage"] = usage
+    return entry
 
 
-def score_mafias(run_id, game_id, mode="multy_agents"):
+def score_mafias(run_id, game_id, mode="multy_agents", store=None):
     """
     Compares mafia names against the true mafias.
     Each correct match scores 1 point, with a maximum of 2 points.
@@ -145,21 +145,17 @@ def score_mafias(run_id, game_id, mode="multy_agents"):
         run_id (int): run_id
         game_id (str): game_id
         mode (str): 'multy_agents' or 'single_agent'
+        store (ResultStore): optional in-memory store of the run
 
     Returns:
         int: Mafia prediction score (0–2)
     """
-    file_path = f"results/{str(run_id)}_result.json"
-
-    if not os.path.exists(file_path):
-        print(f"[Error] File not found: {file_path}")
+    if store is None and not result_exists(run_id):
+        print(f"[Error] File not found: {result_location(run_id)}")
         return 0
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        game_data = data.get(game_id, {})
+        game_data = load_game_data(run_id, game_id, store)
         pred_mafias = game_data.get(mode, {}).get("pred", {}).get("mafias", [])
         true_mafias = game_data.get(mode, {}).get("true", {}).get("true mafias", [])
 
@@ -175,7 +171,7 @@ def score_mafias(run_id, game_id, mode="multy_agents"):
         return 0
 
 
-def score_winner(run_id, game_id, mode="multy_agents"):
+def score_winner(run_id, game_id, mode="multy_agents", store=None):
     """
     Compares won group between prediction and truth.
     Returns 1 point if correct, 0 wrong.
@@ -184,21 +180,17 @@ def score_winner(run_id, game_id, mode="multy_agents"):
         run_id (int): run_id
         game_id (str): game_id
         mode (str): 'multy_agents' or 'single_agent'
+        store (ResultStore): optional in-memory store of the run
 
     Returns:
         int: Game outcome prediction score (0–1)
     """
-    file_path = f"results/{str(run_id)}_result.json"
-
-    if not os.path.exists(file_path):
-        print(f"[Error] File not found: {file_path}")
+    if store is None and not result_exists(run_id):
+        print(f"[Error] File not found: {result_location(run_id)}")
         return 0
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        game_data = data.get(game_id, {})
+        game_data = load_game_data(run_id, game_id, store)
         pred_winner = game_data.get(mode, {}).get("pred", {}).get("winner", None)
         true_winner = game_data.get(mode, {}).get("true", {}).get("true winner", None)
 
@@ -213,77 +205,196 @@ def score_winner(run_id, game_id, mode="multy_agents"):
         return 0
 
 
-def save_result_json(run_id, mode, field, entry, game_id="unknown_game"):
+def load_result_json(run_id, directory=None):
     """
-    Save content to a specific field in a JSON file.
+    Load the current nested view of a run: the compacted JSON file plus every
+    record appended to the journal since the last compaction (or its rows of
+    results.sqlite when result_backend is "sqlite").
 
     Args:
         run_id: Identifier used in the filename.
-        mode: Either "multy_agents" or "single_agent".
-        entry: The data to be saved (type depends on the field).
-        field: The field name to save into (e.g., "log", "pred", "true_mafias", "score_now", "result_part", "vote").
-        game_id: The current game ID (used as the top-level key in the JSON file).
+        directory: Directory to read from instead of result_dir (e.g. a campaign shard).
+
+    Returns:
+        dict: {game_id: {mode: {...}}}, empty if nothing has been saved yet.
     """
+    if result_backend == "sqlite":
+        io_stats["db_queries"] += 1
+        return result_db.load_run(run_id, directory or result_dir)
+    return read_result_files(run_id, directory)
+
 
-    os.makedirs("results", exist_ok=True)
-    filename = os.path.join("results", f"{run_id}_result.json")
+def read_result_files(run_id, directory=None):
+    """The nested data of the JSON result file and journal of a run."""
+    filename = result_path(run_id, directory)
+    journal = journal_path(run_id, directory)
 
-    # Load data
     if os.path.exists(filename):
         with open(filename, "r", encoding="utf-8") as f:
             data = json.load(f)
+        if is_tree(data):
+            data = expand_tree(data)
+        io_stats["json_parses"] += 1
+        io_stats["bytes_read"] += os.path.getsize(filename)
     else:
         data = {}
 
-    # Initialize the structure for this game_id
-    if game_id not in data:
-        data[game_id] = {
-            "multy_agents": {
-                "log": [],
-                "vote": [],
-                "pred": {},
-                "true": {},
-                "score_mafias": 0,
-                "score_winner": 0
-            },
-            "multy_agents_devil": {
-                "log": [],
-                "vote": [],
-                "pred": {},
-                "true": {},
-                "score_mafias": 0,
-                "score_winner": 0
-            },
-            "single_agent": {
-                "vote": [],
-                "pred": {},
-                "true": {},
-                "score_mafias": 0,
-                "score_winner": 0
-            }
-        }
-
-    # Write data to the specified field
-    section = data[game_id][mode]
-
-    if field in ["log", "vote"]:
-        if not isinstance(section.get(field), list):
-            section[field] = []
-        section[field].append(entry)
-
-    elif field in ["pred", "true"]:
-        if not isinstance(section.get(field), dict):
-            section[field] = {}
-        section[field] = entry
-
-    elif field in ["score_mafias", "score_winner"]:
-        section[field] = int(entry)
+    if os.path.exists(journal):
+        io_stats["bytes_read"] += os.path.getsize(journal)
+        with open(journal, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                io_stats["journal_records_read"] += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A killed process can leave a truncated last line behind
+                    print(f"[Warning] Skipping corrupt journal line {line_no} in {journal}")
+                    continue
+                apply_result_entry(data, record["mode"], record["field"], record["entry"], record["game_id"])
+
+    return data
+
+
+def compact_result_json(run_id, game_order=None):
+    """
+    Fold the journal of a run into results/{run_id}_result.json and remove the journal.
+    With the sqlite backend the records are already in place, and only the games are put in order.
 
-    else:
-        raise ValueError(f"Unsupported field: {field}")
-    # Save back to file
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    Args:
+        run_id: Identifier used in the filename.
+        game_order: Optional list of game IDs; games finished out of order
+            (e.g. when played concurrently) are written back in this order.
+
+    Returns:
+        dict: The compacted {game_id: {mode: {...}}} data.
+    """
+    if result_backend == "sqlite":
+        if game_order is not None:
+            result_db.order_games(run_id, game_order, result_dir)
+        return load_result_json(run_id)
+
+    data = load_result_json(run_id)
+    journal = journal_path(run_id)
+
+    if not os.path.exists(journal):
+        return data
+
+    if game_order is not None:
+        rank = {game_id: i for i, game_id in enumerate(game_order)}
+        data = dict(sorted(data.items(), key=lambda item: rank.get(item[0], len(rank))))
+
+    write_result_json(run_id, data)
+    os.remove(journal)
+
+    return data
+
+
+def write_result_json(run_id, data):
+    """
+    Atomically replace results/{run_id}_result.json with the given nested data,
+    stored in the result_format (load_result_json reads both), or the rows of the
+    run in results.sqlite with the sqlite backend.
+    """
+    if result_backend == "sqlite":
+        io_stats["db_writes"] += 1
+        result_db.replace_run(run_id, data, result_dir)
+        return
+    write_result_file(run_id, data)
+
+
+def write_result_file(run_id, data, directory=None):
+    """Atomically replace the JSON result file of a run."""
+    os.makedirs(directory or result_dir, exist_ok=True)
+
+    filename = result_path(run_id, directory)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        if result_format == "tree":
+            json.dump(build_tree(data), f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_filename, filename)
+
+    io_stats["bytes_written"] += os.path.getsize(filename)
+
+
+def load_run_data(run_id, store=None):
+    """Return the nested data of a run, from the ResultStore when one is given."""
+    if store is not None:
+        return store.data
+    return load_result_json(run_id)
+
+
+def load_game_data(run_id, game_id, store=None):
+    """
+    Return the {mode: {...}} data of one game of a run, from the ResultStore when one is
+    given. The sqlite backend reads only the rows of that game.
+    """
+    if store is None and result_backend == "sqlite":
+        io_stats["db_queries"] += 1
+        return result_db.load_game(run_id, game_id, result_dir)
+    return load_run_data(run_id, store).get(game_id, {})
+
+
+def result_location(run_id):
+    return result_db.db_path(result_dir) if result_backend == "sqlite" else result_path(run_id)
+
+
+def result_exists(run_id):
+    """Whether anything has been saved for run_id, compacted or not."""
+    if result_backend == "sqlite":
+        return result_db.run_exists(run_id, result_dir)
+    return os.path.exists(result_path(run_id)) or os.path.exists(journal_path(run_id))
+
+
+def append_result_journal(run_id, records):
+    """
+    Append save_result_json records to results/{run_id}_result.jsonl in one write,
+    or insert them into results.sqlite in one transaction with the sqlite backend.
+    """
+    if not records:
+        return
+
+    if result_backend == "sqlite":
+        result_db.save_records(run_id, records, result_dir)
+        io_stats["db_records_written"] += len(records)
+        return
+
+    os.makedirs(result_dir, exist_ok=True)
+
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    with open(journal_path(run_id), "a", encoding="utf-8") as f:
+        f.write(lines)
+
+    io_stats["bytes_written"] += len(lines.encode("utf-8"))
+    io_stats["journal_records_written"] += len(records)
+
+
+def save_result_json(run_id, mode, field, entry, game_id="unknown_game", store=None):
+    """
+    Save content to a specific field of a run.
+
+    The record is appended to results/{run_id}_result.jsonl; compact_result_json
+    folds the journal back into results/{run_id}_result.json. With the sqlite backend
+    it is inserted into results/results.sqlite instead.
+    If a ResultStore is given, the record is kept in memory until store.flush().
+
+    Args:
+        run_id: Identifier used in the filename.
+        mode: Either "multy_agents" or "single_agent".
+        entry: The data to be saved (type depends on the field).
+        field: The field name to save into (e.g., "log", "pred", "true_mafias", "score_now", "result_part", "vote").
+        game_id: The current game ID (used as the top-level key in the JSON file).
+        store: Optional ResultStore of this run.
+    """
+
+    if store is not None:
+        store.save(mode, field, entry, game_id=game_id)
+        return
+
+    append_result_journal(run_id, [make_result_record(mode, field, entry, game_id)])
 
 
 """
@@ -301,19 +412,15 @@ def format_opinion(opinion: str) -> str:
 def conclude(opinion: list[str]) ->[str]:
     """Summarizing dialogue results (.txt format) by LLM **Discarded**"""
 
-    llm_client = openai.OpenAI(
-        base_url="https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1",
-        api_key="EMPTY"
-    )
-
-    completion = llm_client.chat.completions.create(
-        model= "Qwen/Qwen2.5-72B-Instruct",
-        messages=[
-            {"role": "system", "content": [{"type": "text", "text": load_prompt(prompt_dir, "agent_conclude.txt")}]},
-            {"role": "user", "content": [{"type": "text", "text": "\n".join(opinion)}]},
-        ],
-        temperature=0.0,
-    )
+    with get_pool().request() as endpoint:
+        completion = endpoint.client.chat.completions.create(
+            model= "Qwen/Qwen2.5-72B-Instruct",
+            messages=[
+                {"role": "system", "content": [{"type": "text", "text": load_prompt(prompt_dir, "agent_conclude.txt")}]},
+                {"role": "user", "content": [{"type": "text", "text": "\n".join(opinion)}]},
+            ],
+            temperature=0.0,
+        )
 
     conclusion = completion.choices[0].message.content
     return (conclusion)
@@ -322,20 +429,12 @@ def conclude(opinion: list[str]) ->[str]:
 def conclude_from_log(run_id, game_id, mode = "multy_agents"):
     """Summarizing dialogue results (.json format) by LLM **Discarded**"""
 
-    llm_client = openai.OpenAI(
-        base_url="https://tulip.kuee.kyoto-u.ac.jp/LlamaServer_saffron7/v1",
-        api_key="EMPTY"
-    )
-
-    file_path = f"results/{run_id}_result.json"
-
-    if not os.path.exists(file_path):
-        print(f"[Error] File not found: {file_path}")
+    if not result_exists(run_id):
+        print(f"[Error] File not found: {result_location(run_id)}")
         return ""
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = load_result_json(run_id)
 
         game_data = data.get(game_id, {})
         log_entries = game_data.get(mode, {}).get("log", [])
@@ -347,20 +446,21 @@ def conclude_from_log(run_id, game_id, mode = "multy_agents"):
 
         full_log = "\n".join(log_texts)
 
-        completion = llm_client.chat.completions.create(
-            model="Qwen/Qwen2.5-72B-Instruct",
-            messages=[
-                {
-                    "role": "system",
-                    "content": [{"type": "text", "text": load_prompt(prompt_dir, "agent_conclude.txt")}],
-                },
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": full_log}],
-                },
-            ],
-            temperature=0.0,
-        )
+        with get_pool().request(affinity=game_id) as endpoint:
+            completion = endpoint.client.chat.completions.create(
+                model="Qwen/Qwen2.5-72B-Instruct",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": [{"type": "text", "text": load_prompt(prompt_dir, "agent_conclude.txt")}],
+                    },
+                    {
+                        "role": "user",
+                        "content": [{"type": "text", "text": full_log}],
+                    },
+                ],
+                temperature=0.0,
+            )
 
         return completion.choices[0].message.content.strip()
 
@@ -0,0 +1,51 @@
+"""
+Parsing of the structured answers of the agents (mafias=[...], game_outcome='...'),
+shared by utils.py and result_tree.py without importing either.
+"""
+
+import ast
+import re
+
+
+def extract_mafia_vote(text):
+    """
+    Extract the list of mafias from the structured text.
+    The return value should be a list in the form [mafia1, mafia2, ...], or None if extraction fails.
+    """
+    try:
+
+        text = text.replace('\n', ' ').replace('\\n', ' ')
+
+
+        mafias_match = re.search(r"mafias\s*=\s*(\[[^\]]+\])", text)
+
+        if mafias_match:
+            mafias_str = mafias_match.group(1)
+            mafias = ast.literal_eval(mafias_str)
+            if isinstance(mafias, list):
+
+                return [name.strip() for name in mafias]
+    except Exception as e:
+        print("Fail:", e)
+
+    return None
+
+
+def extract_outcome_vote(text):
+    """
+    Extract the game_outcome from the structured text.
+    The return value should be a string such as 'mafia' or 'villager', or None if extraction fails.
+    """
+    try:
+
+        text = text.replace('\n', ' ').replace('\\n', ' ')
+
+
+        outcome_match = re.search(r"game_outcome\s*=\s*'([^']+)'", text)
+
+        if outcome_match:
+            return outcome_match.group(1).strip()
+    except Exception as e:
+        print("Fail:", e)
+
+    return None